@@ -0,0 +1,75 @@
+"""
+Micro-benchmark for the list-endpoint serialization paths (no database needed).
+
+    cd backend && python benchmarks/serialization_bench.py [items] [repeats]
+
+"standard" is what FastAPI does for `response_model=List[ProductResponse]` when an endpoint returns
+ORM objects: validate with from_attributes, dump to Python primitives, then json.dumps.
+"fast" is shared.serialization.json_response on column rows: one validation, JSON written by pydantic-core.
+"""
+import json
+import sys
+import timeit
+from collections import namedtuple
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1])) # backend/, so "shared" is importable
+
+import orjson # type: ignore
+from pydantic import TypeAdapter # type: ignore
+
+from shared.models import Product
+from shared.schemas import ProductResponse
+from shared.serialization import json_response
+
+COLUMNS = ("id", "name", "description", "price", "stock_quantity", "image_url", "created_at", "updated_at")
+ProductRow = namedtuple("ProductRow", COLUMNS) # Stand-in for a SQLAlchemy Row from select(*columns)
+
+def make_data(items: int):
+    now = datetime.now(timezone.utc)
+    values = [
+        (i, f"Product {i}", "A reasonably long product description " * 3, Decimal("19.99"), i % 50,
+         f"https://cdn.example.com/{i}.jpg", now, now)
+        for i in range(1, items + 1)
+    ]
+    orm_objects = [Product(**dict(zip(COLUMNS, row))) for row in values]
+    rows = [ProductRow(*row) for row in values]
+    return orm_objects, rows
+
+adapter = TypeAdapter(List[ProductResponse])
+
+def standard(orm_objects) -> bytes:
+    validated = adapter.validate_python(orm_objects, from_attributes=True)
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def standard_orjson(orm_objects) -> bytes:
+    # Same, with the ORJSONResponse default response class
+    validated = adapter.validate_python(orm_objects, from_attributes=True)
+    return orjson.dumps(adapter.dump_python(validated, mode="json"))
+
+def fast(rows) -> bytes:
+    return json_response(adapter, rows).body
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    orm_objects, rows = make_data(items)
+    assert standard(orm_objects) == fast(rows), "fast path output differs from the standard path"
+
+    print(f"{items} products per response, best of 5 x {repeats} runs")
+    baseline = None
+    for name, func, data in (
+        ("standard (ORM + response_model + json)", standard, orm_objects),
+        ("standard + orjson response class", standard_orjson, orm_objects),
+        ("fast (rows + TypeAdapter.dump_json)", fast, rows),
+    ):
+        per_call = min(timeit.repeat(lambda: func(data), number=repeats, repeat=5)) / repeats
+        baseline = baseline or per_call
+        print(f"  {name:<42} {per_call * 1e6:9.1f} us/response  {baseline / per_call:5.2f}x")
+
+if __name__ == "__main__":
+    main()
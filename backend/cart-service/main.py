@@ -1,212 +1,349 @@
-from fastapi import FastAPI, Depends, HTTPException, status # type: ignore
+from typing import Dict, List, Optional
+from fastapi import FastAPI, Depends, HTTPException, Response, status # type: ignore
+from pydantic import TypeAdapter # type: ignore
 from sqlalchemy.ext.asyncio import AsyncSession # type: ignore # Import AsyncSession
 from sqlalchemy.orm import relationship, joinedload # type: ignore # relationship needed for eager loading, joinedload for eager loading in queries
 from sqlalchemy.sql import func # type: ignore
-from sqlalchemy import select # type: ignore # Import select for async ORM queries
+from sqlalchemy import select, update, delete, literal, union_all, Integer # type: ignore # Import select for async ORM queries
+from sqlalchemy.dialects.postgresql import insert as pg_insert # type: ignore # INSERT ... ON CONFLICT
 from prometheus_fastapi_instrumentator import Instrumentator # type: ignore
 
 # Import shared components
-from shared.database import get_db, Base, get_engine # get_db is now async
-from shared.models import Cart, CartItem, Product, User
-from shared.schemas import CartItemBase, CartResponse
-from shared.security import get_current_user
+from shared.database import get_session, get_engine, dispose_engines, get_read_session, read_router, ReadYourWritesMiddleware # get_session is now async
+from shared.migrate import check_schema_version
+from shared.query_metrics import install_query_metrics
+from shared.serialization import DefaultResponse, render
+from shared.debug import debug_router
+from shared.health import health_router, start_warm_up, stop_warm_up
+from shared.models import Cart, CartItem, Product
+from shared.schemas import CartItemBase, CartResponse, CartItemBatch, CartItemBatchError, CartBatchResponse
+from shared.security import get_current_user, UserPrincipal, listen_for_principal_changes
+from shared.notifications import PostgresListener
 from shared.config import DATABASE_URL
 
 app = FastAPI(
     title="Cart Service",
     description="Manages user shopping carts.",
     version="1.0.0",
-    root_path="/cart" # This is important for the Nginx proxy routing
+    root_path="/cart", # This is important for the Nginx proxy routing
+    default_response_class=DefaultResponse, # orjson encoding
 )
 
 # --- PROMETHEUS INSTRUMENTATION START ---
 # Initialize Prometheus instrumentation on startup
 # This automatically exposes the /metrics endpoint
 Instrumentator().instrument(app).expose(app)
+install_query_metrics(app) # Per-route SQL statement counts and DB time, plus N+1 warnings
+app.add_middleware(ReadYourWritesMiddleware) # Keeps a client's reads on the primary right after it writes
 print("Prometheus metrics exposed at /metrics")
 # --- PROMETHEUS INSTRUMENTATION END ---
 
+# Operator-only /debug endpoints (slow queries, profiler); disabled unless DEBUG_ENDPOINTS_TOKEN is set
+app.include_router(debug_router)
+
+# Liveness (/health) and readiness (/ready) probes
+app.include_router(health_router)
+
+# Dedicated LISTEN connection that evicts cached principals when any service changes a user
+notification_listener = PostgresListener(DATABASE_URL)
+listen_for_principal_changes(notification_listener)
+
 # Custom dependency for the cart service's asynchronous database connection
-async def get_cart_db():
-    # Await the asynchronous get_db from shared.database
-    async for session in get_db(DATABASE_URL):
-        yield session
+async def get_cart_db(session: AsyncSession = Depends(get_session)):
+    # Same request-scoped session that get_current_user resolves, so a request uses one pooled connection
+    yield session
 
 # Use FastAPI's lifespan events for startup/shutdown (replaces deprecated on_event)
 @app.on_event("startup") # Deprecated, but keeping for now as it's in your original structure
 async def startup_event():
+    # The listener reconnects on its own, so it starts straight away
+    notification_listener.start()
+    # Measures replica lag (DATABASE_READ_URLS); reads use the primary until a replica is known to be current
+    read_router.start()
+    # Connect and check the schema in the background; /ready reports 200 once this has succeeded
+    start_warm_up(warm_up)
+
+async def warm_up():
     # Ensure the engine is created asynchronously
     engine = await get_engine(DATABASE_URL)
-    # You might want to run Base.metadata.create_all here for application startup,
-    # but ensure it's done with an async connection.
-    # For production, migrations (e.g., Alembic) are preferred over create_all on startup.
-    async with engine.begin() as conn:
-        # This creates tables if they don_t exist. For production, use Alembic migrations.
-        await conn.run_sync(Base.metadata.create_all)
-    print("Cart service database tables checked/created.")
+    # The schema is owned by the migrations (python -m shared.migrate); only check it is current
+    await check_schema_version(engine)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_warm_up() # Report not ready first so traffic drains away
+    await read_router.stop()
+    await notification_listener.stop()
+    # Release the shared connection pool so Postgres sees clean disconnects
+    await dispose_engines()
 
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
+cart_adapter = TypeAdapter(CartResponse)
+
+def _select_cart_rows():
+    # The cart and its items as plain column rows (one row per item, or one empty row)
+    return (
+        select(
+            Cart.id, Cart.user_id, Cart.created_at, Cart.updated_at,
+            CartItem.id.label("item_id"), CartItem.product_id, CartItem.quantity, CartItem.price_at_add,
+            CartItem.created_at.label("item_created_at"),
+        )
+        .outerjoin(CartItem, CartItem.cart_id == Cart.id)
+        .order_by(CartItem.id)
+    )
+
+def _cart_from_rows(rows) -> dict:
+    # Rows of cart columns plus item_* columns, one per item (or one with item_id NULL for an empty cart)
+    return {
+        "id": rows[0].id,
+        "user_id": rows[0].user_id,
+        "created_at": rows[0].created_at,
+        "updated_at": rows[0].updated_at,
+        "items": [
+            {
+                "id": row.item_id,
+                "product_id": row.product_id,
+                "quantity": row.quantity,
+                "price_at_add": row.price_at_add,
+                "created_at": row.item_created_at,
+            }
+            for row in rows if row.item_id is not None
+        ],
+    }
 
 @app.get("/", response_model=CartResponse)
 async def get_user_cart(
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_cart_db) # Type hint with AsyncSession
+    response: Response,
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_session) # Type hint with AsyncSession
 ):
-    # Eager load cart items for the response using async ORM query
-    # Use select() and await db.execute() for async queries
+    # One query for the cart and its items
+    cart_result = await db.execute(_select_cart_rows().where(Cart.user_id == current_user.id))
+    rows = cart_result.all()
+
+    if not rows:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found for this user")
+    cart = _cart_from_rows(rows)
+    return render(cart_adapter, cart, response)
+
+# --- Cart mutation helpers ---
+# Each mutation is a single statement: a CTE bumps the cart's updated_at (and resolves the cart id from
+# the user), a second CTE changes cart_items with the product/stock check folded into its WHERE, and the
+# outer SELECT returns the resulting cart from what they RETURN, so the response needs no re-read.
+# The more expensive diagnosis only runs on failure.
+
+CART_ITEM_COLUMNS = (CartItem.id, CartItem.cart_id, CartItem.product_id, CartItem.quantity, CartItem.price_at_add, CartItem.created_at)
+
+def _touch_user_cart(user_id: int):
+    return (
+        update(Cart)
+        .where(Cart.user_id == user_id)
+        .values(updated_at=func.now())
+        .returning(Cart.id, Cart.user_id, Cart.created_at, Cart.updated_at)
+        .cte("touched_cart")
+    )
+
+async def _mutate_cart_item(db: AsyncSession, touched_cart, changed_item, product_id: int, removed: bool = False) -> Optional[dict]:
+    """
+    Runs the `changed_item` CTE (an insert/update/delete of one product's line, RETURNING
+    CART_ITEM_COLUMNS) and returns the cart as it is afterwards, or None when nothing was changed.
+    """
+    # Every part of the statement reads the snapshot from before it, so the other lines come from the
+    # table and the changed line from RETURNING
+    other_items = select(*CART_ITEM_COLUMNS).where(CartItem.cart_id == touched_cart.c.id, CartItem.product_id != product_id)
+    items = (other_items if removed else union_all(select(changed_item), other_items)).subquery("items")
     cart_result = await db.execute(
-        select(Cart)
-        .options(joinedload(Cart.items)) # Corrected: Use joinedload for eager loading
-        .filter(Cart.user_id == current_user.id)
+        select(
+            touched_cart.c.id, touched_cart.c.user_id, touched_cart.c.created_at, touched_cart.c.updated_at,
+            items.c.id.label("item_id"), items.c.product_id, items.c.quantity, items.c.price_at_add,
+            items.c.created_at.label("item_created_at"),
+        )
+        .select_from(touched_cart.outerjoin(items, items.c.cart_id == touched_cart.c.id))
+        .where(select(changed_item.c.id).exists()) # No rows when the cart is missing or the change did not apply
+        .order_by(items.c.id)
     )
-    # Add .unique() when eager loading collections to handle duplicate parent rows
-    cart = cart_result.unique().scalar_one_or_none() # Added .unique()
+    rows = cart_result.all()
+    return _cart_from_rows(rows) if rows else None
 
-    if not cart:
+async def _raise_cart_mutation_error(db: AsyncSession, user_id: int, product_id: int, quantity: int, stock_detail: str, require_item: bool):
+    # Error path only: work out which precondition failed, in the order the API has always reported them
+    cart_id = await db.scalar(select(Cart.id).where(Cart.user_id == user_id))
+    if cart_id is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found for this user")
-    return cart
+    if require_item:
+        item_id = await db.scalar(select(CartItem.id).where(CartItem.cart_id == cart_id, CartItem.product_id == product_id))
+        if item_id is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not in cart")
+    stock_quantity = await db.scalar(select(Product.stock_quantity).where(Product.id == product_id))
+    if stock_quantity is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=stock_detail)
 
 @app.post("/items", response_model=CartResponse, status_code=status.HTTP_200_OK)
 async def add_item_to_cart(
     item: CartItemBase,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
     db: AsyncSession = Depends(get_cart_db) # Type hint with AsyncSession
 ):
-    cart_result = await db.execute(
-        select(Cart).filter(Cart.user_id == current_user.id)
+    # INSERT ... ON CONFLICT (cart_id, product_id) DO UPDATE: adds the line or increases its quantity,
+    # pricing it at the current product price, only if the product has enough stock.
+    touched_cart = _touch_user_cart(current_user.id)
+    source = (
+        select(touched_cart.c.id, Product.id, literal(item.quantity, Integer), Product.price)
+        .where(Product.id == item.product_id, Product.stock_quantity >= item.quantity)
     )
-    cart = cart_result.scalar_one_or_none()
-    if not cart:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found for this user")
+    upsert = pg_insert(CartItem).from_select(["cart_id", "product_id", "quantity", "price_at_add"], source)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[CartItem.cart_id, CartItem.product_id], # The _cart_product_uc unique constraint
+        set_={
+            "quantity": CartItem.quantity + upsert.excluded.quantity,
+            "price_at_add": upsert.excluded.price_at_add, # Update price in case it changed
+        },
+    ).returning(*CART_ITEM_COLUMNS)
 
-    product_result = await db.execute(
-        select(Product).filter(Product.id == item.product_id)
-    )
-    product = product_result.scalar_one_or_none()
-    if not product:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-    if product.stock_quantity < item.quantity:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not enough stock for this product")
-
-    cart_item_result = await db.execute(
-        select(CartItem).filter(
-            CartItem.cart_id == cart.id,
-            CartItem.product_id == item.product_id
-        )
-    )
-    cart_item = cart_item_result.scalar_one_or_none()
+    cart = await _mutate_cart_item(db, touched_cart, upsert.cte("changed_item"), item.product_id)
+    if cart is None:
+        await _raise_cart_mutation_error(db, current_user.id, item.product_id, item.quantity,
+                                         "Not enough stock for this product", require_item=False)
 
-    if cart_item:
-        cart_item.quantity += item.quantity
-        cart_item.price_at_add = product.price # Update price in case it changed
-    else:
-        cart_item = CartItem(
-            cart_id=cart.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            price_at_add=product.price
-        )
-        db.add(cart_item)
-
-    cart.updated_at = func.now() # Update cart timestamp
     await db.commit() # Await commit
-    await db.refresh(cart) # Await refresh
-    if cart_item:
-        await db.refresh(cart_item) # Await refresh
-
-    # Re-fetch cart with items to ensure response is complete (including relations)
-    # This needs to be done after commit and refresh to get the updated state
-    cart_with_items_result = await db.execute(
-        select(Cart)
-        .options(joinedload(Cart.items)) # Corrected: Use joinedload for eager loading
-        .filter(Cart.user_id == current_user.id)
-    )
-    # Add .unique() when eager loading collections to handle duplicate parent rows
-    cart_with_items = cart_with_items_result.unique().scalar_one_or_none() # Added .unique()
-    return cart_with_items
+    return cart
 
 @app.put("/items/{product_id}", response_model=CartResponse)
 async def update_cart_item_quantity(
     product_id: int,
     quantity: int,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
     db: AsyncSession = Depends(get_cart_db) # Type hint with AsyncSession
 ):
-    cart_result = await db.execute(
-        select(Cart).filter(Cart.user_id == current_user.id)
-    )
-    cart = cart_result.scalar_one_or_none()
-    if not cart:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found for this user")
-
-    cart_item_result = await db.execute(
-        select(CartItem).filter(
-            CartItem.cart_id == cart.id,
-            CartItem.product_id == product_id
-        )
-    )
-    cart_item = cart_item_result.scalar_one_or_none()
-
-    if not cart_item:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not in cart")
-
+    touched_cart = _touch_user_cart(current_user.id)
     if quantity <= 0:
-        await db.delete(cart_item) # Await delete
+        mutation = (
+            delete(CartItem)
+            .where(CartItem.cart_id == touched_cart.c.id, CartItem.product_id == product_id)
+            .returning(*CART_ITEM_COLUMNS)
+        )
     else:
-        product_result = await db.execute(
-            select(Product).filter(Product.id == product_id)
+        mutation = (
+            update(CartItem)
+            .where(
+                CartItem.cart_id == touched_cart.c.id,
+                CartItem.product_id == product_id,
+                Product.id == CartItem.product_id,
+                Product.stock_quantity >= quantity,
+            )
+            .values(quantity=quantity, price_at_add=Product.price) # Update price in case it changed
+            .returning(*CART_ITEM_COLUMNS)
         )
-        product = product_result.scalar_one_or_none()
-        if not product:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-        if product.stock_quantity < quantity:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not enough stock for this quantity")
-        cart_item.quantity = quantity
-        cart_item.price_at_add = product.price # Update price in case it changed
-
-    cart.updated_at = func.now() # Update cart timestamp
-    await db.commit() # Await commit
 
-    # Re-fetch cart with items to ensure response is complete
-    cart_with_items_result = await db.execute(
-        select(Cart)
-        .options(joinedload(Cart.items)) # Corrected: Use joinedload for eager loading
-        .filter(Cart.user_id == current_user.id)
-    )
-    # Add .unique() when eager loading collections to handle duplicate parent rows
-    cart_with_items = cart_with_items_result.unique().scalar_one_or_none() # Added .unique()
-    return cart_with_items
+    cart = await _mutate_cart_item(db, touched_cart, mutation.cte("changed_item"), product_id, removed=quantity <= 0)
+    if cart is None:
+        await _raise_cart_mutation_error(db, current_user.id, product_id, quantity,
+                                         "Not enough stock for this quantity", require_item=True)
+
+    await db.commit() # Await commit
+    return cart
 
 @app.delete("/items/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def remove_item_from_cart(
     product_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
     db: AsyncSession = Depends(get_cart_db) # Type hint with AsyncSession
 ):
-    cart_result = await db.execute(
-        select(Cart).filter(Cart.user_id == current_user.id)
+    touched_cart = _touch_user_cart(current_user.id)
+    removed_result = await db.execute(
+        delete(CartItem)
+        .where(CartItem.cart_id == touched_cart.c.id, CartItem.product_id == product_id)
+        .returning(CartItem.cart_id),
+        execution_options={"synchronize_session": False},
     )
-    cart = cart_result.scalar_one_or_none()
-    if not cart:
+    if removed_result.scalar_one_or_none() is None:
+        await _raise_cart_mutation_error(db, current_user.id, product_id, 0, "", require_item=True)
+
+    await db.commit() # Await commit
+    # No return value needed for 204 No Content, but FastAPI might complain if nothing is returned.
+    # Returning an empty dict or None is common for 204.
+    return {} # Return empty dict for 204 No Content status
+
+# --- Batch endpoints ---
+# Restoring a saved cart or merging a guest cart in one call: one product query validates every line,
+# one multi-row upsert applies them, all in a single transaction.
+
+def _merge_batch_items(batch: CartItemBatch, accumulate: bool) -> Dict[int, int]:
+    # ON CONFLICT cannot touch the same row twice in one statement, so fold duplicate product ids first
+    merged: Dict[int, int] = {}
+    for item in batch.items:
+        merged[item.product_id] = merged.get(item.product_id, 0) + item.quantity if accumulate else item.quantity
+    return merged
+
+async def _apply_cart_batch(batch: CartItemBatch, user_id: int, db: AsyncSession, accumulate: bool) -> CartBatchResponse:
+    cart_id = await db.scalar(
+        update(Cart).where(Cart.user_id == user_id).values(updated_at=func.now()).returning(Cart.id)
+    )
+    if cart_id is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found for this user")
 
-    cart_item_result = await db.execute(
-        select(CartItem).filter(
-            CartItem.cart_id == cart.id,
-            CartItem.product_id == product_id
-        )
+    requested = _merge_batch_items(batch, accumulate)
+    products_result = await db.execute(
+        select(Product.id, Product.price, Product.stock_quantity).where(Product.id.in_(requested))
     )
-    cart_item = cart_item_result.scalar_one_or_none()
+    products = {row.id: row for row in products_result.all()}
+
+    errors: List[CartItemBatchError] = []
+    upserts, removals = [], []
+    for product_id, quantity in requested.items():
+        if quantity <= 0:
+            if accumulate:
+                errors.append(CartItemBatchError(product_id=product_id, detail="Quantity must be positive"))
+            else:
+                removals.append(product_id) # Setting a quantity of 0 removes the line
+            continue
+        product = products.get(product_id)
+        if product is None:
+            errors.append(CartItemBatchError(product_id=product_id, detail="Product not found"))
+        elif product.stock_quantity < quantity:
+            errors.append(CartItemBatchError(product_id=product_id, detail="Not enough stock for this product"))
+        else:
+            upserts.append({"cart_id": cart_id, "product_id": product_id, "quantity": quantity, "price_at_add": product.price})
 
-    if not cart_item:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not in cart")
+    if errors and batch.strict:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=[error.model_dump() for error in errors])
 
-    await db.delete(cart_item) # Await delete
-    cart.updated_at = func.now() # Update cart timestamp
+    if upserts:
+        upsert = pg_insert(CartItem).values(upserts)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[CartItem.cart_id, CartItem.product_id],
+            set_={
+                "quantity": CartItem.quantity + upsert.excluded.quantity if accumulate else upsert.excluded.quantity,
+                "price_at_add": upsert.excluded.price_at_add,
+            },
+        )
+        await db.execute(upsert)
+    if removals:
+        await db.execute(
+            delete(CartItem).where(CartItem.cart_id == cart_id, CartItem.product_id.in_(removals)),
+            execution_options={"synchronize_session": False},
+        )
+
+    cart_result = await db.execute(_select_cart_rows().where(Cart.id == cart_id))
+    cart = _cart_from_rows(cart_result.all())
     await db.commit() # Await commit
-    # No return value needed for 204 No Content, but FastAPI might complain if nothing is returned.
-    # Returning an empty dict or None is common for 204.
-    return {} # Return empty dict for 204 No Content status
+    return CartBatchResponse(cart=cart, errors=errors)
+
+@app.post("/items:batch", response_model=CartBatchResponse)
+async def add_items_to_cart(
+    batch: CartItemBatch,
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_cart_db) # Type hint with AsyncSession
+):
+    # Adds each quantity to the cart, like POST /items for every entry
+    return await _apply_cart_batch(batch, current_user.id, db, accumulate=True)
+
+@app.put("/items:batch", response_model=CartBatchResponse)
+async def set_cart_item_quantities(
+    batch: CartItemBatch,
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_cart_db) # Type hint with AsyncSession
+):
+    # Sets each line to exactly the given quantity (adding it if missing); 0 or less removes the line
+    return await _apply_cart_batch(batch, current_user.id, db, accumulate=False)
@@ -3,16 +3,19 @@ import pytest_asyncio # type: ignore
 import uuid
 from decimal import Decimal
 from httpx import AsyncClient # type: ignore
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession # type: ignore
 from sqlalchemy import select # type: ignore
+from sqlalchemy.pool import NullPool # type: ignore
 
 from shared.config import DATABASE_URL
+from shared.database import build_engine, get_session_local, get_session
 from shared.models import User, Product, Cart, CartItem
 from shared.security import get_current_user
 from main import app, get_cart_db
 
-engine = create_async_engine(DATABASE_URL, echo=False)
-SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+# Shared engine settings; NullPool because each test runs on its own event loop
+engine = build_engine(DATABASE_URL, poolclass=NullPool)
+SessionLocal = get_session_local(engine)
 
 @pytest_asyncio.fixture(scope="function")
 async def db_session():
@@ -26,11 +29,13 @@ async def client(db_session: AsyncSession):
         yield db_session
 
     app.dependency_overrides[get_cart_db] = override_get_cart_db
+    app.dependency_overrides[get_session] = override_get_cart_db  # Session behind get_read_session and get_current_user
 
     async with AsyncClient(app=app, base_url="http://test/cart") as ac:
         yield ac
 
     app.dependency_overrides.pop(get_cart_db, None)
+    app.dependency_overrides.pop(get_session, None)
 
 @pytest_asyncio.fixture(scope="function")
 async def mock_auth_user_override(db_session: AsyncSession):
@@ -72,3 +77,106 @@ async def test_add_item_to_cart(client: AsyncClient, db_session: AsyncSession, m
     data = response.json()
     assert data["user_id"] == current_user.id
     assert any(item["product_id"] == product.id for item in data["items"])
+
+async def _product_and_cart(db_session: AsyncSession, user_id: int, stock: int = 5):
+    product = Product(name=f"Prod_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("10.00"), stock_quantity=stock)
+    db_session.add(product)
+    cart = await db_session.scalar(select(Cart).where(Cart.user_id == user_id))
+    if not cart:
+        cart = Cart(user_id=user_id)
+        db_session.add(cart)
+    await db_session.commit()
+    return product, cart
+
+@pytest.mark.asyncio
+async def test_cart_item_upsert_and_update(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+    product, cart = await _product_and_cart(db_session, current_user.id)
+
+    await client.post("/items", json={"product_id": product.id, "quantity": 2})
+    response = await client.post("/items", json={"product_id": product.id, "quantity": 1})
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert [(i["product_id"], i["quantity"]) for i in items] == [(product.id, 3)]  # Same line, quantity accumulated
+
+    response = await client.put(f"/items/{product.id}", params={"quantity": 4})
+    assert response.status_code == 200
+    assert response.json()["items"][0]["quantity"] == 4
+
+    response = await client.put(f"/items/{product.id}", params={"quantity": 0})
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+
+@pytest.mark.asyncio
+async def test_cart_mutation_response_lists_every_line(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+    first, cart = await _product_and_cart(db_session, current_user.id)
+    second, _ = await _product_and_cart(db_session, current_user.id)
+    added = (await client.post("/items", json={"product_id": first.id, "quantity": 1})).json()
+
+    # The changed line comes from RETURNING and the others from the same statement
+    response = await client.post("/items", json={"product_id": second.id, "quantity": 2})
+    data = response.json()
+    assert [(i["product_id"], i["quantity"]) for i in data["items"]] == [(first.id, 1), (second.id, 2)]
+    assert data["id"] == cart.id
+    assert data["updated_at"] >= added["updated_at"]
+
+    response = await client.put(f"/items/{first.id}", params={"quantity": 3})
+    assert [(i["product_id"], i["quantity"]) for i in response.json()["items"]] == [(first.id, 3), (second.id, 2)]
+
+    response = await client.put(f"/items/{second.id}", params={"quantity": 0})
+    assert [(i["product_id"], i["quantity"]) for i in response.json()["items"]] == [(first.id, 3)]
+    assert response.json() == (await client.get("/")).json()
+
+@pytest.mark.asyncio
+async def test_cart_mutation_errors(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+    product, cart = await _product_and_cart(db_session, current_user.id, stock=1)
+
+    response = await client.post("/items", json={"product_id": product.id, "quantity": 2})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Not enough stock for this product"
+
+    response = await client.post("/items", json={"product_id": 0, "quantity": 1})
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Product not found"
+
+    response = await client.put(f"/items/{product.id}", params={"quantity": 1})
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Product not in cart"
+
+    response = await client.delete(f"/items/{product.id}")
+    assert response.status_code == 404
+
+@pytest.mark.asyncio
+async def test_cart_batch_operations(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+    first, cart = await _product_and_cart(db_session, current_user.id, stock=10)
+    second, _ = await _product_and_cart(db_session, current_user.id, stock=1)
+
+    response = await client.post("/items:batch", json={"items": [
+        {"product_id": first.id, "quantity": 2},
+        {"product_id": first.id, "quantity": 1},  # Duplicates are merged
+        {"product_id": second.id, "quantity": 5},  # Not enough stock
+        {"product_id": 0, "quantity": 1},
+    ]})
+    assert response.status_code == 200
+    data = response.json()
+    assert [(i["product_id"], i["quantity"]) for i in data["cart"]["items"]] == [(first.id, 3)]
+    assert {e["product_id"]: e["detail"] for e in data["errors"]} == {
+        second.id: "Not enough stock for this product",
+        0: "Product not found",
+    }
+
+    # Strict mode applies nothing when any entry fails
+    response = await client.put("/items:batch", json={"strict": True, "items": [
+        {"product_id": first.id, "quantity": 7},
+        {"product_id": second.id, "quantity": 5},
+    ]})
+    assert response.status_code == 400
+
+    response = await client.put("/items:batch", json={"items": [
+        {"product_id": first.id, "quantity": 0},
+        {"product_id": second.id, "quantity": 1},
+    ]})
+    assert [(i["product_id"], i["quantity"]) for i in response.json()["cart"]["items"]] == [(second.id, 1)]
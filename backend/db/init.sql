@@ -2,73 +2,9 @@
 -- after the database 'ecommerce_db' and user 'admin_user' are already created
 -- by the environment variables (POSTGRES_DB, POSTGRES_USER) set in docker-compose.yml.
 
--- Create the 'users' table
-CREATE TABLE IF NOT EXISTS users (
-    id SERIAL PRIMARY KEY,
-    username VARCHAR(50) UNIQUE NOT NULL,
-    email VARCHAR(100) UNIQUE NOT NULL,
-    hashed_password VARCHAR(255) NOT NULL,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
+-- Tables and indexes are owned by the Alembic migrations in backend/shared/migrations,
+-- applied by the one-shot "migrate" service in docker-compose.yml (python -m shared.migrate).
+-- Only the extension is created here, as the database superuser.
 
--- Create the 'products' table
-CREATE TABLE IF NOT EXISTS products (
-    id SERIAL PRIMARY KEY,
-    name VARCHAR(255) NOT NULL,
-    description TEXT,
-    price NUMERIC(10, 2) NOT NULL,
-    stock_quantity INTEGER NOT NULL DEFAULT 0,
-    image_url VARCHAR(255),
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
-
--- Create the 'carts' table
--- Ensure 'users' table exists before creating 'carts' due to FOREIGN KEY
-CREATE TABLE IF NOT EXISTS carts (
-    id SERIAL PRIMARY KEY,
-    user_id INTEGER UNIQUE REFERENCES users(id) ON DELETE CASCADE,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
-
--- Create the 'cart_items' table
--- Ensure 'carts' and 'products' tables exist before creating 'cart_items'
-CREATE TABLE IF NOT EXISTS cart_items (
-    id SERIAL PRIMARY KEY,
-    cart_id INTEGER REFERENCES carts(id) ON DELETE CASCADE,
-    product_id INTEGER REFERENCES products(id) ON DELETE CASCADE,
-    quantity INTEGER NOT NULL,
-    price_at_add NUMERIC(10, 2) NOT NULL, -- Price of the product when added to cart
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE (cart_id, product_id) -- A product can only be in a cart once
-);
-
--- Create the 'orders' table
--- Ensure 'users' table exists before creating 'orders'
-CREATE TABLE IF NOT EXISTS orders (
-    id SERIAL PRIMARY KEY,
-    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-    total_amount NUMERIC(10, 2) NOT NULL,
-    status VARCHAR(50) NOT NULL DEFAULT 'pending', -- e.g., 'pending', 'completed', 'shipped', 'cancelled'
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
-
--- Create the 'order_items' table
--- Ensure 'orders' and 'products' tables exist before creating 'order_items'
-CREATE TABLE IF NOT EXISTS order_items (
-    id SERIAL PRIMARY KEY,
-    order_id INTEGER REFERENCES orders(id) ON DELETE CASCADE,
-    product_id INTEGER REFERENCES products(id) ON DELETE CASCADE,
-    quantity INTEGER NOT NULL,
-    price_at_purchase NUMERIC(10, 2) NOT NULL, -- Price of the product when ordered
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE (order_id, product_id) -- A product can only be in an order once
-);
-
--- Add indexes to frequently queried columns for performance
-CREATE INDEX IF NOT EXISTS idx_users_email ON users (email);
-CREATE INDEX IF NOT EXISTS idx_products_name ON products (name);
-CREATE INDEX IF NOT EXISTS idx_carts_user_id ON carts (user_id);
-CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders (user_id);
\ No newline at end of file
+-- Trigram matching for typo-tolerant product search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
@@ -1,148 +1,411 @@
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException, status # type: ignore
-from sqlalchemy.ext.asyncio import AsyncSession # type: ignore
+import asyncio
+import csv
+import io
+import json
+import secrets
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Response, status # type: ignore
+from fastapi.encoders import jsonable_encoder # type: ignore
+from fastapi.responses import StreamingResponse # type: ignore
+from pydantic import TypeAdapter # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker # type: ignore
 from sqlalchemy.orm import selectinload # type: ignore
+from sqlalchemy.orm.attributes import set_committed_value # type: ignore
 from sqlalchemy.sql import func # type: ignore
-from sqlalchemy import select # type: ignore
+from sqlalchemy import select, insert, update, delete, bindparam, any_, literal, Integer # type: ignore
+from sqlalchemy.dialects.postgresql import ARRAY # type: ignore
 from prometheus_fastapi_instrumentator import Instrumentator # type: ignore
 
-from shared.database import get_db, Base, get_engine
-from shared.models import Order, OrderItem, Product, Cart, CartItem, User
-from shared.schemas import OrderResponse
-from shared.security import get_current_user
-from shared.config import DATABASE_URL
+from shared.database import get_session, get_sessionmaker, get_engine, dispose_engines, get_read_session, read_router, ReadYourWritesMiddleware
+from shared.migrate import check_schema_version
+from shared.query_metrics import install_query_metrics
+from shared.serialization import DefaultResponse, render, json_response
+from shared.read_models import OrderRead, OrderItemRead, ORDER_READ_COLUMNS, ORDER_ITEM_READ_COLUMNS, from_rows
+from shared.debug import debug_router
+from shared.health import health_router, start_warm_up, stop_warm_up
+from shared.models import Order, OrderItem, Product, Cart, CartItem
+from shared.schemas import OrderResponse, OrderSummaryResponse, OrderExportFormat
+from shared.schemas import OrderStatus, OrderStatusUpdate, OrderStatusBatchUpdate, OrderStatusBatchResponse
+from shared.idempotency import IDEMPOTENCY_KEY_HEADER, claim_idempotency_key, store_idempotent_response, run_idempotency_key_cleanup
+from shared.outbox import publish_events, run_outbox_cleanup
+from shared.pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor, keyset_before
+from shared.security import get_current_user, UserPrincipal, listen_for_principal_changes
+from shared.notifications import PostgresListener
+from shared.config import DATABASE_URL, ORDER_EXPORT_BATCH_SIZE, ORDER_OPERATOR_TOKEN
 
 app = FastAPI(
     title="Order Service",
     description="Manages order creation and history.",
     version="1.0.0",
     root_path="/orders",  # Important for proxy routing
+    default_response_class=DefaultResponse, # orjson encoding
 )
 
 # --- PROMETHEUS INSTRUMENTATION START ---
 # Initialize Prometheus instrumentation on startup
 # This automatically exposes the /metrics endpoint
 Instrumentator().instrument(app).expose(app)
+install_query_metrics(app) # Per-route SQL statement counts and DB time, plus N+1 warnings
+app.add_middleware(ReadYourWritesMiddleware) # Keeps a client's reads on the primary right after it writes
 print("Prometheus metrics exposed at /metrics")
 # --- PROMETHEUS INSTRUMENTATION END ---
 
-async def get_order_db():
-    async for session in get_db(DATABASE_URL):
-        yield session
+# Operator-only /debug endpoints (slow queries, profiler); disabled unless DEBUG_ENDPOINTS_TOKEN is set
+app.include_router(debug_router)
+
+# Liveness (/health) and readiness (/ready) probes
+app.include_router(health_router)
+
+# Dedicated LISTEN connection that evicts cached principals when any service changes a user
+notification_listener = PostgresListener(DATABASE_URL)
+listen_for_principal_changes(notification_listener)
+
+async def get_order_db(session: AsyncSession = Depends(get_session)):
+    # Same request-scoped session that get_current_user resolves, so a request uses one pooled connection
+    yield session
+
+idempotency_cleanup_task: Optional[asyncio.Task] = None
+outbox_cleanup_task: Optional[asyncio.Task] = None
+
+async def get_export_sessionmaker() -> async_sessionmaker:
+    # A streamed export outlives the request-scoped session, so it opens its own from the shared pool
+    return await get_sessionmaker(DATABASE_URL)
 
 @app.on_event("startup")
 async def startup_event():
+    # The listener reconnects on its own, so it starts straight away
+    notification_listener.start()
+    # Measures replica lag (DATABASE_READ_URLS); reads use the primary until a replica is known to be current
+    read_router.start()
+    # Connect and check the schema in the background; /ready reports 200 once this has succeeded
+    start_warm_up(warm_up)
+
+async def warm_up():
     engine = await get_engine(DATABASE_URL)
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    print("Order service database tables checked/created.")
+    # The schema is owned by the migrations (python -m shared.migrate); only check it is current
+    await check_schema_version(engine)
+    # Purge expired Idempotency-Key rows in the background
+    global idempotency_cleanup_task, outbox_cleanup_task
+    if idempotency_cleanup_task is None:
+        idempotency_cleanup_task = asyncio.create_task(run_idempotency_key_cleanup(await get_sessionmaker(DATABASE_URL)))
+    # Drop order events every outbox consumer has handled once they are past retention
+    if outbox_cleanup_task is None:
+        outbox_cleanup_task = asyncio.create_task(run_outbox_cleanup(await get_sessionmaker(DATABASE_URL)))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_warm_up() # Report not ready first so traffic drains away
+    for task in (idempotency_cleanup_task, outbox_cleanup_task):
+        if task is not None:
+            task.cancel()
+    await read_router.stop()
+    await notification_listener.stop()
+    # Release the shared connection pool so Postgres sees clean disconnects
+    await dispose_engines()
 
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
+# Outbox events for order changes (see shared.outbox); the payload always carries the order id
+def _order_event(event_type: str, order_id: int, payload: dict) -> dict:
+    return {"event_type": event_type, "aggregate_type": "order", "aggregate_id": order_id, "payload": {"order_id": order_id, **payload}}
 
 @app.post("/", response_model=OrderResponse, status_code=status.HTTP_201_CREATED)
 async def create_order_from_cart(
-    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(
+        None,
+        alias=IDEMPOTENCY_KEY_HEADER,
+        max_length=255,
+        description="Client-generated key; retries with the same key replay the first response instead of checking out again",
+    ),
+    current_user: UserPrincipal = Depends(get_current_user),
     db: AsyncSession = Depends(get_order_db),
 ):
-    # Fetch cart asynchronously
-    cart_result = await db.execute(select(Cart).where(Cart.user_id == current_user.id))
-    cart = cart_result.scalar_one_or_none()
-    if not cart:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found for this user")
-
-    # Fetch cart items asynchronously
-    cart_items_result = await db.execute(select(CartItem).where(CartItem.cart_id == cart.id))
-    cart_items = cart_items_result.scalars().all()
-    if not cart_items:
+    # Everything below runs in ONE transaction with a fixed number of statements, whatever the cart size.
+
+    # 0. Claim the idempotency key first. A concurrent retry with the same key waits here until
+    # this transaction ends, then replays the stored order instead of touching the cart or stock.
+    if idempotency_key:
+        replay = await claim_idempotency_key(db, current_user.id, idempotency_key)
+        if replay is not None:
+            return replay
+
+    # 1. Fetch the cart lines and their products in a single query, locking the cart, its lines and the products.
+    # Locking the products serializes concurrent checkouts of the same SKU (no overselling);
+    # locking the cart items makes a concurrent checkout of the same cart see them as already consumed.
+    # Locking the cart row holds off concurrent cart writes (every one starts by updating that row) until
+    # this checkout commits, since row locks cannot cover lines that are added after this query.
+    # Ordering by product id gives every checkout the same lock order, which avoids deadlocks.
+    lines_result = await db.execute(
+        select(
+            CartItem.cart_id,
+            CartItem.product_id,
+            CartItem.quantity,
+            Product.name,
+            Product.price,
+            Product.stock_quantity,
+        )
+        .join(Cart, Cart.id == CartItem.cart_id)
+        .join(Product, Product.id == CartItem.product_id)
+        .where(Cart.user_id == current_user.id)
+        .order_by(Product.id)
+        .with_for_update(of=(Cart, CartItem, Product))
+    )
+    lines = lines_result.all()
+    if not lines:
+        # Only the error path pays for telling "no cart" apart from "empty cart"
+        cart_id = await db.scalar(select(Cart.id).where(Cart.user_id == current_user.id))
+        if cart_id is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found for this user")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cart is empty")
 
-    total_amount = 0.0
-    order_items_to_create = []
-    products_to_update = []
-
-    for cart_item in cart_items:
-        # Fetch product asynchronously
-        product_result = await db.execute(select(Product).where(Product.id == cart_item.product_id))
-        product = product_result.scalar_one_or_none()
-        if not product:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                detail=f"Product with ID {cart_item.product_id} not found.")
-        if product.stock_quantity < cart_item.quantity:
+    for line in lines:
+        if line.stock_quantity < line.quantity:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Not enough stock for product '{product.name}'. Available: {product.stock_quantity}, Requested: {cart_item.quantity}"
+                detail=f"Not enough stock for product '{line.name}'. Available: {line.stock_quantity}, Requested: {line.quantity}"
             )
+    cart_id = lines[0].cart_id
+
+    # 2. Decrement stock for every product with one batched UPDATE.
+    # The stock guard in the WHERE clause is a second line of defence behind the row locks.
+    requested = func.unnest(
+        bindparam("product_ids", [line.product_id for line in lines], type_=ARRAY(Integer)),
+        bindparam("quantities", [line.quantity for line in lines], type_=ARRAY(Integer)),
+    ).table_valued("product_id", "quantity").render_derived(name="requested")
+    updated_result = await db.execute(
+        update(Product)
+        .where(Product.id == requested.c.product_id, Product.stock_quantity >= requested.c.quantity)
+        .values(stock_quantity=Product.stock_quantity - requested.c.quantity)
+        .returning(Product.id)
+    )
+    if len(updated_result.all()) != len(lines):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Stock changed during checkout, please retry")
+
+    # 3. Create the order, totalled by Postgres in exact NUMERIC: SUM(price * quantity) over the lines
+    # locked in step 1 (the same product ids and quantities as step 2), so the total matches the items
+    # the order records. Re-reading cart_items here would take a new snapshot and could include a line
+    # committed after step 1 that is not part of this order.
+    # RETURNING gives us the id and server-side timestamps without a re-select.
+    order_total = (
+        select(
+            literal(current_user.id, Integer),
+            func.sum(Product.price * requested.c.quantity),
+            literal(OrderStatus.pending.value),
+        )
+        .select_from(requested)
+        .join(Product, Product.id == requested.c.product_id)
+    )
+    new_order = await db.scalar(
+        insert(Order)
+        .from_select([Order.user_id, Order.total_amount, Order.status], order_total)
+        .returning(Order)
+    )
 
-        # Calculate total amount and prepare order items
-        item_total = float(product.price) * cart_item.quantity
-        total_amount += item_total
-        order_items_to_create.append({
-            "product_id": product.id,
-            "quantity": cart_item.quantity,
-            "price_at_purchase": float(product.price)
-        })
-
-        # Prepare product stock update
-        product.stock_quantity -= cart_item.quantity
-        products_to_update.append(product)
-
-    # Create the order
-    new_order = Order(
-        user_id=current_user.id,
-        total_amount=total_amount,
-        status="pending",
-        created_at=func.now(),
-        updated_at=func.now()
+    # 4. Bulk-insert the order items (a single multi-row INSERT ... RETURNING).
+    order_items_result = await db.scalars(
+        insert(OrderItem).returning(OrderItem, sort_by_parameter_order=True),
+        [
+            {
+                "order_id": new_order.id,
+                "product_id": line.product_id,
+                "quantity": line.quantity,
+                "price_at_purchase": line.price,
+            }
+            for line in lines
+        ],
     )
-    db.add(new_order)
-    await db.commit()  # Commit to get order ID
-    await db.refresh(new_order)
+    order_items = order_items_result.all()
 
-    # Create order items and update product stock
-    for item_data in order_items_to_create:
-        order_item = OrderItem(order_id=new_order.id, **item_data)
-        db.add(order_item)
+    # 5. Clear the ordered lines with one DELETE. Only the lines locked in step 1 were ordered; a line
+    # committed after that query is not in this order and stays in the cart.
+    await db.execute(
+        delete(CartItem)
+        .where(
+            CartItem.cart_id == cart_id,
+            CartItem.product_id == any_(bindparam("ordered_ids", [line.product_id for line in lines], type_=ARRAY(Integer))),
+        )
+    )
 
-    for product_to_update in products_to_update:
-        db.add(product_to_update)
+    # Attach the inserted items so the response needs no second read
+    set_committed_value(new_order, "items", order_items)
 
-    # Clear the cart items
-    for cart_item in cart_items:
-        await db.delete(cart_item)
+    # 6. Record the order.created event in the outbox; downstream consumers (cache invalidation,
+    # analytics, emails) pick it up after commit instead of adding to checkout latency.
+    await publish_events(db, [_order_event("order.created", new_order.id, {
+        "user_id": current_user.id,
+        "status": new_order.status,
+        "total_amount": str(new_order.total_amount),
+        "items": [
+            {"product_id": item.product_id, "quantity": item.quantity, "price_at_purchase": str(item.price_at_purchase)}
+            for item in order_items
+        ],
+    })])
+
+    # 7. Store the response under the idempotency key, committed atomically with the order.
+    if idempotency_key:
+        body = jsonable_encoder(OrderResponse.model_validate(new_order))
+        await store_idempotent_response(
+            db, current_user.id, idempotency_key, status.HTTP_201_CREATED, body, order_id=new_order.id
+        )
 
     await db.commit()
-    await db.refresh(new_order)
+    return new_order
 
-    # Eager load order items for complete response
-    order_with_items_result = await db.execute(
-        select(Order)
-        .options(selectinload(Order.items))
-        .where(Order.id == new_order.id)
-    )
-    order_with_items = order_with_items_result.scalar_one_or_none()
-    return order_with_items
+# Order history loads OrderRead / OrderItemRead rows (see shared.read_models) instead of ORM objects
+order_list_adapter = TypeAdapter(List[OrderResponse])
+order_summary_list_adapter = TypeAdapter(List[OrderSummaryResponse])
 
-@app.get("/", response_model=List[OrderResponse])
+@app.get(
+    "/",
+    response_model=List[OrderResponse],
+    responses={200: {"description": "Orders newest first; with summary=true, a list of OrderSummaryResponse"}},
+)
 async def get_user_orders(
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_order_db),
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    summary: bool = Query(False, description="Return order headers with an item count instead of full items"),
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_session),
 ):
-    orders_result = await db.execute(
-        select(Order)
-        .options(selectinload(Order.items))
-        .where(Order.user_id == current_user.id)
+    # Newest first, seeking on (created_at, id) through ix_orders_user_id_created_at
+    sort_columns = (Order.created_at, Order.id)
+    if summary:
+        # Headers plus item count from one aggregate query, no OrderItem rows at all
+        query = (
+            select(*ORDER_READ_COLUMNS, func.count(OrderItem.id).label("item_count"))
+            .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+            .group_by(Order.id)
+        )
+    else:
+        query = select(*ORDER_READ_COLUMNS)
+    query = (
+        query.where(Order.user_id == current_user.id)
+        .order_by(Order.created_at.desc(), Order.id.desc())
+        .limit(limit + 1) # One extra row tells us if there is a next page
+    )
+    if cursor:
+        query = query.where(keyset_before(sort_columns, decode_cursor(cursor, "orders", (datetime, int))))
+
+    orders_result = await db.execute(query)
+    orders = orders_result.all() if summary else from_rows(OrderRead, orders_result)
+    if len(orders) > limit:
+        orders = orders[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor("orders", [orders[-1].created_at, orders[-1].id])
+
+    if summary:
+        # A different shape than response_model, so it is always encoded here
+        return json_response(order_summary_list_adapter, orders, headers=dict(response.headers))
+
+    if orders:
+        orders_by_id = {order.id: order for order in orders}
+        items_result = await db.execute(
+            select(OrderItem.order_id, *ORDER_ITEM_READ_COLUMNS)
+            .where(OrderItem.order_id.in_(list(orders_by_id)))
+            .order_by(OrderItem.order_id, OrderItem.id)
+        )
+        for order_id, *item in items_result:
+            orders_by_id[order_id].items.append(OrderItemRead(*item))
+    return render(order_list_adapter, orders, response)
+
+# --- Streaming export ---
+# Rows come from a server-side cursor in batches of ORDER_EXPORT_BATCH_SIZE and each batch is written
+# out as one chunk, so memory stays flat no matter how many orders the account has.
+EXPORT_CSV_COLUMNS = (
+    "order_id", "user_id", "status", "total_amount", "created_at", "updated_at",
+    "item_id", "product_id", "quantity", "price_at_purchase",
+)
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is None or isinstance(value, (int, str)):
+        return value
+    return str(value) # Decimal money keeps its exact representation
+
+def _order_export_query(user_id: int):
+    return (
+        select(
+            Order.id.label("order_id"), Order.user_id, Order.status, Order.total_amount,
+            Order.created_at, Order.updated_at,
+            OrderItem.id.label("item_id"), OrderItem.product_id, OrderItem.quantity, OrderItem.price_at_purchase,
+        )
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .where(Order.user_id == user_id)
+        .order_by(Order.created_at.desc(), Order.id.desc(), OrderItem.id) # An order's items are adjacent
+        .execution_options(yield_per=ORDER_EXPORT_BATCH_SIZE)
+    )
+
+def _csv_chunk(rows) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if value is None else _export_value(value) for value in row])
+    return buffer.getvalue()
+
+async def _stream_order_export(
+    session_factory: async_sessionmaker, user_id: int, export_format: OrderExportFormat
+) -> AsyncIterator[str]:
+    async with session_factory() as session:
+        result = await session.stream(_order_export_query(user_id))
+        if export_format == OrderExportFormat.csv:
+            yield _csv_chunk([EXPORT_CSV_COLUMNS])
+            async for rows in result.partitions():
+                yield _csv_chunk(rows)
+            return
+
+        # NDJSON: fold each order's item rows into one object; only the current order is held in memory
+        current = None
+        async for rows in result.partitions():
+            lines = []
+            for row in rows:
+                if current is None or current["id"] != row.order_id:
+                    if current is not None:
+                        lines.append(json.dumps(current, separators=(",", ":")))
+                    current = {
+                        "id": row.order_id,
+                        "user_id": row.user_id,
+                        "status": row.status,
+                        "total_amount": _export_value(row.total_amount),
+                        "created_at": _export_value(row.created_at),
+                        "updated_at": _export_value(row.updated_at),
+                        "items": [],
+                    }
+                if row.item_id is not None:
+                    current["items"].append({
+                        "id": row.item_id,
+                        "product_id": row.product_id,
+                        "quantity": row.quantity,
+                        "price_at_purchase": _export_value(row.price_at_purchase),
+                    })
+            if lines:
+                yield "\n".join(lines) + "\n"
+        if current is not None:
+            yield json.dumps(current, separators=(",", ":")) + "\n"
+
+@app.get(
+    "/export",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}, "text/csv": {}}}},
+)
+async def export_orders(
+    format: OrderExportFormat = Query(OrderExportFormat.ndjson),
+    current_user: UserPrincipal = Depends(get_current_user),
+    session_factory: async_sessionmaker = Depends(get_export_sessionmaker),
+):
+    # Declared before /{order_id} so "export" is not parsed as an order id
+    media_type = "text/csv" if format == OrderExportFormat.csv else "application/x-ndjson"
+    return StreamingResponse(
+        _stream_order_export(session_factory, current_user.id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="orders.{format.value}"'},
     )
-    orders = orders_result.scalars().all()
-    return orders
 
 @app.get("/{order_id}", response_model=OrderResponse)
 async def get_order_details(
     order_id: int,
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_order_db),
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_session),
 ):
     order_result = await db.execute(
         select(Order)
@@ -156,3 +419,126 @@ async def get_order_details(
             detail="Order not found or you don't have permission to view it",
         )
     return order
+
+# --- Status transitions ---
+# Allowed moves of the order state machine. Stock is taken at checkout, so cancelling returns it.
+ORDER_STATUS_TRANSITIONS = {
+    OrderStatus.pending: {OrderStatus.paid, OrderStatus.cancelled},
+    OrderStatus.paid: {OrderStatus.shipped, OrderStatus.cancelled},
+    OrderStatus.shipped: {OrderStatus.delivered},
+    OrderStatus.delivered: set(),
+    OrderStatus.cancelled: set(),
+}
+
+def _transition_error(from_status: str, to_status: OrderStatus, status_code: int) -> HTTPException:
+    return HTTPException(status_code=status_code, detail=f"Cannot change order status from '{from_status}' to '{to_status.value}'")
+
+async def _transition_orders(db: AsyncSession, order_ids: List[int], from_status: OrderStatus, to_status: OrderStatus) -> List[int]:
+    """
+    Moves every order in order_ids that is still in from_status to to_status with one set-based UPDATE,
+    restocking cancelled orders' products with one more, and records an order.status_changed event
+    per moved order. Returns the ids that moved; the caller commits.
+    """
+    # The status guard makes this safe against concurrent changes: an order that moved meanwhile is simply not returned
+    moved_result = await db.execute(
+        update(Order)
+        .where(Order.id == any_(bindparam("order_ids", order_ids, type_=ARRAY(Integer))), Order.status == from_status.value)
+        .values(status=to_status.value)
+        .returning(Order.id, Order.user_id),
+        execution_options={"synchronize_session": False},
+    )
+    moved = moved_result.all()
+    moved_ids = [row.id for row in moved]
+    await publish_events(db, [
+        _order_event("order.status_changed", row.id, {"user_id": row.user_id, "from_status": from_status.value, "to_status": to_status.value})
+        for row in moved
+    ])
+
+    if to_status == OrderStatus.cancelled and moved_ids:
+        restock = (
+            select(OrderItem.product_id, func.sum(OrderItem.quantity).label("quantity"))
+            .where(OrderItem.order_id == any_(bindparam("cancelled_ids", moved_ids, type_=ARRAY(Integer))))
+            .group_by(OrderItem.product_id)
+            .subquery("restock")
+        )
+        # Lock the products in id order first, the same order checkout uses, so the two cannot deadlock
+        await db.execute(
+            select(Product.id).where(Product.id.in_(select(restock.c.product_id))).order_by(Product.id).with_for_update()
+        )
+        await db.execute(
+            update(Product)
+            .where(Product.id == restock.c.product_id)
+            .values(stock_quantity=Product.stock_quantity + restock.c.quantity),
+            execution_options={"synchronize_session": False},
+        )
+    return moved_ids
+
+# --- Who may change an order's status ---
+# Operators (fulfilment tools sending X-Operator-Token) may make any transition on any order.
+# Customers may only cancel their own orders while they are still pending.
+
+OPERATOR_TOKEN_HEADER = "X-Operator-Token"
+
+async def is_order_operator(operator_token: Optional[str] = Header(None, alias=OPERATOR_TOKEN_HEADER)) -> bool:
+    return bool(ORDER_OPERATOR_TOKEN) and operator_token is not None and secrets.compare_digest(operator_token, ORDER_OPERATOR_TOKEN)
+
+async def require_order_operator(operator: bool = Depends(is_order_operator)):
+    if not operator:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Operator token required")
+
+@app.post("/status:batch", response_model=OrderStatusBatchResponse, dependencies=[Depends(require_order_operator)])
+async def update_order_status_batch(
+    batch: OrderStatusBatchUpdate,
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_order_db),
+):
+    if batch.to_status not in ORDER_STATUS_TRANSITIONS[batch.from_status]:
+        raise _transition_error(batch.from_status.value, batch.to_status, status.HTTP_400_BAD_REQUEST)
+
+    order_ids = list(dict.fromkeys(batch.order_ids)) # De-duplicate, keeping request order
+    moved_ids = await _transition_orders(db, order_ids, batch.from_status, batch.to_status)
+    await db.commit()
+
+    moved = set(moved_ids)
+    return OrderStatusBatchResponse(
+        updated=[order_id for order_id in order_ids if order_id in moved],
+        skipped=[order_id for order_id in order_ids if order_id not in moved],
+    )
+
+@app.patch("/{order_id}/status", response_model=OrderResponse)
+async def update_order_status(
+    order_id: int,
+    status_update: OrderStatusUpdate,
+    current_user: UserPrincipal = Depends(get_current_user),
+    operator: bool = Depends(is_order_operator),
+    db: AsyncSession = Depends(get_order_db),
+):
+    customer_forbidden = HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Customers can only cancel pending orders")
+    if not operator and status_update.status != OrderStatus.cancelled:
+        raise customer_forbidden
+    # Lock the order so the transition is validated against the status we are about to overwrite
+    order_query = select(Order.status).where(Order.id == order_id)
+    if not operator:
+        order_query = order_query.where(Order.user_id == current_user.id) # Other customers' orders are not found
+    current_status = await db.scalar(order_query.with_for_update())
+    if current_status is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
+    if not operator and current_status != OrderStatus.pending.value:
+        raise customer_forbidden
+    try:
+        from_status = OrderStatus(current_status)
+    except ValueError: # A legacy status outside the state machine
+        raise _transition_error(current_status, status_update.status, status.HTTP_409_CONFLICT)
+    if status_update.status not in ORDER_STATUS_TRANSITIONS[from_status]:
+        raise _transition_error(current_status, status_update.status, status.HTTP_409_CONFLICT)
+
+    await _transition_orders(db, [order_id], from_status, status_update.status)
+    await db.commit()
+
+    order_result = await db.execute(
+        select(Order)
+        .options(selectinload(Order.items))
+        .where(Order.id == order_id)
+        .execution_options(populate_existing=True)
+    )
+    return order_result.scalar_one()
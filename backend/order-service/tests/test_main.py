@@ -1,18 +1,28 @@
 import pytest # type: ignore
 import pytest_asyncio # type: ignore
+import asyncio
+import csv
+import io
+import json
 import uuid
 from decimal import Decimal
 from httpx import AsyncClient # type: ignore
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker # type: ignore
-from sqlalchemy import select # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession # type: ignore
+from sqlalchemy import select, update, func # type: ignore
+from sqlalchemy.pool import NullPool # type: ignore
 
+from shared import config
 from shared.config import DATABASE_URL
-from shared.models import User, Product, Cart, CartItem
+from shared.database import build_engine, get_session_local, get_session
+from shared.models import User, Product, Cart, CartItem, Order, OrderItem, OutboxEvent
+from shared.idempotency import claim_idempotency_key, store_idempotent_response
 from shared.security import get_current_user
-from main import app, get_order_db
+import main
+from main import app, get_order_db, get_export_sessionmaker, OPERATOR_TOKEN_HEADER
 
-engine = create_async_engine(DATABASE_URL, echo=False)
-TestSessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+# Shared engine settings; NullPool because each test runs on its own event loop
+engine = build_engine(DATABASE_URL, poolclass=NullPool)
+TestSessionLocal = get_session_local(engine)
 
 @pytest_asyncio.fixture(scope="function")
 async def db_session():
@@ -26,11 +36,13 @@ async def client(db_session: AsyncSession):
         yield db_session
 
     app.dependency_overrides[get_order_db] = override_get_order_db
+    app.dependency_overrides[get_session] = override_get_order_db  # Session behind get_read_session and get_current_user
 
     async with AsyncClient(app=app, base_url="http://test/orders") as ac:
         yield ac
 
     app.dependency_overrides.pop(get_order_db, None)
+    app.dependency_overrides.pop(get_session, None)
 
 @pytest_asyncio.fixture(scope="function")
 async def mock_auth_user_override(db_session: AsyncSession):
@@ -97,3 +109,398 @@ async def test_create_order_from_cart(client: AsyncClient, db_session: AsyncSess
 
     assert "items" in data
     assert len(data["items"]) == 2
+
+    # Stock was decremented and the cart cleared in the same transaction
+    await db_session.refresh(prod1)
+    await db_session.refresh(prod2)
+    assert prod1.stock_quantity == 3
+    assert prod2.stock_quantity == 2
+    remaining = await db_session.scalars(select(CartItem).where(CartItem.cart_id == cart.id))
+    assert remaining.all() == []
+
+@pytest.mark.asyncio
+async def test_checkout_keeps_cart_lines_added_after_the_lock(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override, monkeypatch):
+    current_user = await app.dependency_overrides[get_current_user]()
+
+    ordered = Product(name=f"Locked_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("4.00"), stock_quantity=5)
+    late = Product(name=f"Late_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("9.00"), stock_quantity=5)
+    cart = Cart(user_id=current_user.id)
+    db_session.add_all([ordered, late, cart])
+    await db_session.commit()
+    cart_id, ordered_id, late_id = cart.id, ordered.id, late.id
+    db_session.add(CartItem(cart_id=cart_id, product_id=ordered_id, quantity=1, price_at_add=ordered.price))
+    await db_session.commit()
+
+    async def add_line_like_post_cart_items():
+        # A second session doing what every cart write does: touch the cart row, then write the line
+        async with TestSessionLocal() as other:
+            await other.execute(update(Cart).where(Cart.id == cart_id).values(updated_at=func.now()))
+            other.add(CartItem(cart_id=cart_id, product_id=late_id, quantity=1, price_at_add=Decimal("9.00")))
+            await other.commit()
+
+    # Run the concurrent cart write right after checkout's locking query
+    race = {}
+    execute = db_session.execute
+    async def execute_then_race(statement, *args, **kwargs):
+        result = await execute(statement, *args, **kwargs)
+        if getattr(statement, "_for_update_arg", None) is not None and "task" not in race:
+            race["task"] = asyncio.create_task(add_line_like_post_cart_items())
+            await asyncio.sleep(0.2)
+            race["blocked"] = not race["task"].done()
+        return result
+    monkeypatch.setattr(db_session, "execute", execute_then_race)
+
+    response = await client.post("/")
+    assert response.status_code == 201
+    await asyncio.wait_for(race["task"], timeout=5)
+    assert race["blocked"] # The cart write waited for checkout to commit
+
+    # The late line was not ordered, and checkout did not delete it
+    assert [item["product_id"] for item in response.json()["items"]] == [ordered_id]
+    remaining = await db_session.scalars(select(CartItem.product_id).where(CartItem.cart_id == cart_id))
+    assert remaining.all() == [late_id]
+
+@pytest.mark.asyncio
+async def test_checkout_totals_only_the_locked_lines(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+
+    ordered = Product(name=f"Snapshot_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("4.00"), stock_quantity=5)
+    late = Product(name=f"Late_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("9.00"), stock_quantity=5)
+    cart = Cart(user_id=current_user.id)
+    db_session.add_all([ordered, late, cart])
+    await db_session.commit()
+    cart_id, ordered_id, late_id = cart.id, ordered.id, late.id
+    db_session.add(CartItem(cart_id=cart_id, product_id=ordered_id, quantity=2, price_at_add=ordered.price))
+    await db_session.commit()
+
+    async with TestSessionLocal() as other:
+        # A cart write in flight when checkout starts: checkout waits on the cart row, and its locking
+        # query then works from a snapshot without the new line, while later statements would see it.
+        await other.execute(update(Cart).where(Cart.id == cart_id).values(updated_at=func.now()))
+        other.add(CartItem(cart_id=cart_id, product_id=late_id, quantity=1, price_at_add=Decimal("9.00")))
+        await other.flush()
+
+        checkout = asyncio.create_task(client.post("/"))
+        await asyncio.sleep(0.2)
+        assert not checkout.done()
+        await other.commit()
+        response = await asyncio.wait_for(checkout, timeout=5)
+
+    assert response.status_code == 201
+    data = response.json()
+    assert [item["product_id"] for item in data["items"]] == [ordered_id]
+    charged = sum(Decimal(str(item["price_at_purchase"])) * item["quantity"] for item in data["items"])
+    assert Decimal(str(data["total_amount"])) == charged == Decimal("8.00")
+    remaining = await db_session.scalars(select(CartItem.product_id).where(CartItem.cart_id == cart_id))
+    assert remaining.all() == [late_id]
+
+@pytest.mark.asyncio
+async def test_create_order_rejects_insufficient_stock(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+
+    product = Product(name=f"Scarce_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("5.00"), stock_quantity=1)
+    cart = Cart(user_id=current_user.id)
+    db_session.add_all([product, cart])
+    await db_session.commit()
+    db_session.add(CartItem(cart_id=cart.id, product_id=product.id, quantity=2, price_at_add=product.price))
+    await db_session.commit()
+
+    response = await client.post("/")
+    assert response.status_code == 400
+
+    # Nothing was written: stock untouched, cart still holds the item
+    await db_session.refresh(product)
+    assert product.stock_quantity == 1
+    remaining = await db_session.scalars(select(CartItem).where(CartItem.cart_id == cart.id))
+    assert len(remaining.all()) == 1
+
+@pytest.mark.asyncio
+async def test_get_user_orders_keyset_pagination_and_summary(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+
+    products = [
+        Product(name=f"Hist{i}_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("4.00"), stock_quantity=10)
+        for i in range(3)
+    ]
+    db_session.add_all(products)
+    await db_session.commit()
+    orders = []
+    for item_count in (1, 2, 3):
+        order = Order(user_id=current_user.id, total_amount=Decimal("4.00") * item_count, status="pending")
+        order.items = [
+            OrderItem(product_id=product.id, quantity=1, price_at_purchase=product.price) for product in products[:item_count]
+        ]
+        orders.append(order)
+        db_session.add(order)
+        await db_session.commit() # Separate transactions so created_at differs
+    newest_first = [order.id for order in reversed(orders)]
+
+    first_page = await client.get("/", params={"limit": 2})
+    assert first_page.status_code == 200
+    assert [o["id"] for o in first_page.json()] == newest_first[:2]
+    assert len(first_page.json()[0]["items"]) == 3
+    cursor = first_page.headers["X-Next-Cursor"]
+
+    second_page = await client.get("/", params={"limit": 2, "cursor": cursor})
+    assert [o["id"] for o in second_page.json()] == newest_first[2:]
+    assert "X-Next-Cursor" not in second_page.headers
+
+    summary = await client.get("/", params={"limit": 2, "summary": "true"})
+    assert summary.status_code == 200
+    assert [(o["id"], o["item_count"]) for o in summary.json()] == [(newest_first[0], 3), (newest_first[1], 2)]
+    assert "items" not in summary.json()[0]
+    assert summary.headers["X-Next-Cursor"] == cursor
+
+    assert (await client.get("/", params={"cursor": "garbage"})).status_code == 400
+
+@pytest.mark.asyncio
+async def test_export_orders_streams_ndjson_and_csv(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+    app.dependency_overrides[get_export_sessionmaker] = lambda: TestSessionLocal
+
+    products = [
+        Product(name=f"Export{i}_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("2.50"), stock_quantity=10)
+        for i in range(2)
+    ]
+    db_session.add_all(products)
+    await db_session.commit()
+    with_items = Order(user_id=current_user.id, total_amount=Decimal("5.00"), status="pending")
+    with_items.items = [OrderItem(product_id=p.id, quantity=1, price_at_purchase=p.price) for p in products]
+    empty = Order(user_id=current_user.id, total_amount=Decimal("0.00"), status="pending")
+    db_session.add_all([with_items, empty])
+    await db_session.commit()
+
+    try:
+        ndjson = await client.get("/export")
+        assert ndjson.status_code == 200
+        assert ndjson.headers["content-type"].startswith("application/x-ndjson")
+        exported = {order["id"]: order for order in map(json.loads, ndjson.text.splitlines())}
+        assert set(exported) == {with_items.id, empty.id}
+        assert exported[with_items.id]["total_amount"] == "5.00"
+        assert [item["product_id"] for item in exported[with_items.id]["items"]] == [p.id for p in products]
+        assert exported[empty.id]["items"] == []
+
+        csv_export = await client.get("/export", params={"format": "csv"})
+        assert csv_export.status_code == 200
+        rows = list(csv.DictReader(io.StringIO(csv_export.text)))
+        assert len(rows) == 3 # One row per item, plus one for the order without items
+        assert {row["order_id"] for row in rows} == {str(with_items.id), str(empty.id)}
+    finally:
+        app.dependency_overrides.pop(get_export_sessionmaker, None)
+
+@pytest.fixture
+def operator_headers(monkeypatch):
+    monkeypatch.setattr(main, "ORDER_OPERATOR_TOKEN", "test-operator-token")
+    return {OPERATOR_TOKEN_HEADER: "test-operator-token"}
+
+async def _pending_order(db_session: AsyncSession, user_id: int, product: Product, quantity: int) -> Order:
+    order = Order(user_id=user_id, total_amount=product.price * quantity, status="pending")
+    order.items = [OrderItem(product_id=product.id, quantity=quantity, price_at_purchase=product.price)]
+    db_session.add(order)
+    await db_session.commit()
+    return order
+
+@pytest.mark.asyncio
+async def test_update_order_status_follows_state_machine(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override, operator_headers):
+    current_user = await app.dependency_overrides[get_current_user]()
+    product = Product(name=f"Status_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("3.00"), stock_quantity=5)
+    db_session.add(product)
+    await db_session.commit()
+    order = await _pending_order(db_session, current_user.id, product, 2)
+
+    response = await client.patch(f"/{order.id}/status", json={"status": "paid"}, headers=operator_headers)
+    assert response.status_code == 200
+    assert response.json()["status"] == "paid"
+    assert len(response.json()["items"]) == 1
+
+    # paid -> delivered skips shipping
+    response = await client.patch(f"/{order.id}/status", json={"status": "delivered"}, headers=operator_headers)
+    assert response.status_code == 409
+
+    response = await client.patch(f"/{order.id}/status", json={"status": "cancelled"}, headers=operator_headers)
+    assert response.status_code == 200
+    await db_session.refresh(product)
+    assert product.stock_quantity == 7 # The cancelled order's items went back into stock
+
+    assert (await client.patch(f"/{order.id}/status", json={"status": "paid"}, headers=operator_headers)).status_code == 409
+    assert (await client.patch("/999999999/status", json={"status": "paid"}, headers=operator_headers)).status_code == 404
+
+@pytest.mark.asyncio
+async def test_customers_can_only_cancel_their_own_pending_orders(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override, operator_headers):
+    current_user = await app.dependency_overrides[get_current_user]()
+    other_user = User(username=f"other_{uuid.uuid4().hex[:6]}", email=f"other_{uuid.uuid4().hex[:8]}@example.com", hashed_password="mockpass")
+    product = Product(name=f"Owner_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("2.00"), stock_quantity=5)
+    db_session.add_all([other_user, product])
+    await db_session.commit()
+    own = await _pending_order(db_session, current_user.id, product, 1)
+    own_paid = await _pending_order(db_session, current_user.id, product, 1)
+    own_paid.status = "paid"
+    others = await _pending_order(db_session, other_user.id, product, 2)
+    await db_session.commit()
+
+    # A customer cannot pay for, or otherwise advance, their own order
+    assert (await client.patch(f"/{own.id}/status", json={"status": "paid"})).status_code == 403
+    # ...nor cancel once it is paid
+    assert (await client.patch(f"/{own_paid.id}/status", json={"status": "cancelled"})).status_code == 403
+    # Someone else's order does not exist for them, and a wrong operator token changes nothing
+    assert (await client.patch(f"/{others.id}/status", json={"status": "cancelled"})).status_code == 404
+    wrong_token = {OPERATOR_TOKEN_HEADER: "guess"}
+    assert (await client.patch(f"/{others.id}/status", json={"status": "cancelled"}, headers=wrong_token)).status_code == 404
+    await db_session.refresh(product)
+    assert product.stock_quantity == 5
+
+    response = await client.patch(f"/{own.id}/status", json={"status": "cancelled"})
+    assert response.status_code == 200
+    assert response.json()["status"] == "cancelled"
+
+@pytest.mark.asyncio
+async def test_batch_status_update_is_guarded_by_from_status(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override, operator_headers):
+    current_user = await app.dependency_overrides[get_current_user]()
+    product = Product(name=f"Batch_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("1.00"), stock_quantity=0)
+    db_session.add(product)
+    await db_session.commit()
+    first = await _pending_order(db_session, current_user.id, product, 1)
+    second = await _pending_order(db_session, current_user.id, product, 3)
+    already_paid = await _pending_order(db_session, current_user.id, product, 5)
+    already_paid.status = "paid"
+    await db_session.commit()
+
+    batch = {
+        "order_ids": [first.id, second.id, already_paid.id, 999999999],
+        "from_status": "pending",
+        "to_status": "cancelled",
+    }
+    # Operators only
+    assert (await client.post("/status:batch", json=batch)).status_code == 403
+    assert (await client.post("/status:batch", json=batch, headers={OPERATOR_TOKEN_HEADER: "guess"})).status_code == 403
+
+    response = await client.post("/status:batch", json=batch, headers=operator_headers)
+    assert response.status_code == 200
+    assert response.json() == {"updated": [first.id, second.id], "skipped": [already_paid.id, 999999999]}
+
+    await db_session.refresh(product)
+    assert product.stock_quantity == 4 # Restocked from both cancelled orders, not the paid one
+    await db_session.refresh(already_paid)
+    assert already_paid.status == "paid"
+
+    response = await client.post("/status:batch", json={"order_ids": [first.id], "from_status": "pending", "to_status": "delivered"}, headers=operator_headers)
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_create_order_replays_idempotency_key(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+    product = Product(name=f"Idem_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("6.00"), stock_quantity=5)
+    cart = Cart(user_id=current_user.id)
+    db_session.add_all([product, cart])
+    await db_session.commit()
+    db_session.add(CartItem(cart_id=cart.id, product_id=product.id, quantity=2, price_at_add=product.price))
+    await db_session.commit()
+
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    first = await client.post("/", headers=headers)
+    assert first.status_code == 201
+
+    # Refill the cart: a replay must not check it out again
+    db_session.add(CartItem(cart_id=cart.id, product_id=product.id, quantity=1, price_at_add=product.price))
+    await db_session.commit()
+    retry = await client.post("/", headers=headers)
+    assert retry.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+
+    await db_session.refresh(product)
+    assert product.stock_quantity == 3
+    orders = await db_session.scalars(select(Order).where(Order.user_id == current_user.id))
+    assert len(orders.all()) == 1
+
+    # A new key is a new checkout
+    assert (await client.post("/", headers={"Idempotency-Key": uuid.uuid4().hex})).status_code == 201
+
+@pytest.mark.asyncio
+async def test_concurrent_idempotency_key_waits_for_first_request(db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+    key = uuid.uuid4().hex
+
+    async with TestSessionLocal() as first, TestSessionLocal() as second:
+        assert await claim_idempotency_key(first, current_user.id, key) is None
+
+        duplicate = asyncio.create_task(claim_idempotency_key(second, current_user.id, key))
+        await asyncio.sleep(0.2)
+        assert not duplicate.done() # Blocked on the unique index until the first transaction ends
+
+        await store_idempotent_response(first, current_user.id, key, 201, {"id": 42})
+        await first.commit()
+        replay = await asyncio.wait_for(duplicate, timeout=5)
+        assert replay is not None and replay.status_code == 201
+        assert json.loads(replay.body) == {"id": 42}
+        await second.rollback()
+
+@pytest.mark.asyncio
+async def test_fast_serialization_of_order_history_is_identical(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override, monkeypatch):
+    current_user = await app.dependency_overrides[get_current_user]()
+    product = Product(name=f"FastOrder_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("7.25"), stock_quantity=10)
+    db_session.add(product)
+    await db_session.commit()
+    await _pending_order(db_session, current_user.id, product, 2)
+    await _pending_order(db_session, current_user.id, product, 1)
+
+    monkeypatch.setattr(config, "FAST_SERIALIZATION", False)
+    standard = await client.get("/")
+    monkeypatch.setattr(config, "FAST_SERIALIZATION", True)
+    fast = await client.get("/")
+
+    assert fast.status_code == standard.status_code == 200
+    assert fast.content == standard.content
+    assert [len(order["items"]) for order in fast.json()] == [1, 1]
+
+@pytest.mark.asyncio
+async def test_order_total_is_exact(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+    # 0.1 has no exact binary float representation; summing floats would drift
+    products = [
+        Product(name=f"Dime{i}_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("0.10"), stock_quantity=100)
+        for i in range(3)
+    ]
+    cart = Cart(user_id=current_user.id)
+    db_session.add_all([*products, cart])
+    await db_session.commit()
+    db_session.add_all([
+        CartItem(cart_id=cart.id, product_id=product.id, quantity=quantity, price_at_add=product.price)
+        for product, quantity in zip(products, (1, 2, 7))
+    ])
+    await db_session.commit()
+
+    response = await client.post("/")
+    assert response.status_code == 201
+    data = response.json()
+    assert data["total_amount"] == "1.00"
+    assert {item["price_at_purchase"] for item in data["items"]} == {"0.10"}
+
+@pytest.mark.asyncio
+async def test_order_changes_write_outbox_events(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    current_user = await app.dependency_overrides[get_current_user]()
+    product = Product(name=f"Outbox_{uuid.uuid4().hex[:6]}", description="desc", price=Decimal("4.50"), stock_quantity=5)
+    cart = Cart(user_id=current_user.id)
+    db_session.add_all([product, cart])
+    await db_session.commit()
+    db_session.add(CartItem(cart_id=cart.id, product_id=product.id, quantity=2, price_at_add=product.price))
+    await db_session.commit()
+
+    response = await client.post("/")
+    assert response.status_code == 201
+    order_id = response.json()["id"]
+    assert (await client.patch(f"/{order_id}/status", json={"status": "cancelled"})).status_code == 200
+
+    # Written in the same transactions as the order and the status change
+    events = (await db_session.scalars(
+        select(OutboxEvent).where(OutboxEvent.aggregate_type == "order", OutboxEvent.aggregate_id == order_id).order_by(OutboxEvent.id)
+    )).all()
+    assert [event.event_type for event in events] == ["order.created", "order.status_changed"]
+    assert events[0].payload == {
+        "order_id": order_id,
+        "user_id": current_user.id,
+        "status": "pending",
+        "total_amount": "9.00",
+        "items": [{"product_id": product.id, "quantity": 2, "price_at_purchase": "4.50"}],
+    }
+    assert events[1].payload == {"order_id": order_id, "user_id": current_user.id, "from_status": "pending", "to_status": "cancelled"}
@@ -1,56 +1,111 @@
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException, status # type: ignore
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional
+from pydantic import TypeAdapter # type: ignore
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status # type: ignore
 from sqlalchemy.ext.asyncio import AsyncSession # type: ignore # Import AsyncSession
-from sqlalchemy import select # type: ignore # Import select for async ORM queries
+from sqlalchemy import select, or_, and_ # type: ignore # Import select for async ORM queries
 from sqlalchemy.sql import func # type: ignore # For timestamps
 from prometheus_fastapi_instrumentator import Instrumentator # type: ignore
 
 # Import shared components
-from shared.database import get_db, Base, get_engine # get_db and get_engine are now async
-from shared.models import Product, User # User is needed for get_current_user
-from shared.schemas import ProductCreate, ProductUpdate, ProductResponse
-from shared.security import get_current_user
+from shared.database import get_session, get_sessionmaker, get_engine, dispose_engines, get_read_session, read_router, ReadYourWritesMiddleware # get_session and get_engine are now async
+from shared.migrate import check_schema_version
+from shared.query_metrics import install_query_metrics
+from shared.serialization import DefaultResponse, render, json_response
+from shared.read_models import ProductRead, PRODUCT_READ_COLUMNS, from_rows, read_columns, parse_fields, sparse_list_adapter
+from shared.debug import debug_router
+from shared.health import health_router, start_warm_up, stop_warm_up
+from shared.models import Product, OrderItem
+from shared.schemas import ProductCreate, ProductUpdate, ProductResponse, ProductSort, OrderStatus
+from shared.pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor, keyset_after
+from shared.http_cache import make_etag, conditional_response
+from shared.security import get_current_user, UserPrincipal, listen_for_principal_changes
+from shared.product_cache import product_cache, publish_product_changed, listen_for_product_changes
+from shared.notifications import PostgresListener
+from shared.outbox import OutboxConsumer, OutboxMessage
 from shared.config import DATABASE_URL
 
 app = FastAPI(
     title="Product Service",
     description="Manages product catalog operations.",
     version="1.0.0",
-    root_path="/products" # This is important for the Nginx proxy routing
+    root_path="/products", # This is important for the Nginx proxy routing
+    default_response_class=DefaultResponse, # orjson encoding
 )
 
 # --- PROMETHEUS INSTRUMENTATION START ---
 # Initialize Prometheus instrumentation on startup
 # This automatically exposes the /metrics endpoint
 Instrumentator().instrument(app).expose(app)
+install_query_metrics(app) # Per-route SQL statement counts and DB time, plus N+1 warnings
+app.add_middleware(ReadYourWritesMiddleware) # Keeps a client's reads on the primary right after it writes
 print("Prometheus metrics exposed at /metrics")
 # --- PROMETHEUS INSTRUMENTATION END ---
 
+# Operator-only /debug endpoints (slow queries, profiler); disabled unless DEBUG_ENDPOINTS_TOKEN is set
+app.include_router(debug_router)
+
+# Liveness (/health) and readiness (/ready) probes
+app.include_router(health_router)
+
+# Dedicated LISTEN connection that keeps the product and principal caches coherent across replicas
+notification_listener = PostgresListener(DATABASE_URL)
+listen_for_product_changes(notification_listener)
+listen_for_principal_changes(notification_listener)
+
+async def invalidate_stock_changes(db: AsyncSession, message: OutboxMessage):
+    # Checkout takes stock and cancelling returns it, so cached products show a stale stock_quantity.
+    # publish_product_changed notifies every replica when the consumer's offset commits.
+    if message.event_type == "order.created":
+        product_ids = {item["product_id"] for item in message.payload["items"]}
+    elif message.event_type == "order.status_changed" and message.payload["to_status"] == OrderStatus.cancelled.value:
+        product_ids = set(await db.scalars(select(OrderItem.product_id).where(OrderItem.order_id == message.aggregate_id)))
+    else:
+        return
+    for product_id in sorted(product_ids):
+        await publish_product_changed(db, product_id)
+
+# Order events from the outbox, delivered once across all replicas; NOTIFY on the listener wakes it
+stock_change_consumer = OutboxConsumer("product-cache-stock", invalidate_stock_changes)
+stock_change_consumer.listen(notification_listener)
+
 # Custom dependency for the product service's asynchronous database connection
-async def get_product_db():
-    # Await the asynchronous get_db from shared.database
-    async for session in get_db(DATABASE_URL):
-        yield session
+async def get_product_db(session: AsyncSession = Depends(get_session)):
+    # Same request-scoped session that get_current_user resolves, so a request uses one pooled connection
+    yield session
 
 @app.on_event("startup") # Deprecated, but keeping for now as it's in your original structure
 async def startup_event():
+    # The listener reconnects on its own, so it starts straight away
+    notification_listener.start()
+    # Measures replica lag (DATABASE_READ_URLS); reads use the primary until a replica is known to be current
+    read_router.start()
+    # Connect and check the schema in the background; /ready reports 200 once this has succeeded
+    start_warm_up(warm_up)
+
+async def warm_up():
     # Ensure the engine is created asynchronously
     engine = await get_engine(DATABASE_URL)
-    # This creates tables if they don't exist. For production, migrations (e.g., Alembic) are preferred.
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    print("Product service database tables checked/created.")
+    # The schema is owned by the migrations (python -m shared.migrate); only check it is current
+    await check_schema_version(engine)
+    stock_change_consumer.start(await get_sessionmaker(DATABASE_URL))
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_warm_up() # Report not ready first so traffic drains away
+    await stock_change_consumer.stop()
+    await notification_listener.stop()
+    await read_router.stop()
+    # Release the shared connection pool so Postgres sees clean disconnects
+    await dispose_engines()
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
 
 @app.post("/", response_model=ProductResponse, status_code=status.HTTP_201_CREATED)
 async def create_product(
     product: ProductCreate,
     db: AsyncSession = Depends(get_product_db), # Type hint with AsyncSession
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     # For simplicity, allowing any logged-in user to create products.
     # In a real app, you'd add admin/seller roles and checks here.
@@ -60,25 +115,127 @@ async def create_product(
     await db.refresh(db_product) # Await refresh
     return db_product
 
+# List pages load ProductRead rows (see shared.read_models) rather than ORM objects, and encode them
+# with one prebuilt adapter when FAST_SERIALIZATION is on.
+product_list_adapter = TypeAdapter(List[ProductResponse])
+
+# Keyset sort columns per sort order; the trailing id makes every key unique
+PRODUCT_SORT_KEYS = {
+    ProductSort.id: ((Product.id,), (int,)),
+    ProductSort.price: ((Product.price, Product.id), (Decimal, int)),
+    ProductSort.created_at: ((Product.created_at, Product.id), (datetime, int)),
+}
+
 @app.get("/", response_model=List[ProductResponse])
 async def read_products(
-    skip: int = 0,
-    limit: int = 100,
-    db: AsyncSession = Depends(get_product_db) # Type hint with AsyncSession
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    sort: ProductSort = ProductSort.id,
+    min_price: Optional[Decimal] = Query(None, ge=0),
+    max_price: Optional[Decimal] = Query(None, ge=0),
+    in_stock: bool = False,
+    skip: int = Query(0, ge=0, deprecated=True, description="Offset paging; ignored when a cursor is given"),
+    fields: Optional[str] = Query(None, description="Comma-separated subset of product fields to return, e.g. id,name,price"),
+    db: AsyncSession = Depends(get_read_session) # Type hint with AsyncSession
 ):
-    products_result = await db.execute(select(Product).offset(skip).limit(limit))
-    products = products_result.scalars().all() # Use scalars().all() for multiple results
-    return products
+    sort_columns, sort_types = PRODUCT_SORT_KEYS[sort]
+    field_names = parse_fields(fields, ProductResponse)
+    if field_names is None:
+        columns = PRODUCT_READ_COLUMNS
+    else:
+        # Sparse fieldset: only the requested columns, plus what the cursor and ETag need
+        needed = set(field_names) | {"id", "updated_at"} | {column.key for column in sort_columns}
+        columns = read_columns(ProductRead, Product, needed)
+    query = select(*columns).order_by(*sort_columns).limit(limit + 1) # One extra row tells us if there is a next page
+
+    if min_price is not None:
+        query = query.where(Product.price >= min_price)
+    if max_price is not None:
+        query = query.where(Product.price <= max_price)
+    if in_stock:
+        query = query.where(Product.stock_quantity > 0)
+    if cursor:
+        query = query.where(keyset_after(sort_columns, decode_cursor(cursor, sort.value, sort_types)))
+    elif skip:
+        query = query.offset(skip)
+
+    products_result = await db.execute(query)
+    products = products_result.all() if field_names else from_rows(ProductRead, products_result)
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            sort.value, [getattr(last, column.key) for column in sort_columns]
+        )
+
+    # The page's ETag changes whenever a row on it is added, removed or updated. No Last-Modified:
+    # the newest updated_at on the page does not move when a product is deleted, so If-Modified-Since
+    # would answer 304 for a page that still lists it.
+    etag = make_etag("products", field_names, [(p.id, p.updated_at) for p in products], response.headers.get(NEXT_CURSOR_HEADER))
+    not_modified = conditional_response(request, response, etag)
+    if not_modified is not None:
+        return not_modified
+    if field_names is not None:
+        # A different shape than response_model, so it is always encoded here
+        return json_response(sparse_list_adapter(ProductResponse, field_names), products, headers=dict(response.headers))
+    return render(product_list_adapter, products, response)
+
+def _search_rank(q: str):
+    # Full-text relevance plus trigram similarity of the name, so near-miss spellings still rank
+    return func.ts_rank(Product.search_vector, func.websearch_to_tsquery("english", q)) + func.similarity(Product.name, q)
+
+# Declared before /{product_id} so "search" is not parsed as a product id
+@app.get("/search", response_model=List[ProductResponse])
+async def search_products(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    db: AsyncSession = Depends(get_read_session) # Type hint with AsyncSession
+):
+    q = q.strip()
+    rank = _search_rank(q)
+    # Escape LIKE wildcards so the prefix match treats user input literally
+    prefix = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    query = (
+        select(Product, rank.label("rank"))
+        .where(or_(
+            Product.search_vector.op("@@")(func.websearch_to_tsquery("english", q)), # GIN tsvector index
+            Product.name.op("%")(q), # Trigram similarity (typo tolerant), GIN trigram index
+            Product.name.ilike(prefix, escape="\\"), # Prefix match, also served by the trigram index
+        ))
+        .order_by(rank.desc(), Product.id)
+        .limit(limit + 1)
+    )
+    if cursor:
+        last_rank, last_id = decode_cursor(cursor, "search", (float, int))
+        # Keyset for (rank DESC, id ASC)
+        query = query.where(or_(rank < last_rank, and_(rank == last_rank, Product.id > last_id)))
+
+    search_result = await db.execute(query)
+    rows = search_result.all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor("search", [rows[-1].rank, rows[-1].Product.id])
+    return [row.Product for row in rows]
 
 @app.get("/{product_id}", response_model=ProductResponse)
 async def read_product(
     product_id: int,
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_product_db) # Type hint with AsyncSession
 ):
-    product_result = await db.execute(select(Product).filter(Product.id == product_id))
-    product = product_result.scalar_one_or_none() # Use scalar_one_or_none for a single result
+    # Stays on the primary session: a miss refills the cache, and a lagging replica could refill an entry
+    # that was just invalidated. The cache, not a replica, is what scales this endpoint.
+    product = await product_cache.get(db, product_id) # Read-through cache, invalidated on update/delete
     if product is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    not_modified = conditional_response(request, response, make_etag("product", product.id, product.updated_at), product.updated_at)
+    if not_modified is not None:
+        return not_modified
     return product
 
 @app.put("/{product_id}", response_model=ProductResponse)
@@ -86,7 +243,7 @@ async def update_product(
     product_id: int,
     product_update: ProductUpdate,
     db: AsyncSession = Depends(get_product_db), # Type hint with AsyncSession
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     product_result = await db.execute(select(Product).filter(Product.id == product_id))
     db_product = product_result.scalar_one_or_none()
@@ -98,6 +255,7 @@ async def update_product(
     db_product.updated_at = func.now() # Manually update timestamp (SQLAlchemy `onupdate` handles this too)
     
     # db.add(db_product) # Not strictly necessary for updates if object is already tracked by session
+    await publish_product_changed(db, product_id) # Replicas drop their cached copy when this commits
     await db.commit() # Await commit
     await db.refresh(db_product) # Await refresh
     return db_product
@@ -106,7 +264,7 @@ async def update_product(
 async def delete_product(
     product_id: int,
     db: AsyncSession = Depends(get_product_db), # Type hint with AsyncSession
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     product_result = await db.execute(select(Product).filter(Product.id == product_id))
     db_product = product_result.scalar_one_or_none()
@@ -114,5 +272,6 @@ async def delete_product(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     
     await db.delete(db_product) # Await delete
+    await publish_product_changed(db, product_id) # Replicas drop their cached copy when this commits
     await db.commit() # Await commit
     return {} # Return empty dict for 204 No Content status
\ No newline at end of file
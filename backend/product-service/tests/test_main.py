@@ -1,17 +1,31 @@
 import pytest  # type: ignore
 import pytest_asyncio  # type: ignore
 from httpx import AsyncClient  # type: ignore
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker  # type: ignore
-from sqlalchemy import select  # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession  # type: ignore
+from sqlalchemy import select, text  # type: ignore
+from sqlalchemy.pool import NullPool  # type: ignore
 from uuid import uuid4  # add this import
+from datetime import datetime
+from decimal import Decimal
+import random
+import asyncio
+from prometheus_client import REGISTRY  # type: ignore
 
+from shared import config
 from shared.config import DATABASE_URL
+from shared.database import build_engine, get_session_local, get_session, get_engine, dispose_engines
+from shared.database import read_router, READ_YOUR_WRITES_COOKIE
 from shared.models import Product, User
+from shared.outbox import OutboxMessage
+from shared.pagination import encode_cursor
 from shared.security import get_current_user
-from main import app, get_db
+from shared.notifications import PostgresListener
+from shared.product_cache import product_cache, listen_for_product_changes, publish_product_changed, set_second_tier
+from main import app, get_product_db, invalidate_stock_changes
 
-engine = create_async_engine(DATABASE_URL, echo=False)
-SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+# Shared engine settings; NullPool because each test runs on its own event loop
+engine = build_engine(DATABASE_URL, poolclass=NullPool)
+SessionLocal = get_session_local(engine)
 
 @pytest_asyncio.fixture(scope="function")
 async def db_session():
@@ -23,7 +37,8 @@ async def db_session():
 async def client(db_session: AsyncSession):
     async def override_get_db():
         yield db_session
-    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_product_db] = override_get_db
+    app.dependency_overrides[get_session] = override_get_db  # Session behind get_read_session and get_current_user
 
     async with AsyncClient(app=app, base_url="http://test") as ac:
         yield ac
@@ -56,4 +71,253 @@ async def test_create_product(client: AsyncClient, db_session: AsyncSession, moc
     assert product_in_db is not None
     assert product_in_db.stock_quantity == 100
 
+@pytest.mark.asyncio
+async def test_engine_is_created_once_per_process():
+    first = await get_engine(DATABASE_URL)
+    second = await get_engine(DATABASE_URL)
+    assert first is second  # Same pool is reused, no new handshake per request
+    await dispose_engines()
+
+@pytest.mark.asyncio
+async def test_read_products_keyset_pagination(client: AsyncClient, db_session: AsyncSession):
+    # A price band no other test data uses, so the filter isolates our rows
+    base = Decimal(random.randint(1_000_000, 9_000_000))
+    prices = [base + Decimal("0.01") * i for i in (3, 1, 2)]
+    products = [Product(name=f"Keyset {uuid4().hex[:8]}", price=price, stock_quantity=i) for i, price in enumerate(prices)]
+    db_session.add_all(products)
+    await db_session.commit()
+    band = {"min_price": str(base), "max_price": str(base + 1), "sort": "price", "limit": 2}
+
+    first = await client.get("/", params=band)
+    assert first.status_code == 200
+    assert [p["price"] for p in first.json()] == [str(base + Decimal("0.01")), str(base + Decimal("0.02"))]
+    assert "x-next-cursor" in first.headers
+
+    second = await client.get("/", params={**band, "cursor": first.headers["x-next-cursor"]})
+    assert [p["price"] for p in second.json()] == [str(base + Decimal("0.03"))]
+    assert "x-next-cursor" not in second.headers
+
+    # in_stock drops the product created with stock_quantity=0
+    in_stock = await client.get("/", params={**band, "in_stock": "true"})
+    assert len(in_stock.json()) == 2
+
+    bad = await client.get("/", params={**band, "cursor": "not-a-cursor"})
+    assert bad.status_code == 400
+
+@pytest.mark.asyncio
+async def test_search_products_ranked_and_paginated(client: AsyncClient, db_session: AsyncSession):
+    has_trgm = await db_session.scalar(text("SELECT to_regprocedure('similarity(text,text)') IS NOT NULL"))
+    if not has_trgm:
+        pytest.skip("pg_trgm extension is not installed")
+    token = f"zeb{uuid4().hex[:8]}"
+    db_session.add_all([
+        Product(name=f"{token} lamp", description="desk lamp", price=Decimal("5.00"), stock_quantity=1),
+        Product(name="Plain lamp", description=f"pairs well with {token}", price=Decimal("5.00"), stock_quantity=1),
+        Product(name=f"{token} {token} shade", description=f"{token} shade", price=Decimal("5.00"), stock_quantity=1),
+    ])
+    await db_session.commit()
+
+    first = await client.get("/search", params={"q": token, "limit": 2})
+    assert first.status_code == 200
+    assert len(first.json()) == 2
+    second = await client.get("/search", params={"q": token, "limit": 2, "cursor": first.headers["x-next-cursor"]})
+    names = [p["name"] for p in first.json() + second.json()]
+    assert len(names) == 3
+    assert names[-1] == "Plain lamp"  # Description-only match ranks last
+
+    # Prefix match on the product name
+    prefix = await client.get("/search", params={"q": token[:6]})
+    assert any(p["name"].startswith(token) for p in prefix.json())
+
+@pytest.mark.asyncio
+async def test_read_product_is_cached_and_invalidated_on_update(client: AsyncClient, db_session: AsyncSession, mock_auth_user_override):
+    product = Product(name=f"Cached {uuid4().hex[:8]}", price=Decimal("3.00"), stock_quantity=4)
+    db_session.add(product)
+    await db_session.commit()
+
+    assert (await client.get(f"/{product.id}")).json()["stock_quantity"] == 4
+    assert product.id in product_cache.local
+
+    response = await client.put(f"/{product.id}", json={"name": product.name, "price": 3.0, "stock_quantity": 9})
+    assert response.status_code == 200
+    assert (await client.get(f"/{product.id}")).json()["stock_quantity"] == 9
+
+class DictCacheBackend:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ttl):
+        self.data[key] = value
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+@pytest.mark.asyncio
+async def test_product_cache_invalidated_by_notification(db_session: AsyncSession):
+    product = Product(name=f"Notified {uuid4().hex[:8]}", price=Decimal("3.00"), stock_quantity=4)
+    db_session.add(product)
+    await db_session.commit()
+    second_tier = DictCacheBackend()
+    set_second_tier(second_tier)
+    key = f"product:{product.id}"
+
+    listener = PostgresListener(DATABASE_URL)
+    listen_for_product_changes(listener)
+    listener.start()
+    try:
+        await asyncio.wait_for(listener.connected.wait(), timeout=5)
+        product.stock_quantity = 1
+        await publish_product_changed(db_session, product.id)
+        # A reader between the writer's eviction and its commit re-fills both tiers with the old row
+        async with SessionLocal() as reader:
+            assert (await product_cache.get(reader, product.id)).stock_quantity == 4
+        assert key in second_tier.data
+
+        # Both tiers are dropped once the writer commits
+        await db_session.commit()
+        for _ in range(50):
+            if product.id not in product_cache.local and key not in second_tier.data:
+                break
+            await asyncio.sleep(0.05)
+        assert product.id not in product_cache.local
+        assert key not in second_tier.data
+    finally:
+        set_second_tier(None)
+        await listener.stop()
+
+@pytest.mark.asyncio
+async def test_conditional_get_returns_304(client: AsyncClient, db_session: AsyncSession):
+    product = Product(name=f"Etag {uuid4().hex[:8]}", price=Decimal("7.00"), stock_quantity=1)
+    db_session.add(product)
+    await db_session.commit()
+
+    first = await client.get(f"/{product.id}")
+    assert first.status_code == 200
+    assert "max-age" in first.headers["cache-control"]
+    etag, last_modified = first.headers["etag"], first.headers["last-modified"]
+
+    assert (await client.get(f"/{product.id}", headers={"If-None-Match": etag})).status_code == 304
+    assert (await client.get(f"/{product.id}", headers={"If-Modified-Since": last_modified})).status_code == 304
+    assert (await client.get(f"/{product.id}", headers={"If-None-Match": '"stale"'})).status_code == 200
+
+    page = await client.get("/", params={"limit": 5})
+    revalidated = await client.get("/", params={"limit": 5}, headers={"If-None-Match": page.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+    # Lists are validated by ETag only: a deletion leaves the newest updated_at unchanged
+    params = {"limit": 5, "cursor": encode_cursor("id", [product.id - 1])} # a page that starts with the product
+    page = await client.get("/", params=params)
+    assert page.json()[0]["id"] == product.id
+    assert "last-modified" not in page.headers
+    assert (await client.get("/", params=params, headers={"If-Modified-Since": last_modified})).status_code == 200
+    await db_session.delete(product)
+    await db_session.commit()
+    after_delete = await client.get("/", params=params, headers={"If-None-Match": page.headers["etag"]})
+    assert after_delete.status_code == 200
+    assert product.id not in {p["id"] for p in after_delete.json()}
+
+@pytest.mark.asyncio
+async def test_fast_serialization_output_is_identical(client: AsyncClient, db_session: AsyncSession, monkeypatch):
+    db_session.add_all([
+        Product(name=f"Fast {i} {uuid4().hex[:8]}", description="Ünïcode", price=Decimal("12.30"), stock_quantity=i)
+        for i in range(3)
+    ])
+    await db_session.commit()
+
+    monkeypatch.setattr(config, "FAST_SERIALIZATION", False)
+    standard = await client.get("/", params={"limit": 3})
+    monkeypatch.setattr(config, "FAST_SERIALIZATION", True)
+    fast = await client.get("/", params={"limit": 3})
+
+    assert fast.status_code == standard.status_code == 200
+    assert fast.content == standard.content
+    assert fast.headers["content-type"] == standard.headers["content-type"]
+    assert fast.headers["etag"] == standard.headers["etag"]
+    assert fast.headers["x-next-cursor"] == standard.headers["x-next-cursor"]
+
+@pytest.mark.asyncio
+async def test_read_products_sparse_fieldsets(client: AsyncClient, db_session: AsyncSession):
+    products = [
+        Product(name=f"Sparse {i} {uuid4().hex[:8]}", description="desc", price=Decimal("3.50"), stock_quantity=1)
+        for i in range(3)
+    ]
+    db_session.add_all(products)
+    await db_session.commit()
+    params = {"min_price": "3.50", "max_price": "3.50", "sort": "price", "limit": 2}
+
+    full = await client.get("/", params=params)
+    sparse = await client.get("/", params={**params, "fields": "price,name"})
+    assert sparse.status_code == 200
+    assert [set(p) for p in sparse.json()] == [{"name", "price"}] * 2
+    assert [p["name"] for p in sparse.json()] == [p["name"] for p in full.json()]
+    assert sparse.headers["etag"] != full.headers["etag"] # A different representation of the same page
+    assert sparse.headers["x-next-cursor"] == full.headers["x-next-cursor"]
+
+    next_page = await client.get("/", params={**params, "fields": "name,price", "cursor": sparse.headers["x-next-cursor"]})
+    assert next_page.status_code == 200
+    assert all(set(p) == {"name", "price"} for p in next_page.json())
+
+    assert (await client.get("/", params={"fields": "name,password"})).status_code == 400
+
+@pytest.mark.asyncio
+async def test_prices_are_exact_fixed_point_strings(client: AsyncClient, mock_auth_user_override):
+    product_data = {"name": f"Money {uuid4().hex[:8]}", "price": "19.9", "stock_quantity": 1}
+    response = await client.post("/", json=product_data)
+    assert response.status_code == 201
+    assert response.json()["price"] == "19.90"
+
+    # More precision than NUMERIC(10, 2) holds is rejected rather than silently rounded
+    response = await client.post("/", json={**product_data, "price": "19.999"})
+    assert response.status_code == 422
+
+@pytest.mark.asyncio
+async def test_reads_use_replica_except_right_after_a_write(client: AsyncClient, mock_auth_user_override, monkeypatch):
+    # The local database stands in for a replica: not in recovery, so its lag measures 0
+    monkeypatch.setattr(read_router, "replicas", [DATABASE_URL])
+    monkeypatch.setattr(read_router, "lag", {DATABASE_URL: None})
+    monkeypatch.setattr(read_router, "in_use", {DATABASE_URL: 0})
+    await read_router.check_lag()
+    assert read_router.lag[DATABASE_URL] == 0
+
+    def read_sessions(target):
+        return REGISTRY.get_sample_value("db_read_sessions_total", {"target": target}) or 0
+    try:
+        replica_reads = read_sessions("replica")
+        assert (await client.get("/", params={"limit": 1})).status_code == 200
+        assert read_sessions("replica") == replica_reads + 1
+
+        headers = {"Authorization": "Bearer writer-token"}
+        created = await client.post("/", json={"name": f"RYW {uuid4().hex[:8]}", "price": "1.00", "stock_quantity": 1}, headers=headers)
+        assert created.status_code == 201
+        assert READ_YOUR_WRITES_COOKIE in created.cookies
+
+        primary_reads = read_sessions("primary")
+        await client.get("/", params={"limit": 1}) # Cookie
+        client.cookies.clear()
+        await client.get("/", params={"limit": 1}, headers=headers) # Same credentials, same process
+        assert read_sessions("primary") == primary_reads + 2
+        assert read_sessions("replica") == replica_reads + 1
+    finally:
+        await read_router.stop()
+        read_router.recent_writers.clear()
+
+@pytest.mark.asyncio
+async def test_order_events_invalidate_cached_stock(db_session: AsyncSession):
+    product = Product(name=f"Stock {uuid4().hex[:8]}", price=Decimal("2.00"), stock_quantity=5)
+    db_session.add(product)
+    await db_session.commit()
+    await product_cache.get(db_session, product.id)
+    assert product.id in product_cache.local
+
+    message = OutboxMessage(
+        id=1, txid=1, event_type="order.created", aggregate_type="order", aggregate_id=1,
+        payload={"order_id": 1, "items": [{"product_id": product.id, "quantity": 1}]}, created_at=datetime.now(),
+    )
+    await invalidate_stock_changes(db_session, message)
+    assert product.id not in product_cache.local
+
 # Add more product service tests same pattern...
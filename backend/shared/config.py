@@ -7,4 +7,90 @@ load_dotenv() # Load environment variables from .env file
 DATABASE_URL = os.environ["DATABASE_URL"]
 SECRET_KEY = os.environ["SECRET_KEY"]
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
\ No newline at end of file
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+# --- Worker processes ---
+# Number of gunicorn/uvicorn worker processes per replica (see shared/gunicorn_conf.py); 0 = one per CPU
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1")) or len(os.sched_getaffinity(0))
+
+# --- Database connection pool ---
+# One engine (and pool) is created per process and shared by every request.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30")) # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800")) # seconds before a connection is replaced
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Pooled connections one replica may hold across all of its workers; 0 = no cap (each worker gets the full pool).
+# Give every replica of every service its share of Postgres max_connections here when running several workers.
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "0"))
+
+# --- Read replicas ---
+# Comma-separated read-only replica URLs for endpoints that use get_read_session; empty = read from the primary
+DATABASE_READ_URLS = [url.strip() for url in os.getenv("DATABASE_READ_URLS", "").split(",") if url.strip()]
+READ_REPLICA_MAX_LAG_SECONDS = float(os.getenv("READ_REPLICA_MAX_LAG_SECONDS", "2")) # replicas further behind are skipped
+READ_REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv("READ_REPLICA_CHECK_INTERVAL_SECONDS", "2")) # how often lag is measured
+READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", "10")) # reads stay on the primary this long after a client writes
+
+# --- Startup ---
+# Connection attempts back off exponentially with full jitter: attempt n sleeps uniform(0, min(MAX, BASE * 2**n))
+DB_CONNECT_MAX_ATTEMPTS = int(os.getenv("DB_CONNECT_MAX_ATTEMPTS", "10"))
+DB_CONNECT_BACKOFF_BASE = float(os.getenv("DB_CONNECT_BACKOFF_BASE", "0.1")) # seconds
+DB_CONNECT_BACKOFF_MAX = float(os.getenv("DB_CONNECT_BACKOFF_MAX", "5")) # seconds
+READINESS_CHECK_TIMEOUT = float(os.getenv("READINESS_CHECK_TIMEOUT", "1")) # seconds /ready waits for the database
+
+# --- Authenticated principal cache (username -> user) ---
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "60")) # 0 disables the cache
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))
+
+# --- Password hashing worker pool ---
+# bcrypt runs off the event loop in a bounded pool; requests beyond workers + queue get a 503.
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread") # "thread" or "process"
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+
+# --- Product read-through cache (invalidated via Postgres LISTEN/NOTIFY) ---
+PRODUCT_CACHE_TTL_SECONDS = int(os.getenv("PRODUCT_CACHE_TTL_SECONDS", "300")) # 0 disables the cache
+PRODUCT_CACHE_MAX_SIZE = int(os.getenv("PRODUCT_CACHE_MAX_SIZE", "10000"))
+
+# --- HTTP caching of catalog responses (browser and nginx micro-cache) ---
+CATALOG_CACHE_MAX_AGE = int(os.getenv("CATALOG_CACHE_MAX_AGE", "5")) # seconds
+CATALOG_CACHE_STALE_WHILE_REVALIDATE = int(os.getenv("CATALOG_CACHE_STALE_WHILE_REVALIDATE", "30")) # seconds
+
+# --- Cart batch operations ---
+CART_BATCH_MAX_ITEMS = int(os.getenv("CART_BATCH_MAX_ITEMS", "100"))
+
+# --- Order export ---
+ORDER_EXPORT_BATCH_SIZE = int(os.getenv("ORDER_EXPORT_BATCH_SIZE", "1000")) # rows fetched per server-side cursor round trip
+
+# --- Order status changes ---
+ORDER_STATUS_BATCH_MAX_IDS = int(os.getenv("ORDER_STATUS_BATCH_MAX_IDS", "10000"))
+# Fulfilment tools send this in X-Operator-Token to move orders through any transition; without it
+# customers can only cancel their own pending orders, and nobody can use the bulk endpoint
+ORDER_OPERATOR_TOKEN = os.getenv("ORDER_OPERATOR_TOKEN", "")
+
+# --- Idempotency keys ---
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", "86400")) # how long a key can be replayed
+IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS = int(os.getenv("IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS", "3600"))
+
+# --- Per-request SQL metrics ---
+QUERY_REPEAT_WARN_THRESHOLD = int(os.getenv("QUERY_REPEAT_WARN_THRESHOLD", "10")) # warn when one request runs the same statement more often (likely N+1)
+
+# --- Slow-query log ---
+SLOW_QUERY_THRESHOLD_MS = int(os.getenv("SLOW_QUERY_THRESHOLD_MS", "500")) # 0 disables the slow-query log
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "0")) # fraction of slow SELECTs to EXPLAIN ANALYZE
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100")) # entries kept for /debug/slow-queries
+
+# --- Debug endpoints ---
+# /debug/* answers 404 unless a token is configured; requests must send it in X-Debug-Token
+DEBUG_ENDPOINTS_TOKEN = os.getenv("DEBUG_ENDPOINTS_TOKEN", "")
+DEBUG_PROFILE_MAX_SECONDS = int(os.getenv("DEBUG_PROFILE_MAX_SECONDS", "60")) # longest /debug/profile run
+
+# --- Response serialization ---
+# When enabled, list endpoints encode column rows straight to JSON bytes with a prebuilt TypeAdapter
+# instead of going through FastAPI's response_model validation and encoding. Output is identical.
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "false").lower() in ("1", "true", "yes")
+
+# --- Transactional outbox ---
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100")) # events a consumer handles per transaction
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", "1")) # fallback when no NOTIFY arrives
+OUTBOX_RETENTION_HOURS = int(os.getenv("OUTBOX_RETENTION_HOURS", "168")) # delivered events are kept this long
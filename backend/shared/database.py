@@ -1,39 +1,138 @@
 import asyncio # For asynchronous sleep in retry logic
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker # type: ignore # Import async SQLAlchemy components
+import hashlib
+import random
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+from fastapi import Depends, Request # type: ignore
+from prometheus_client import Counter, Gauge # type: ignore
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker # type: ignore # Import async SQLAlchemy components
 from sqlalchemy.orm import declarative_base # type: ignore # For Base
 from sqlalchemy import text # type: ignore # For simple query to test connection
+from sqlalchemy.engine import make_url # type: ignore
+
+from .cache import TTLCache
+from .query_metrics import instrument_engine
+from .config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+from .config import DB_CONNECT_MAX_ATTEMPTS, DB_CONNECT_BACKOFF_BASE, DB_CONNECT_BACKOFF_MAX
+from .config import WEB_CONCURRENCY, DB_CONNECTION_BUDGET
+from .config import DATABASE_READ_URLS, READ_REPLICA_MAX_LAG_SECONDS, READ_REPLICA_CHECK_INTERVAL_SECONDS, READ_YOUR_WRITES_SECONDS
 
 # Base needs to be defined in one central place and imported by models
 # It's good practice to import declarative_base directly from sqlalchemy.orm as of SQLAlchemy 2.0
 Base = declarative_base()
 
+# Process-wide engines and session factories, keyed by database URL.
+# An engine owns a connection pool, so it must be created once and reused by every request.
+_engines: Dict[str, AsyncEngine] = {}
+_session_factories: Dict[str, async_sessionmaker] = {}
+_engine_lock = asyncio.Lock()
+
+def worker_pool_limits(budget: int, workers: int, pool_size: int, max_overflow: int) -> Tuple[int, int]:
+    """
+    Returns (pool_size, max_overflow) for one worker process so that all `workers` together
+    stay within `budget` pooled connections. A budget of 0 leaves the configured sizes alone.
+    """
+    if budget <= 0:
+        return pool_size, max_overflow
+    per_worker = max(1, budget // workers)
+    size = min(pool_size, per_worker)
+    return size, max(0, min(max_overflow, per_worker - size))
+
+# Every worker process builds its own engine after the fork, so these limits apply per worker
+WORKER_POOL_SIZE, WORKER_MAX_OVERFLOW = worker_pool_limits(DB_CONNECTION_BUDGET, WEB_CONCURRENCY, DB_POOL_SIZE, DB_MAX_OVERFLOW)
+
+def build_engine(db_url: str, **overrides) -> AsyncEngine:
+    """
+    Builds an AsyncEngine with the pool settings from shared.config.
+    Keyword arguments override the configured defaults (e.g. poolclass=NullPool in tests).
+    Does not connect; use get_engine() for the shared, verified engine.
+    """
+    options = {
+        "echo": False, # 'echo=True' for debugging SQL
+        "pool_size": WORKER_POOL_SIZE,
+        "max_overflow": WORKER_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if "poolclass" in overrides:
+        # Pool sizing arguments only apply to QueuePool
+        for key in ("pool_size", "max_overflow", "pool_timeout"):
+            options.pop(key)
+    options.update(overrides)
+    engine = create_async_engine(db_url, **options)
+    instrument_engine(engine) # Per-request statement counts and the slow-query log (SLOW_QUERY_THRESHOLD_MS)
+    return engine
+
+def backoff_delay(attempt: int, base: float = DB_CONNECT_BACKOFF_BASE, cap: float = DB_CONNECT_BACKOFF_MAX) -> float:
+    """
+    Seconds to wait before retry number `attempt` (0-based): exponential backoff with full jitter.
+    The first retries come quickly, so a replica starting next to a database that is almost up
+    connects within a fraction of a second; the jitter keeps many replicas from retrying in lockstep.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def peek_engine(db_url: str) -> Optional[AsyncEngine]:
+    """
+    Returns the shared engine for db_url if get_engine() has already created it, without connecting.
+    """
+    return _engines.get(db_url)
+
+def _warn_if_pool_exceeds(max_connections: int):
+    replica_connections = WEB_CONCURRENCY * (WORKER_POOL_SIZE + WORKER_MAX_OVERFLOW)
+    if replica_connections > max_connections:
+        print(
+            f"WARNING: {WEB_CONCURRENCY} workers x {WORKER_POOL_SIZE + WORKER_MAX_OVERFLOW} pooled connections "
+            f"can exceed Postgres max_connections={max_connections} on their own; set DB_CONNECTION_BUDGET."
+        )
+
 # Function to get the SQLAlchemy AsyncEngine
-async def get_engine(db_url: str):
+async def get_engine(db_url: str) -> AsyncEngine:
     """
-    Attempts to connect to the database asynchronously with retries.
+    Returns the process-wide engine for db_url, creating it on first use.
+    The first call verifies connectivity asynchronously with retries; later calls are free.
     """
-    max_retries = 10
-    retry_interval = 5 # seconds
-    engine = None # Initialize engine outside the loop
+    engine = _engines.get(db_url)
+    if engine is not None:
+        return engine
 
-    for i in range(max_retries):
-        try:
-            # Create the async engine
-            engine = create_async_engine(db_url, echo=False) # 'echo=True' for debugging SQL
-
-            # Test connection asynchronously by executing a simple query
-            async with engine.connect() as conn:
-                await conn.scalar(text("SELECT 1")) # Executes a trivial query to verify connection
-            print(f"Database connection successful after {i+1} attempts.")
-            return engine
-        except Exception as e:
-            print(f"Database connection failed (attempt {i+1}/{max_retries}): {e}")
-            if i < max_retries - 1:
-                await asyncio.sleep(retry_interval) # Use asyncio.sleep for non-blocking delay
-            else:
-                # Re-raise if max retries reached, indicating persistent connection issue
-                raise ConnectionRefusedError(f"Failed to connect to database after {max_retries} attempts: {e}")
-    return None # This line should theoretically not be reached if exceptions are handled
+    async with _engine_lock:
+        # Another coroutine may have created the engine while we waited for the lock
+        if db_url in _engines:
+            return _engines[db_url]
+
+        max_retries = DB_CONNECT_MAX_ATTEMPTS
+        engine = build_engine(db_url)
+
+        for i in range(max_retries):
+            try:
+                # Test connection asynchronously by executing a simple query
+                async with engine.connect() as conn:
+                    await conn.scalar(text("SELECT 1")) # Executes a trivial query to verify connection
+                    max_connections = int(await conn.scalar(text("SHOW max_connections")))
+                print(f"Database connection successful after {i+1} attempts.")
+                _warn_if_pool_exceeds(max_connections)
+                _engines[db_url] = engine
+                return engine
+            except Exception as e:
+                print(f"Database connection failed (attempt {i+1}/{max_retries}): {e}")
+                if i < max_retries - 1:
+                    await asyncio.sleep(backoff_delay(i)) # Use asyncio.sleep for non-blocking delay
+                else:
+                    await engine.dispose()
+                    # Re-raise if max retries reached, indicating persistent connection issue
+                    raise ConnectionRefusedError(f"Failed to connect to database after {max_retries} attempts: {e}")
+    raise ConnectionRefusedError("Could not obtain a database engine.") # Not reached; keeps type checkers happy
+
+async def dispose_engines():
+    """
+    Closes every pooled connection. Call from each service's shutdown event.
+    """
+    for engine in list(_engines.values()):
+        await engine.dispose()
+    _engines.clear()
+    _session_factories.clear()
+    print("Database engines disposed.")
 
 # Function to get a configured AsyncSessionLocal class
 def get_session_local(engine_obj):
@@ -48,20 +147,220 @@ def get_session_local(engine_obj):
         expire_on_commit=False,
     )
 
+async def get_sessionmaker(db_url: str) -> async_sessionmaker:
+    """
+    Returns the cached session factory bound to the shared engine for db_url.
+    """
+    factory = _session_factories.get(db_url)
+    if factory is None:
+        factory = get_session_local(await get_engine(db_url))
+        _session_factories[db_url] = factory
+    return factory
+
 # Dependency to get the DB session for FastAPI endpoints
 async def get_db(db_url: str):
     """
     FastAPI dependency that provides an asynchronous database session.
-    Manages session lifecycle (creation and closing).
+    Manages session lifecycle (creation and closing); connections come from the shared pool.
     """
-    engine = await get_engine(db_url) # Await the asynchronous get_engine function
-    if not engine:
-        # If get_engine didn't return an engine after retries, raise an error
-        raise ConnectionRefusedError("Could not obtain a database engine.")
-
-    SessionLocal = get_session_local(engine)
+    SessionLocal = await get_sessionmaker(db_url)
     async with SessionLocal() as db: # Use 'async with' for AsyncSession
         try:
             yield db
         finally:
-            await db.close() # Ensure the async session is properly closed
\ No newline at end of file
+            await db.close() # Ensure the async session is properly closed
+
+async def get_session():
+    """
+    Request-scoped session on the service's primary DATABASE_URL.
+    Endpoints and shared dependencies (e.g. get_current_user) that depend on this
+    receive the same session within one request, so they share a pooled connection.
+    """
+    async for session in get_db(DATABASE_URL):
+        yield session
+
+# --- Read replicas ---
+# Read-only endpoints take get_read_session instead of get_session. Each request goes to the eligible
+# replica with the fewest sessions open in this process (ties rotate round-robin). A replica is
+# eligible while its last measured replay lag is within READ_REPLICA_MAX_LAG_SECONDS; replicas that
+# are unreachable or not yet measured are skipped, and with none eligible reads use the primary.
+# After a client writes, its reads stay on the primary for READ_YOUR_WRITES_SECONDS so it sees its
+# own changes. The write is remembered in this process (keyed by the Authorization header) and in a
+# cookie, so a browser also reads its writes through the other services and worker processes.
+
+READ_YOUR_WRITES_COOKIE = "read_primary_until"
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+DB_REPLICA_LAG_SECONDS = Gauge(
+    "db_replica_lag_seconds",
+    "Replay lag last measured on each read replica (-1 while unreachable).",
+    ["replica"],
+    multiprocess_mode="max",
+)
+DB_READ_SESSIONS = Counter("db_read_sessions_total", "Sessions opened by get_read_session, by target.", ["target"])
+
+# Zero on a primary (e.g. a stand-in instance) or a standby that has replayed everything it received
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+def _replica_label(db_url: str) -> str:
+    url = make_url(db_url)
+    return f"{url.host or 'local'}:{url.port or 5432}/{url.database}"
+
+class ReplicaRouter:
+    def __init__(
+        self,
+        replica_urls: Sequence[str],
+        max_lag: float = READ_REPLICA_MAX_LAG_SECONDS,
+        check_interval: float = READ_REPLICA_CHECK_INTERVAL_SECONDS,
+        read_your_writes_seconds: float = READ_YOUR_WRITES_SECONDS,
+    ):
+        self.replicas: List[str] = list(replica_urls)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.lag: Dict[str, Optional[float]] = {url: None for url in self.replicas} # None = unknown or unreachable
+        self.in_use: Dict[str, int] = {url: 0 for url in self.replicas}
+        self.recent_writers = TTLCache(maxsize=100_000, ttl=read_your_writes_seconds)
+        self._next = 0
+        self._engines: Dict[str, AsyncEngine] = {}
+        self._session_factories: Dict[str, async_sessionmaker] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def record_write(self, writer_key: str):
+        self.recent_writers.set(writer_key, True)
+
+    def choose(self, writer_key: Optional[str] = None, primary_until: float = 0) -> Optional[str]:
+        """
+        Returns the replica URL to read from, or None to read from the primary.
+        `primary_until` is a unix time before which the client asked to read its own writes.
+        """
+        if primary_until > time.time() or (writer_key is not None and writer_key in self.recent_writers):
+            return None
+        eligible = [url for url in self.replicas if self.lag[url] is not None and self.lag[url] <= self.max_lag]
+        if not eligible:
+            return None
+        # Least sessions in use; rotating the starting point spreads ties round-robin
+        self._next = (self._next + 1) % len(eligible)
+        rotated = eligible[self._next:] + eligible[:self._next]
+        return min(rotated, key=lambda url: self.in_use[url])
+
+    def engine(self, db_url: str) -> AsyncEngine:
+        engine = self._engines.get(db_url)
+        if engine is None:
+            engine = self._engines[db_url] = build_engine(db_url)
+            self._session_factories[db_url] = get_session_local(engine)
+        return engine
+
+    def sessionmaker(self, db_url: str) -> async_sessionmaker:
+        self.engine(db_url)
+        return self._session_factories[db_url]
+
+    async def check_lag(self):
+        """
+        Measures every replica's replay lag once. A replica that does not answer within
+        check_interval is marked unknown and skipped until it answers again.
+        """
+        for url in self.replicas:
+            try:
+                async with asyncio.timeout(self.check_interval):
+                    async with self.engine(url).connect() as conn:
+                        lag = await conn.scalar(REPLICA_LAG_SQL)
+                self.lag[url] = float(lag) if lag is not None else None
+            except Exception as e:
+                if self.lag[url] is not None:
+                    print(f"Read replica {_replica_label(url)} is unavailable: {e}")
+                self.lag[url] = None
+            DB_REPLICA_LAG_SECONDS.labels(replica=_replica_label(url)).set(-1 if self.lag[url] is None else self.lag[url])
+
+    async def _run(self):
+        while True:
+            await self.check_lag()
+            await asyncio.sleep(self.check_interval)
+
+    def start(self):
+        if self._task is None and self.replicas:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for engine in self._engines.values():
+            await engine.dispose()
+        self._engines.clear()
+        self._session_factories.clear()
+
+read_router = ReplicaRouter(DATABASE_READ_URLS)
+
+def writer_key(headers) -> Optional[str]:
+    """
+    Identifies the client for read-your-writes by its credentials (a digest, not the token itself).
+    `headers` is a Starlette Headers mapping.
+    """
+    authorization = headers.get("authorization")
+    if not authorization:
+        return None
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+def _primary_until(request: Request) -> float:
+    try:
+        return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0))
+    except ValueError:
+        return 0
+
+async def get_read_session(request: Request, primary: AsyncSession = Depends(get_session)):
+    """
+    Request-scoped session for read-only endpoints; see the read replica notes above.
+    Falls back to the request's primary session, so with no DATABASE_READ_URLS nothing changes.
+    """
+    db_url = read_router.choose(writer_key(request.headers), _primary_until(request))
+    if db_url is None:
+        DB_READ_SESSIONS.labels(target="primary").inc()
+        yield primary
+        return
+    DB_READ_SESSIONS.labels(target="replica").inc()
+    read_router.in_use[db_url] += 1
+    try:
+        async with read_router.sessionmaker(db_url)() as db:
+            yield db
+    finally:
+        read_router.in_use[db_url] -= 1
+
+class ReadYourWritesMiddleware:
+    """
+    Pure ASGI middleware that remembers every write request (any method other than GET/HEAD/OPTIONS)
+    and sets the read-your-writes cookie on its response.
+    """
+
+    def __init__(self, app, router: ReplicaRouter = read_router):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS or not self.router.replicas:
+            await self.app(scope, receive, send)
+            return
+
+        key = writer_key(Request(scope).headers)
+        if key is not None:
+            self.router.record_write(key)
+        window = int(self.router.read_your_writes_seconds)
+        cookie = f"{READ_YOUR_WRITES_COOKIE}={time.time() + window:.0f}; Max-Age={window}; Path=/; HttpOnly; SameSite=Lax"
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            if key is not None:
+                self.router.record_write(key) # Restart the window once the write has committed
@@ -0,0 +1,45 @@
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status # type: ignore
+from fastapi.responses import PlainTextResponse # type: ignore
+
+from .config import DEBUG_ENDPOINTS_TOKEN, DEBUG_PROFILE_MAX_SECONDS
+from .profiling import ProfileMode, ProfilerBusy, run_profile
+from .slow_queries import slow_query_log
+
+# --- Operator-only debug endpoints ---
+# Mounted by every service with app.include_router(debug_router). Without DEBUG_ENDPOINTS_TOKEN the
+# endpoints do not exist as far as clients can tell (404); with it, callers must send X-Debug-Token.
+
+DEBUG_TOKEN_HEADER = "X-Debug-Token"
+
+async def require_debug_token(debug_token: Optional[str] = Header(None, alias=DEBUG_TOKEN_HEADER)):
+    if not DEBUG_ENDPOINTS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if debug_token is None or not secrets.compare_digest(debug_token, DEBUG_ENDPOINTS_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid debug token")
+
+debug_router = APIRouter(prefix="/debug", tags=["debug"], dependencies=[Depends(require_debug_token)], include_in_schema=False)
+
+@debug_router.get("/slow-queries")
+async def get_slow_queries():
+    # Newest first; "explain" is filled in asynchronously for sampled SELECTs
+    return {
+        "threshold_ms": slow_query_log.threshold_ms,
+        "queries": slow_query_log.entries(),
+    }
+
+@debug_router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10, gt=0, le=DEBUG_PROFILE_MAX_SECONDS),
+    mode: ProfileMode = Query(ProfileMode.sample, description="sample: collapsed stacks for flamegraphs; cprofile: pstats text"),
+    interval_ms: float = Query(5, ge=1, le=1000, description="Sampling interval (sample mode)"),
+    limit: int = Query(100, ge=1, le=2000, description="Functions listed (cprofile mode)"),
+):
+    # Profiles this worker process only; with several workers, repeat the call to reach the others
+    try:
+        report = await run_profile(mode, seconds, interval=interval_ms / 1000, limit=limit)
+    except ProfilerBusy:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already running")
+    return PlainTextResponse(report)
@@ -0,0 +1,39 @@
+"""
+Gunicorn settings for serving a service with several Uvicorn worker processes:
+
+    gunicorn main:app -c python:shared.gunicorn_conf
+
+WEB_CONCURRENCY sets the number of workers and PORT the port to bind. The app is not preloaded:
+each worker imports it after the fork and builds its own engine, pool and background tasks, since
+none of those survive a fork. With more than one worker, Prometheus metrics are kept in
+PROMETHEUS_MULTIPROC_DIR and /metrics aggregates every worker.
+"""
+import os
+import shutil
+
+from shared.config import WEB_CONCURRENCY
+
+workers = WEB_CONCURRENCY
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+preload_app = False
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30")) # seconds a worker gets to finish in-flight requests
+timeout = int(os.getenv("WORKER_TIMEOUT", "60")) # an unresponsive worker is restarted after this long
+accesslog = "-"
+
+# Must be set before any worker imports prometheus_client, which picks its storage on import
+if workers > 1:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus-multiproc")
+
+def on_starting(server):
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        # Files left by a previous run would be added to this run's counters
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess # type: ignore
+        # Drops the worker's live gauges (queue depth, readiness) from the aggregate
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+from fastapi import APIRouter, Depends, status # type: ignore
+from prometheus_client import Gauge # type: ignore
+from sqlalchemy import text # type: ignore
+from sqlalchemy.ext.asyncio import AsyncEngine # type: ignore
+from sqlalchemy.pool import QueuePool # type: ignore
+
+from .config import DATABASE_URL, READINESS_CHECK_TIMEOUT
+from .database import WORKER_MAX_OVERFLOW, backoff_delay, peek_engine
+from .serialization import DefaultResponse
+
+# --- Liveness, readiness and startup timing ---
+# /health is liveness: the process is up and its event loop answers. It never touches the database,
+# so a slow database does not get healthy replicas restarted. /ready is readiness: startup work has
+# finished and the pool can hand out a connection, so the replica may receive traffic.
+# Startup work runs in the background (start_warm_up) and the server starts accepting connections at
+# once; orchestrators route to the replica as soon as /ready turns 200.
+
+# With several workers (shared/gunicorn_conf.py) the timings report the slowest worker and
+# service_ready is 1 only while every live worker is ready
+SERVICE_IMPORT_SECONDS = Gauge(
+    "service_import_duration_seconds",
+    "Seconds from process start until the application began starting up (interpreter, imports, app setup).",
+    multiprocess_mode="max",
+)
+SERVICE_STARTUP_SECONDS = Gauge(
+    "service_startup_duration_seconds",
+    "Seconds from process start until the service first reported ready.",
+    multiprocess_mode="max",
+)
+SERVICE_READY = Gauge("service_ready", "1 while the service reports ready on /ready, else 0.", multiprocess_mode="livemin")
+
+def _process_start_time() -> float:
+    """
+    Wall-clock time the process started, read from /proc so time spent importing before this module
+    was loaded is counted too. Falls back to the time this module was imported.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 (starttime) is in clock ticks since boot; the command name may contain spaces
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        return boot_time + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time()
+
+PROCESS_START_TIME = _process_start_time()
+
+class Readiness:
+    def __init__(self):
+        self.ready = False
+        self.reason = "starting"
+        self._task: Optional[asyncio.Task] = None
+
+    def mark_ready(self):
+        if not self.ready:
+            SERVICE_STARTUP_SECONDS.set(time.time() - PROCESS_START_TIME)
+        self.ready = True
+        self.reason = ""
+        SERVICE_READY.set(1)
+
+    def mark_not_ready(self, reason: str):
+        self.ready = False
+        self.reason = reason
+        SERVICE_READY.set(0)
+
+readiness = Readiness()
+
+async def _warm_up_until_ready(warm_up: Callable[[], Awaitable[None]]):
+    attempt = 0
+    while True:
+        try:
+            await warm_up()
+            break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            readiness.reason = f"startup failed: {e}"
+            print(f"Service startup failed (attempt {attempt + 1}), retrying: {e}")
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+    readiness.mark_ready()
+    print(f"Service ready {time.time() - PROCESS_START_TIME:.2f}s after process start.")
+
+def start_warm_up(warm_up: Callable[[], Awaitable[None]]):
+    """
+    Call from the startup event. Records the import time, then runs `warm_up` (connect the engine,
+    check the schema, ...) in the background, retrying with backoff until it succeeds and the
+    service is marked ready. The server does not wait for it, so /health answers immediately.
+    """
+    SERVICE_IMPORT_SECONDS.set(time.time() - PROCESS_START_TIME)
+    readiness.mark_not_ready("starting")
+    readiness._task = asyncio.create_task(_warm_up_until_ready(warm_up))
+
+async def stop_warm_up():
+    """
+    Call first in the shutdown event: reports not ready so traffic drains, and stops a warm-up
+    that is still retrying.
+    """
+    readiness.mark_not_ready("shutting down")
+    task, readiness._task = readiness._task, None
+    if task is not None and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+def get_readiness_engine() -> Optional[AsyncEngine]:
+    return peek_engine(DATABASE_URL)
+
+def _pool_exhausted(engine: AsyncEngine) -> bool:
+    pool = engine.sync_engine.pool
+    if not isinstance(pool, QueuePool):
+        return False
+    # QueuePool.overflow() counts connections opened beyond pool_size (negative until the pool fills).
+    # The shared engine is built with WORKER_MAX_OVERFLOW (see build_engine); a negative value means unlimited.
+    return WORKER_MAX_OVERFLOW >= 0 and pool.checkedin() == 0 and pool.overflow() >= WORKER_MAX_OVERFLOW
+
+health_router = APIRouter(tags=["health"])
+
+@health_router.get("/health")
+async def health_check():
+    return {"status": "healthy"}
+
+@health_router.get("/ready")
+async def readiness_check(engine: Optional[AsyncEngine] = Depends(get_readiness_engine)):
+    def not_ready(reason: str):
+        return DefaultResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "not ready", "reason": reason})
+
+    if not readiness.ready:
+        return not_ready(readiness.reason)
+    if engine is None:
+        return not_ready("no database engine")
+    if _pool_exhausted(engine):
+        return not_ready("database pool exhausted")
+    try:
+        async with asyncio.timeout(READINESS_CHECK_TIMEOUT):
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+    except Exception as e:
+        return not_ready(f"database unavailable: {e.__class__.__name__}")
+    return {"status": "ready"}
@@ -0,0 +1,106 @@
+import asyncio
+from datetime import timedelta
+from typing import Any, Optional
+
+from fastapi.responses import JSONResponse # type: ignore
+from sqlalchemy import select, update, delete # type: ignore
+from sqlalchemy.dialects.postgresql import insert as pg_insert # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker # type: ignore
+from sqlalchemy.sql import func # type: ignore
+
+from .config import IDEMPOTENCY_KEY_TTL_SECONDS, IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS
+from .models import IdempotencyKey
+
+# --- Idempotency-Key support ---
+# The key is claimed with an INSERT inside the same transaction as the work it protects, and the
+# response is stored before that transaction commits. A concurrent duplicate blocks on the unique
+# index until the first request finishes: if it committed, the duplicate replays its response;
+# if it rolled back, the duplicate claims the key and does the work itself.
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+IDEMPOTENT_REPLAY_HEADER = "Idempotent-Replayed"
+
+async def claim_idempotency_key(db: AsyncSession, user_id: int, key: str) -> Optional[JSONResponse]:
+    """
+    Claims `key` for `user_id` in the session's transaction. Returns None when the caller should go
+    ahead (and later call store_idempotent_response), or the stored response to replay.
+    """
+    expires_at = func.now() + timedelta(seconds=IDEMPOTENCY_KEY_TTL_SECONDS)
+    claim = (
+        pg_insert(IdempotencyKey)
+        .values(user_id=user_id, key=key, expires_at=expires_at)
+        # An expired key that has not been purged yet is taken over as if it were new
+        .on_conflict_do_update(
+            index_elements=[IdempotencyKey.user_id, IdempotencyKey.key],
+            set_={"expires_at": expires_at, "order_id": None, "response_status": None, "response_body": None},
+            where=IdempotencyKey.expires_at < func.now(),
+        )
+        .returning(IdempotencyKey.id)
+    )
+    if await db.scalar(claim) is not None:
+        return None
+
+    stored_result = await db.execute(
+        select(IdempotencyKey.response_status, IdempotencyKey.response_body)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+    )
+    stored = stored_result.one()
+    return JSONResponse(
+        status_code=stored.response_status,
+        content=stored.response_body,
+        headers={IDEMPOTENT_REPLAY_HEADER: "true"},
+    )
+
+async def store_idempotent_response(
+    db: AsyncSession, user_id: int, key: str, status_code: int, body: Any, order_id: Optional[int] = None
+):
+    """
+    Records the response for a claimed key; call before committing the protected transaction.
+    `body` must already be JSON-compatible (e.g. passed through jsonable_encoder).
+    """
+    await db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+        .values(order_id=order_id, response_status=status_code, response_body=body),
+        execution_options={"synchronize_session": False},
+    )
+
+async def purge_expired_idempotency_keys(db: AsyncSession, batch_size: int = 1000) -> int:
+    """
+    Deletes up to batch_size expired keys and commits. SKIP LOCKED lets several replicas purge at once.
+    """
+    expired = (
+        select(IdempotencyKey.id)
+        .where(IdempotencyKey.expires_at < func.now())
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    deleted_result = await db.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.id.in_(expired)).returning(IdempotencyKey.id),
+        execution_options={"synchronize_session": False},
+    )
+    deleted = len(deleted_result.all())
+    await db.commit()
+    return deleted
+
+async def run_idempotency_key_cleanup(session_factory: async_sessionmaker, interval: float = IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS):
+    """
+    Background loop for a service's startup event; cancel the task on shutdown.
+    """
+    while True:
+        try:
+            async with session_factory() as db:
+                total = 0
+                batch_size = 1000
+                while True:
+                    deleted = await purge_expired_idempotency_keys(db, batch_size)
+                    total += deleted
+                    if deleted < batch_size:
+                        break
+            if total:
+                print(f"Purged {total} expired idempotency keys.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Idempotency key cleanup failed: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,106 @@
+"""
+Schema migrations (Alembic). The schema is owned by these migrations, not by the services:
+run them once per deploy, before the services start (the compose "migrate" service does this).
+
+    python -m shared.migrate                # upgrade to the latest revision
+    python -m shared.migrate current        # print the applied revision
+    python -m shared.migrate check          # exit 1 unless the database is at the latest revision
+    python -m shared.migrate revision -m "add widgets"   # new empty revision file
+
+Services only verify the revision on startup (check_schema_version), which is one cheap query.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine # type: ignore
+
+if TYPE_CHECKING:
+    from alembic.config import Config # type: ignore
+
+from .config import DATABASE_URL
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+
+class SchemaVersionError(RuntimeError):
+    pass
+
+# Alembic is imported inside the functions that use it: services only need it for one startup query,
+# and importing it at module level would add to every replica's cold start.
+
+def alembic_config(db_url: str = DATABASE_URL) -> "Config":
+    from alembic.config import Config # type: ignore
+
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS_DIR))
+    # Passed as an attribute rather than an ini option, which would need '%' escaped in passwords
+    config.attributes["db_url"] = db_url
+    return config
+
+def head_revision() -> Optional[str]:
+    from alembic.script import ScriptDirectory # type: ignore
+
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+async def current_revision(engine: AsyncEngine) -> Optional[str]:
+    from alembic.runtime.migration import MigrationContext # type: ignore
+
+    async with engine.connect() as conn:
+        return await conn.run_sync(lambda sync_conn: MigrationContext.configure(sync_conn).get_current_revision())
+
+async def check_schema_version(engine: AsyncEngine):
+    """
+    Raises SchemaVersionError unless the database is at the latest migration.
+    Call from each service's startup event instead of creating tables.
+    """
+    current, head = await current_revision(engine), head_revision()
+    if current != head:
+        raise SchemaVersionError(
+            f"Database schema is at revision {current or '<none>'}, this build expects {head}. "
+            "Run 'python -m shared.migrate' first."
+        )
+    print(f"Database schema is at revision {current}.")
+
+def main(argv=None):
+    from alembic import command # type: ignore
+
+    parser = argparse.ArgumentParser(prog="python -m shared.migrate", description="Database schema migrations")
+    parser.add_argument("action", nargs="?", default="upgrade", choices=["upgrade", "downgrade", "current", "check", "history", "revision"])
+    parser.add_argument("revision", nargs="?", default=None, help="Target revision for upgrade/downgrade (default: head / -1)")
+    parser.add_argument("-m", "--message", help="Message for a new revision")
+    parser.add_argument("--sql", action="store_true", help="Print the SQL instead of running it (offline mode)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s") # Alembic reports each revision it runs
+    config = alembic_config()
+
+    if args.action == "upgrade":
+        command.upgrade(config, args.revision or "head", sql=args.sql)
+    elif args.action == "downgrade":
+        command.downgrade(config, args.revision or "-1", sql=args.sql)
+    elif args.action == "current":
+        command.current(config)
+    elif args.action == "history":
+        command.history(config)
+    elif args.action == "revision":
+        command.revision(config, message=args.message)
+    elif args.action == "check":
+        from .database import build_engine
+        from sqlalchemy.pool import NullPool # type: ignore
+
+        async def _check():
+            engine = build_engine(DATABASE_URL, poolclass=NullPool)
+            try:
+                await check_schema_version(engine)
+            finally:
+                await engine.dispose()
+        try:
+            asyncio.run(_check())
+        except SchemaVersionError as e:
+            print(e)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import asyncio
+
+from alembic import context # type: ignore
+from sqlalchemy import text # type: ignore
+from sqlalchemy.pool import NullPool # type: ignore
+
+from shared.database import Base, build_engine
+from shared import models # noqa: F401 # Registers every table on Base.metadata
+
+config = context.config
+target_metadata = Base.metadata
+db_url = config.attributes.get("db_url") or config.get_main_option("sqlalchemy.url")
+
+# Held for the whole run so two migrators started at once apply revisions one after the other
+MIGRATION_LOCK_KEY = 7241901
+
+def run_migrations_offline():
+    context.configure(url=db_url, target_metadata=target_metadata, literal_binds=True, dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+def do_run_migrations(connection):
+    connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    connection.commit()
+    try:
+        # One transaction per revision, so a revision can use autocommit_block() for CONCURRENTLY builds
+        context.configure(connection=connection, target_metadata=target_metadata, transaction_per_migration=True)
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        connection.commit()
+
+async def run_migrations_online():
+    engine = build_engine(db_url, poolclass=NullPool)
+    try:
+        async with engine.connect() as connection:
+            await connection.run_sync(do_run_migrations)
+    finally:
+        await engine.dispose()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_migrations_online())
@@ -0,0 +1,138 @@
+"""Baseline schema
+
+Creates every table the services use, or brings an existing database (created by db/init.sql or by
+the services' old create_all on startup) to the same shape. Every statement is idempotent.
+Secondary indexes live in 0002 so they can be built CONCURRENTLY.
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-18
+"""
+import logging
+
+from alembic import op # type: ignore
+
+revision = "0001_baseline"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+TABLES = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username VARCHAR(50) UNIQUE NOT NULL,
+    email VARCHAR(255) UNIQUE NOT NULL,
+    hashed_password VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS products (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    description TEXT,
+    price NUMERIC(10, 2) NOT NULL,
+    stock_quantity INTEGER NOT NULL DEFAULT 0,
+    image_url VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, ''))) STORED;
+
+CREATE TABLE IF NOT EXISTS carts (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER UNIQUE NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS cart_items (
+    id SERIAL PRIMARY KEY,
+    cart_id INTEGER NOT NULL REFERENCES carts(id) ON DELETE CASCADE,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL,
+    price_at_add NUMERIC(10, 2) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT _cart_product_uc UNIQUE (cart_id, product_id)
+);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    total_amount NUMERIC(10, 2) NOT NULL,
+    status VARCHAR(50) NOT NULL DEFAULT 'pending',
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    id SERIAL PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL,
+    price_at_purchase NUMERIC(10, 2) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT _order_product_uc UNIQUE (order_id, product_id)
+);
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    key VARCHAR(255) NOT NULL,
+    order_id INTEGER REFERENCES orders(id) ON DELETE SET NULL,
+    response_status INTEGER,
+    response_body JSONB,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    CONSTRAINT uq_idempotency_keys_user_id_key UNIQUE (user_id, key)
+);
+"""
+
+# db/init.sql declared email as VARCHAR(100); widening a VARCHAR is a catalog-only change
+WIDEN_EMAIL = "ALTER TABLE users ALTER COLUMN email TYPE VARCHAR(255)"
+
+# Databases created by create_all have these foreign keys without ON DELETE CASCADE.
+# They are re-added NOT VALID and then validated, which checks existing rows without blocking writes.
+CASCADING_FOREIGN_KEYS = [
+    ("carts", "user_id", "users"),
+    ("cart_items", "cart_id", "carts"),
+    ("cart_items", "product_id", "products"),
+    ("orders", "user_id", "users"),
+    ("order_items", "order_id", "orders"),
+    ("order_items", "product_id", "products"),
+]
+
+def upgrade():
+    for statement in TABLES.split(";"): # One statement per execute (asyncpg prepares each one)
+        if statement.strip():
+            op.execute(statement)
+    op.execute(WIDEN_EMAIL)
+    for table, column, referenced in CASCADING_FOREIGN_KEYS:
+        name = f"{table}_{column}_fkey" # Postgres' default name, used by both init.sql and create_all
+        op.execute(f"""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM pg_constraint WHERE conname = '{name}' AND confdeltype = 'c'
+                ) THEN
+                    ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name};
+                    ALTER TABLE {table} ADD CONSTRAINT {name}
+                        FOREIGN KEY ({column}) REFERENCES {referenced}(id) ON DELETE CASCADE NOT VALID;
+                END IF;
+            END $$;
+        """)
+        op.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+
+def downgrade():
+    """
+    Deliberately leaves the schema in place. The baseline adopts databases that existed before the
+    migrations (with their data), so undoing it cannot mean dropping those tables; downgrading to
+    base only forgets the applied revision. To really start over, drop the database or restore a
+    backup, then upgrade again: every upgrade statement above is idempotent.
+    """
+    logging.getLogger(__name__).warning(
+        "0001_baseline downgrade leaves every table in place; drop the database or restore a backup to remove them."
+    )
@@ -0,0 +1,54 @@
+"""Performance indexes
+
+Every secondary index the services rely on, built with CREATE INDEX CONCURRENTLY so a live database
+keeps taking writes while they build.
+
+Revision ID: 0002_performance_indexes
+Revises: 0001_baseline
+Create Date: 2026-10-18
+"""
+from alembic import op # type: ignore
+
+revision = "0002_performance_indexes"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    # Product listing: keyset pagination per sort order and the in-stock filter
+    "ix_products_price_id": "products (price, id)",
+    "ix_products_created_at_id": "products (created_at, id)",
+    "ix_products_in_stock_id": "products (id) WHERE stock_quantity > 0",
+    # Product search: full-text document and trigram name matching
+    "ix_products_search_vector": "products USING GIN (search_vector)",
+    "ix_products_name_trgm": "products USING GIN (name gin_trgm_ops)",
+    # Foreign keys: cart/order item lookups and ON DELETE CASCADE from products
+    "ix_cart_items_cart_id": "cart_items (cart_id)",
+    "ix_order_items_order_id": "order_items (order_id)",
+    "ix_order_items_product_id": "order_items (product_id)",
+    # Order history, newest first per user
+    "ix_orders_user_id_created_at": "orders (user_id, created_at DESC, id DESC)",
+    # Idempotency key TTL cleanup
+    "ix_idempotency_keys_expires_at": "idempotency_keys (expires_at)",
+}
+
+# A failed CONCURRENTLY build leaves an INVALID index behind that IF NOT EXISTS would then skip
+DROP_IF_INVALID = """
+SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+WHERE c.relname = '{name}' AND NOT i.indisvalid
+"""
+
+def upgrade():
+    # CONCURRENTLY cannot run inside a transaction block
+    migration_context = op.get_context()
+    with migration_context.autocommit_block():
+        for name, definition in INDEXES.items():
+            # Offline (--sql) runs cannot inspect the catalog; they only emit the CREATE
+            if not migration_context.as_sql and op.get_bind().exec_driver_sql(DROP_IF_INVALID.format(name=name)).first() is not None:
+                op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name in reversed(list(INDEXES)):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
@@ -0,0 +1,43 @@
+"""Transactional outbox
+
+outbox_events holds domain events written in the same transaction as the change they describe;
+outbox_consumer_offsets records how far each consumer has read. Both tables are new, so plain
+CREATE statements are safe on a live database.
+
+Revision ID: 0003_outbox
+Revises: 0002_performance_indexes
+Create Date: 2026-10-18
+"""
+import sqlalchemy as sa # type: ignore
+from alembic import op # type: ignore
+from sqlalchemy.dialects import postgresql # type: ignore
+
+revision = "0003_outbox"
+down_revision = "0002_performance_indexes"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "outbox_events",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        # pg_current_xact_id() needs Postgres 13+
+        sa.Column("txid", sa.BigInteger(), nullable=False, server_default=sa.text("pg_current_xact_id()::text::bigint")),
+        sa.Column("event_type", sa.String(100), nullable=False),
+        sa.Column("aggregate_type", sa.String(50), nullable=False),
+        sa.Column("aggregate_id", sa.Integer(), nullable=False),
+        sa.Column("payload", postgresql.JSONB(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index("ix_outbox_events_txid_id", "outbox_events", ["txid", "id"])
+    op.create_table(
+        "outbox_consumer_offsets",
+        sa.Column("consumer", sa.String(100), primary_key=True),
+        sa.Column("last_txid", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("last_event_id", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+def downgrade():
+    op.drop_table("outbox_consumer_offsets")
+    op.drop_table("outbox_events") # Drops ix_outbox_events_txid_id with it
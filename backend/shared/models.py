@@ -1,16 +1,19 @@
-from sqlalchemy import Column, Integer, String, Numeric, Text, DateTime, ForeignKey, UniqueConstraint # type: ignore
-from sqlalchemy.orm import relationship # type: ignore
+from sqlalchemy import Column, Integer, BigInteger, String, Numeric, Text, DateTime, ForeignKey, UniqueConstraint, Index, Computed, text # type: ignore
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR # type: ignore
+from sqlalchemy.orm import relationship, deferred # type: ignore
 from sqlalchemy.sql import func # type: ignore
 from pydantic import EmailStr # type: ignore # Used for type hinting, not for column type directly in SQLA
 
 from .database import Base # Import Base from the shared database setup
 
 # --- SQLAlchemy Models (Database Schema) ---
+# The database schema itself is owned by the migrations in shared/migrations; a model change needs a
+# new revision there too (python -m shared.migrate revision -m "...").
 class User(Base):
     __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String(50), unique=True, index=True, nullable=False)
-    email = Column(String(255), unique=True, index=True, nullable=False) # Use String for email in SQLA
+    id = Column(Integer, primary_key=True)
+    username = Column(String(50), unique=True, nullable=False)
+    email = Column(String(255), unique=True, nullable=False) # Use String for email in SQLA
     hashed_password = Column(String(255), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -19,22 +22,37 @@ class User(Base):
 
 class Product(Base):
     __tablename__ = "products"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(255), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False)
     description = Column(Text)
     price = Column(Numeric(10, 2), nullable=False)
     stock_quantity = Column(Integer, nullable=False, default=0)
     image_url = Column(String(255))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    # Full-text document maintained by Postgres; deferred so normal product loads never fetch it
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed("to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, ''))", persisted=True),
+    ))
+
+    __table_args__ = (
+        # Composite indexes backing keyset pagination on GET /products/ (see ProductSort)
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_created_at_id", "created_at", "id"),
+        Index("ix_products_in_stock_id", "id", postgresql_where=stock_quantity > 0),
+        # GET /products/search: full-text match plus pg_trgm for typo-tolerant and prefix name matching
+        Index("ix_products_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_products_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    )
 
     cart_items = relationship("CartItem", back_populates="product")
     order_items = relationship("OrderItem", back_populates="product")
 
 class Cart(Base):
     __tablename__ = "carts"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=False)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), unique=True, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -43,9 +61,9 @@ class Cart(Base):
 
 class CartItem(Base):
     __tablename__ = "cart_items"
-    id = Column(Integer, primary_key=True, index=True)
-    cart_id = Column(Integer, ForeignKey("carts.id"), nullable=False)
-    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    id = Column(Integer, primary_key=True)
+    cart_id = Column(Integer, ForeignKey("carts.id", ondelete="CASCADE"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
     quantity = Column(Integer, nullable=False)
     price_at_add = Column(Numeric(10, 2), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -57,21 +75,24 @@ class CartItem(Base):
 
 class Order(Base):
     __tablename__ = "orders"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     total_amount = Column(Numeric(10, 2), nullable=False)
     status = Column(String(50), nullable=False, default="pending")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    # Order history is read newest-first per user and paginated on (created_at, id)
+    __table_args__ = (Index("ix_orders_user_id_created_at", user_id, created_at.desc(), id.desc()),)
+
     user = relationship("User", back_populates="orders")
     items = relationship("OrderItem", back_populates="order")
 
 class OrderItem(Base):
     __tablename__ = "order_items"
-    id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
-    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
     quantity = Column(Integer, nullable=False)
     price_at_purchase = Column(Numeric(10, 2), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -79,4 +100,48 @@ class OrderItem(Base):
     __table_args__ = (UniqueConstraint('order_id', 'product_id', name='_order_product_uc'),)
 
     order = relationship("Order", back_populates="items")
-    product = relationship("Product", back_populates="order_items")
\ No newline at end of file
+    product = relationship("Product", back_populates="order_items")
+
+class IdempotencyKey(Base):
+    # One row per (user, Idempotency-Key) holding the response of the request that first used the key
+    __tablename__ = "idempotency_keys"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    key = Column(String(255), nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="SET NULL"), nullable=True)
+    response_status = Column(Integer, nullable=True)
+    response_body = Column(JSONB, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_id_key"),
+        Index("ix_idempotency_keys_expires_at", expires_at), # TTL cleanup scans by expiry
+    )
+
+class OutboxEvent(Base):
+    # Domain events written in the same transaction as the change they describe (see shared.outbox).
+    # txid is the writing transaction's id. (txid, id) order is not commit order by itself: a higher
+    # txid can commit first. Consumers only read events whose txid is below the snapshot's xmin
+    # (every lower transaction has finished), and within that horizon no event can still appear
+    # behind their offset, so an offset never skips an event from a slower transaction.
+    __tablename__ = "outbox_events"
+    id = Column(BigInteger, primary_key=True)
+    txid = Column(BigInteger, nullable=False, server_default=text("pg_current_xact_id()::text::bigint"))
+    event_type = Column(String(100), nullable=False)
+    aggregate_type = Column(String(50), nullable=False)
+    aggregate_id = Column(Integer, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_outbox_events_txid_id", txid, id), # Consumers seek from their offset
+    )
+
+class OutboxConsumerOffset(Base):
+    # Position of the last event each named consumer has handled
+    __tablename__ = "outbox_consumer_offsets"
+    consumer = Column(String(100), primary_key=True)
+    last_txid = Column(BigInteger, nullable=False, server_default="0")
+    last_event_id = Column(BigInteger, nullable=False, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -0,0 +1,99 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+import asyncpg # type: ignore
+from sqlalchemy import select, func # type: ignore
+from sqlalchemy.engine import make_url # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession # type: ignore
+
+# --- Postgres LISTEN/NOTIFY ---
+# NOTIFY is transactional: a notification sent inside a transaction is only delivered when it commits,
+# so listeners never hear about changes that were rolled back.
+
+Handler = Callable[[str], Union[None, Awaitable[None]]]
+
+async def notify(db: AsyncSession, channel: str, payload: str):
+    """
+    Queues a notification on the session's current transaction; delivered on commit.
+    """
+    await db.execute(select(func.pg_notify(channel, payload)))
+
+def asyncpg_dsn(db_url: str) -> str:
+    """
+    Converts a SQLAlchemy URL (postgresql+asyncpg://...) into a plain DSN asyncpg can connect with.
+    """
+    return make_url(db_url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+class PostgresListener:
+    """
+    Holds one dedicated connection (outside the pool) that LISTENs on a set of channels and
+    dispatches payloads to handlers. Reconnects with a delay if the connection drops, calling
+    on_reconnect so callers can drop state that may have missed notifications.
+    """
+
+    def __init__(self, db_url: str, reconnect_delay: float = 2.0):
+        self.dsn = asyncpg_dsn(db_url)
+        self.reconnect_delay = reconnect_delay
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._reconnect_callbacks: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._connection: Optional[asyncpg.Connection] = None
+        self.connected = asyncio.Event() # Set while LISTEN is active
+
+    def add_handler(self, channel: str, handler: Handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def on_reconnect(self, callback: Callable[[], None]):
+        self._reconnect_callbacks.append(callback)
+
+    def _dispatch(self, connection, pid, channel, payload):
+        for handler in self._handlers.get(channel, []):
+            try:
+                result = handler(payload)
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+            except Exception as e:
+                print(f"Notification handler for '{channel}' failed: {e}")
+
+    async def _run(self):
+        first_connect = True
+        while True:
+            try:
+                self._connection = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                self._connection.add_termination_listener(lambda _conn: lost.set())
+                for channel in self._handlers:
+                    await self._connection.add_listener(channel, self._dispatch)
+                if not first_connect:
+                    # Anything published while we were disconnected was missed
+                    for callback in self._reconnect_callbacks:
+                        callback()
+                first_connect = False
+                self.connected.set()
+                print(f"Listening for notifications on: {', '.join(self._handlers)}")
+                await lost.wait()
+                self.connected.clear()
+                print("Notification listener connection lost, reconnecting...")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.connected.clear()
+                print(f"Notification listener could not connect: {e}")
+            await asyncio.sleep(self.reconnect_delay)
+
+    def start(self):
+        if self._task is None and self._handlers:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.connected.clear()
+        if self._connection is not None and not self._connection.is_closed():
+            await self._connection.close()
+        self._connection = None
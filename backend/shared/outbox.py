@@ -0,0 +1,233 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge # type: ignore
+from sqlalchemy import select, insert, update, delete, tuple_, exists, cast, Text, BigInteger # type: ignore
+from sqlalchemy.dialects.postgresql import insert as pg_insert # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker # type: ignore
+from sqlalchemy.sql import func # type: ignore
+
+from .config import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL_SECONDS, OUTBOX_RETENTION_HOURS
+from .database import backoff_delay
+from .models import OutboxEvent, OutboxConsumerOffset
+from .notifications import PostgresListener, notify
+
+# --- Transactional outbox ---
+# Writers call publish_events() inside the transaction that makes the change, so an event exists if and
+# only if the change committed, and the request pays for one INSERT rather than the downstream work.
+# Each OutboxConsumer is a named stream position: it reads events after its offset in batches, hands
+# them to its handler and advances the offset in the same transaction. A handler that raises rolls the
+# batch back and it is retried, so delivery is at-least-once and handlers should be idempotent.
+# The offset row is locked with SKIP LOCKED, so across all replicas and workers one process at a time
+# delivers for a given consumer. NOTIFY on OUTBOX_CHANNEL wakes consumers as soon as events commit;
+# polling every OUTBOX_POLL_INTERVAL_SECONDS covers missed notifications.
+#
+# Events are read in (txid, id) order and only from transactions older than every transaction still
+# running (the snapshot's xmin). Neither ids nor txids follow commit order on their own: both are
+# assigned before commit, so a later one can commit first and an offset past it would skip the
+# earlier one. The xmin horizon is what makes the order safe: below it every transaction has
+# finished, so no new event can appear behind the offset. A long-running transaction delays
+# delivery until it ends; it never causes an event to be skipped.
+
+OUTBOX_CHANNEL = "outbox_events"
+
+OUTBOX_EVENTS_DELIVERED = Counter("outbox_events_delivered_total", "Outbox events handled, by consumer.", ["consumer"])
+OUTBOX_DELIVERY_FAILURES = Counter("outbox_delivery_failures_total", "Outbox batches that failed and will be retried.", ["consumer"])
+OUTBOX_CONSUMER_LAG_EVENTS = Gauge(
+    "outbox_consumer_lag_events",
+    "Committed outbox events the consumer has not handled yet.",
+    ["consumer"],
+    multiprocess_mode="livemostrecent", # reported by whichever worker delivered last
+)
+OUTBOX_CONSUMER_LAG_SECONDS = Gauge(
+    "outbox_consumer_lag_seconds",
+    "Age of the oldest outbox event the consumer has not handled yet (0 when caught up).",
+    ["consumer"],
+    multiprocess_mode="livemostrecent",
+)
+
+def _visible_txid_horizon():
+    # Transactions with a lower id have all finished, so their events can no longer appear or change
+    return cast(cast(func.pg_snapshot_xmin(func.pg_current_snapshot()), Text), BigInteger)
+
+@dataclass(slots=True, frozen=True)
+class OutboxMessage:
+    id: int
+    txid: int
+    event_type: str
+    aggregate_type: str
+    aggregate_id: int
+    payload: Dict[str, Any]
+    created_at: datetime
+
+async def publish_events(db: AsyncSession, events: List[Dict[str, Any]]):
+    """
+    Queues events on the session's transaction; they become visible to consumers on commit.
+    Each event is a dict with event_type, aggregate_type, aggregate_id and a JSON-compatible payload.
+    """
+    if not events:
+        return
+    await db.execute(insert(OutboxEvent), events)
+    await notify(db, OUTBOX_CHANNEL, "") # Identical notifications in one transaction are delivered once
+
+Handler = Callable[[AsyncSession, OutboxMessage], Awaitable[None]]
+
+class OutboxConsumer:
+    """
+    Delivers outbox events to `handler(db, message)` with the consumer's own session, in the same
+    transaction that advances the offset, so work the handler does in `db` commits with it.
+    A new consumer starts from the oldest retained event.
+    """
+
+    def __init__(self, name: str, handler: Handler, batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: float = OUTBOX_POLL_INTERVAL_SECONDS):
+        self.name = name
+        self.handler = handler
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def listen(self, listener: PostgresListener):
+        """
+        Wakes the consumer whenever events commit. Call before listener.start().
+        """
+        listener.add_handler(OUTBOX_CHANNEL, lambda _payload: self._wake.set())
+        listener.on_reconnect(self._wake.set)
+
+    async def _ensure_offset(self, db: AsyncSession):
+        await db.execute(pg_insert(OutboxConsumerOffset).values(consumer=self.name).on_conflict_do_nothing())
+        await db.commit()
+
+    async def deliver_batch(self, db: AsyncSession) -> int:
+        """
+        Handles up to batch_size events after this consumer's offset and commits.
+        Returns how many were handled; 0 also when another process holds this consumer.
+        """
+        offset = (await db.execute(
+            select(OutboxConsumerOffset.last_txid, OutboxConsumerOffset.last_event_id)
+            .where(OutboxConsumerOffset.consumer == self.name)
+            .with_for_update(skip_locked=True)
+        )).one_or_none()
+        if offset is None:
+            await db.rollback()
+            return 0
+
+        position = tuple_(OutboxEvent.txid, OutboxEvent.id)
+        rows = (await db.execute(
+            select(
+                OutboxEvent.id, OutboxEvent.txid, OutboxEvent.event_type, OutboxEvent.aggregate_type,
+                OutboxEvent.aggregate_id, OutboxEvent.payload, OutboxEvent.created_at,
+            )
+            .where(
+                position > tuple_(offset.last_txid, offset.last_event_id),
+                OutboxEvent.txid < _visible_txid_horizon(),
+            )
+            .order_by(OutboxEvent.txid, OutboxEvent.id)
+            .limit(self.batch_size)
+        )).all()
+        messages = [OutboxMessage(*row) for row in rows]
+        for message in messages:
+            await self.handler(db, message)
+
+        if messages:
+            last = messages[-1]
+            await db.execute(
+                update(OutboxConsumerOffset)
+                .where(OutboxConsumerOffset.consumer == self.name)
+                .values(last_txid=last.txid, last_event_id=last.id, updated_at=func.now())
+            )
+            offset = last.txid, last.id
+        await self._record_lag(db, *offset)
+        await db.commit()
+        OUTBOX_EVENTS_DELIVERED.labels(consumer=self.name).inc(len(messages))
+        return len(messages)
+
+    async def _record_lag(self, db: AsyncSession, last_txid: int, last_event_id: int):
+        count, age = (await db.execute(
+            select(func.count(), func.coalesce(func.extract("epoch", func.now() - func.min(OutboxEvent.created_at)), 0))
+            .where(tuple_(OutboxEvent.txid, OutboxEvent.id) > tuple_(last_txid, last_event_id))
+        )).one()
+        OUTBOX_CONSUMER_LAG_EVENTS.labels(consumer=self.name).set(count)
+        OUTBOX_CONSUMER_LAG_SECONDS.labels(consumer=self.name).set(float(age))
+
+    async def _run(self, session_factory: async_sessionmaker):
+        failures = 0
+        while True:
+            try:
+                async with session_factory() as db:
+                    await self._ensure_offset(db)
+                    while True:
+                        self._wake.clear()
+                        delivered = await self.deliver_batch(db)
+                        failures = 0
+                        if delivered < self.batch_size:
+                            try:
+                                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                            except asyncio.TimeoutError:
+                                pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                OUTBOX_DELIVERY_FAILURES.labels(consumer=self.name).inc()
+                print(f"Outbox consumer '{self.name}' failed, retrying: {e}")
+                await asyncio.sleep(backoff_delay(failures))
+                failures += 1
+
+    def start(self, session_factory: async_sessionmaker):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(session_factory))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+async def purge_delivered_outbox_events(db: AsyncSession, batch_size: int = 1000) -> int:
+    """
+    Deletes up to batch_size events older than OUTBOX_RETENTION_HOURS that every consumer has
+    handled, and commits. SKIP LOCKED lets several replicas purge at once.
+    """
+    unhandled_by_some_consumer = exists().where(
+        tuple_(OutboxConsumerOffset.last_txid, OutboxConsumerOffset.last_event_id) < tuple_(OutboxEvent.txid, OutboxEvent.id)
+    )
+    delivered = (
+        select(OutboxEvent.id)
+        .where(OutboxEvent.created_at < func.now() - timedelta(hours=OUTBOX_RETENTION_HOURS), ~unhandled_by_some_consumer)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    deleted_result = await db.execute(
+        delete(OutboxEvent).where(OutboxEvent.id.in_(delivered)).returning(OutboxEvent.id),
+        execution_options={"synchronize_session": False},
+    )
+    deleted = len(deleted_result.all())
+    await db.commit()
+    return deleted
+
+async def run_outbox_cleanup(session_factory: async_sessionmaker, interval: float = 3600):
+    """
+    Background loop for the startup event of the service that writes events; cancel on shutdown.
+    """
+    while True:
+        try:
+            async with session_factory() as db:
+                total = 0
+                batch_size = 1000
+                while True:
+                    deleted = await purge_delivered_outbox_events(db, batch_size)
+                    total += deleted
+                    if deleted < batch_size:
+                        break
+            if total:
+                print(f"Purged {total} delivered outbox events.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Outbox cleanup failed: {e}")
+        await asyncio.sleep(interval)
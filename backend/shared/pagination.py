@@ -0,0 +1,55 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, List, Sequence
+
+from fastapi import HTTPException, status # type: ignore
+from sqlalchemy import tuple_ # type: ignore
+
+# --- Keyset (cursor) pagination helpers ---
+# A cursor is the sort key of the last row on a page, encoded as opaque url-safe base64 JSON.
+# Seeking with "(sort_key, id) > (:last_sort_key, :last_id)" lets Postgres start the scan at the
+# right place in a matching composite index, so page 10,000 costs the same as page 1.
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def encode_cursor(kind: str, values: Sequence[Any]) -> str:
+    payload = json.dumps({"k": kind, "v": [_to_json(v) for v in values]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, kind: str, types: Sequence[type]) -> List[Any]:
+    """
+    Decodes a cursor produced by encode_cursor for the same `kind` (e.g. the sort order),
+    converting each value back with the matching entry of `types`.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload["k"] != kind or len(payload["v"]) != len(types):
+            raise ValueError("cursor does not match this listing")
+        return [
+            datetime.fromisoformat(value) if type_ is datetime else type_(value)
+            for type_, value in zip(types, payload["v"])
+        ]
+    except (ValueError, KeyError, TypeError, ArithmeticError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+
+def keyset_after(columns: Sequence[Any], values: Sequence[Any]):
+    """
+    Row-value comparison "(c1, c2, ...) > (v1, v2, ...)" for ascending keyset pagination.
+    """
+    return tuple_(*columns) > tuple_(*values)
+
+def keyset_before(columns: Sequence[Any], values: Sequence[Any]):
+    """
+    Row-value comparison "(c1, c2, ...) < (v1, v2, ...)" for descending keyset pagination.
+    """
+    return tuple_(*columns) < tuple_(*values)
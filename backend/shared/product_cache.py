@@ -0,0 +1,106 @@
+from typing import Optional, Protocol
+
+from prometheus_client import Counter # type: ignore
+from sqlalchemy import select # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession # type: ignore
+
+from .cache import TTLCache
+from .config import PRODUCT_CACHE_TTL_SECONDS, PRODUCT_CACHE_MAX_SIZE
+from .models import Product
+from .notifications import PostgresListener, notify
+from .schemas import ProductResponse
+
+# --- Read-through product cache ---
+# Tier 1 is an in-process LRU with TTL; tier 2 is an optional shared store (e.g. Redis) plugged in
+# with set_second_tier(). Writers call publish_product_changed() inside their transaction and every
+# replica subscribed through listen_for_product_changes() drops the entry from both tiers as soon as
+# it commits.
+
+PRODUCT_CHANGED_CHANNEL = "product_changed"
+
+PRODUCT_CACHE_HITS = Counter("product_cache_hits_total", "Product lookups served from cache.", ["tier"])
+PRODUCT_CACHE_MISSES = Counter("product_cache_misses_total", "Product lookups that fell through to Postgres.")
+
+class CacheBackend(Protocol):
+    """
+    Interface for an optional second cache tier shared between replicas.
+    """
+    async def get(self, key: str) -> Optional[bytes]: ...
+    async def set(self, key: str, value: bytes, ttl: float) -> None: ...
+    async def delete(self, key: str) -> None: ...
+
+class ProductCache:
+    def __init__(self, maxsize: int, ttl: float, second_tier: Optional[CacheBackend] = None):
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.second_tier = second_tier
+
+    @staticmethod
+    def _key(product_id: int) -> str:
+        return f"product:{product_id}"
+
+    async def get(self, db: AsyncSession, product_id: int) -> Optional[ProductResponse]:
+        """
+        Returns the product, loading it with `db` on a miss. Missing products are not cached.
+        """
+        product = self.local.get(product_id)
+        if product is not None:
+            PRODUCT_CACHE_HITS.labels(tier="local").inc()
+            return product
+
+        if self.second_tier is not None:
+            cached = await self.second_tier.get(self._key(product_id))
+            if cached is not None:
+                PRODUCT_CACHE_HITS.labels(tier="second").inc()
+                product = ProductResponse.model_validate_json(cached)
+                self.local.set(product_id, product)
+                return product
+
+        PRODUCT_CACHE_MISSES.inc()
+        product_result = await db.execute(select(Product).filter(Product.id == product_id))
+        db_product = product_result.scalar_one_or_none()
+        if db_product is None:
+            return None
+        product = ProductResponse.model_validate(db_product)
+        self.local.set(product_id, product)
+        if self.second_tier is not None:
+            await self.second_tier.set(self._key(product_id), product.model_dump_json().encode(), self.local.ttl)
+        return product
+
+    def invalidate_local(self, product_id: int):
+        self.local.pop(product_id)
+
+    async def invalidate(self, product_id: int):
+        self.invalidate_local(product_id)
+        if self.second_tier is not None:
+            await self.second_tier.delete(self._key(product_id))
+
+product_cache = ProductCache(maxsize=PRODUCT_CACHE_MAX_SIZE, ttl=PRODUCT_CACHE_TTL_SECONDS)
+
+def set_second_tier(backend: Optional[CacheBackend]):
+    product_cache.second_tier = backend
+
+async def publish_product_changed(db: AsyncSession, product_id: int):
+    """
+    Call from any transaction that updates or deletes a product. Drops the entry now and again, in
+    both tiers, once the transaction commits: a reader in between may have re-filled it with the
+    old row, so only the eviction after commit is authoritative.
+    """
+    await product_cache.invalidate(product_id)
+    await notify(db, PRODUCT_CHANGED_CHANNEL, str(product_id))
+
+async def _handle_product_changed(payload: str):
+    try:
+        product_id = int(payload)
+    except ValueError:
+        product_cache.local.clear() # Unknown payload: be safe and drop everything
+        return
+    # Every replica deletes the shared entry; the deletes are idempotent and one of them is the writer's
+    await product_cache.invalidate(product_id)
+
+def listen_for_product_changes(listener: PostgresListener):
+    """
+    Subscribes the process-wide product cache to invalidation notifications, which arrive after
+    the writer's commit and evict both tiers.
+    """
+    listener.add_handler(PRODUCT_CHANGED_CHANNEL, _handle_product_changed)
+    listener.on_reconnect(product_cache.local.clear) # Notifications may have been missed while disconnected
@@ -0,0 +1,76 @@
+import asyncio
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from enum import Enum
+
+# --- In-process profiling for /debug/profile ---
+# Both modes observe the whole worker for the requested window, so every concurrent request is included.
+# "sample" snapshots every thread's stack at a fixed interval and returns collapsed stacks
+# ("frame;frame;frame count" lines, the input format of flamegraph.pl and speedscope) with low overhead.
+# "cprofile" traces every call on the event loop thread and returns pstats text; exact, but slower.
+
+class ProfileMode(str, Enum):
+    sample = "sample"
+    cprofile = "cprofile"
+
+class ProfilerBusy(Exception):
+    pass
+
+_profile_lock = asyncio.Lock()
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+def _collapse(frame, thread_name: str) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+def _sample_stacks(seconds: float, interval: float) -> Counter:
+    sampler_id = threading.get_ident()
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != sampler_id:
+                stacks[_collapse(frame, names.get(thread_id, f"thread-{thread_id}"))] += 1
+        time.sleep(interval)
+    return stacks
+
+async def _run_sampling(seconds: float, interval: float) -> str:
+    # The sampler runs in its own thread so it keeps ticking while the event loop is busy
+    stacks = await asyncio.to_thread(_sample_stacks, seconds, interval)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+async def _run_cprofile(seconds: float, limit: int) -> str:
+    profiler = cProfile.Profile()
+    profiler.enable() # Traces the event loop thread, i.e. every coroutine that runs while we sleep
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).strip_dirs().sort_stats("cumulative").print_stats(limit)
+    return output.getvalue()
+
+async def run_profile(mode: ProfileMode, seconds: float, interval: float = 0.005, limit: int = 100) -> str:
+    """
+    Profiles the process for `seconds` and returns the report as text.
+    Raises ProfilerBusy if another profile is already running in this process.
+    """
+    if _profile_lock.locked():
+        raise ProfilerBusy()
+    async with _profile_lock:
+        if mode == ProfileMode.cprofile:
+            return await _run_cprofile(seconds, limit)
+        return await _run_sampling(seconds, interval)
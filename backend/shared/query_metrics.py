@@ -0,0 +1,134 @@
+import re
+import time
+from collections import Counter as StatementCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client import Histogram # type: ignore
+from sqlalchemy import event # type: ignore
+from sqlalchemy.ext.asyncio import AsyncEngine # type: ignore
+
+from .config import QUERY_REPEAT_WARN_THRESHOLD
+from .slow_queries import slow_query_log
+
+# --- Per-request SQL statement counting ---
+# Cursor-execute hooks on every engine built by shared.database add each statement to the stats of
+# the request that ran it (tracked through a ContextVar, so concurrent requests never mix), and
+# QueryMetricsMiddleware turns those stats into per-route histograms plus an N+1 warning.
+# The same hooks feed statements over SLOW_QUERY_THRESHOLD_MS to shared.slow_queries.
+
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "SQL statements executed while handling one request.",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100, 200),
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds",
+    "Time spent executing SQL statements while handling one request.",
+    ["method", "route"],
+)
+
+_WHITESPACE = re.compile(r"\s+")
+
+def statement_shape(statement: str) -> str:
+    # SQLAlchemy already renders bound parameters as placeholders, so only whitespace needs folding
+    return _WHITESPACE.sub(" ", statement).strip()
+
+class QueryStats:
+    """
+    Statements executed within one request (or one track_queries() block).
+    """
+
+    def __init__(self, scope: Optional[Dict] = None):
+        self.scope = scope # ASGI scope of the request, once routing has filled in the route
+        self.count = 0
+        self.duration = 0.0
+        self.statements: StatementCounter = StatementCounter()
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement_shape(statement)] += 1
+
+    @property
+    def route(self) -> Optional[str]:
+        return _route_label(self.scope) if self.scope is not None else None
+
+    def repeated(self, threshold: int = QUERY_REPEAT_WARN_THRESHOLD) -> List[Tuple[str, int]]:
+        return [(shape, count) for shape, count in self.statements.most_common() if count > threshold]
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+@contextmanager
+def track_queries(scope: Optional[Dict] = None) -> Iterator[QueryStats]:
+    """
+    Collects every statement executed in the current context until the block exits.
+    """
+    stats = QueryStats(scope)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get("query_start_times")
+    if not start_times:
+        return
+    duration = time.perf_counter() - start_times.pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement, duration)
+    explaining = context is not None and context.execution_options.get("slow_query_explain")
+    if slow_query_log.is_slow(duration) and not explaining:
+        slow_query_log.record(conn.engine, statement, parameters, duration, stats.route if stats else None)
+
+def instrument_engine(engine: AsyncEngine):
+    """
+    Attaches the statement hooks to an engine; build_engine() calls this for every engine.
+    """
+    sync_engine = engine.sync_engine
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+def _route_label(scope: Dict) -> str:
+    # Label by route template (e.g. "/{product_id}") rather than raw path to keep cardinality bounded
+    route = scope.get("route")
+    return getattr(route, "path", None) or "<unmatched>"
+
+class QueryMetricsMiddleware:
+    """
+    Pure ASGI middleware (so streamed response bodies are included) that records per-request
+    statement counts and DB time, and warns about statements repeated within one request.
+    """
+
+    def __init__(self, app, repeat_threshold: int = QUERY_REPEAT_WARN_THRESHOLD):
+        self.app = app
+        self.repeat_threshold = repeat_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries(scope) as stats:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                method, route = scope["method"], stats.route
+                DB_QUERIES_PER_REQUEST.labels(method=method, route=route).observe(stats.count)
+                DB_TIME_PER_REQUEST.labels(method=method, route=route).observe(stats.duration)
+                for shape, count in stats.repeated(self.repeat_threshold):
+                    print(f"WARNING: possible N+1 in {method} {route}: statement ran {count} times: {shape[:500]}")
+
+def install_query_metrics(app):
+    """
+    Call next to Instrumentator().instrument(app) in each service.
+    """
+    app.add_middleware(QueryMetricsMiddleware)
@@ -0,0 +1,97 @@
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Iterable, List, Optional, Sequence, Tuple, Type
+
+from fastapi import HTTPException, status # type: ignore
+from pydantic import BaseModel, ConfigDict, TypeAdapter, create_model # type: ignore
+
+from .models import Order, OrderItem, Product
+
+# --- Read models ---
+# Read-only endpoints select just the columns they return and load them into these __slots__
+# dataclasses instead of ORM instances: no identity map entry, instance state or relationship
+# bookkeeping per row. Field names match the response schemas, so they serialize through the same
+# (from_attributes) models. Field order matches read_columns(), so rows load positionally.
+
+@dataclass(slots=True)
+class ProductRead:
+    id: int
+    name: str
+    description: Optional[str]
+    price: Decimal
+    stock_quantity: int
+    image_url: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+
+@dataclass(slots=True)
+class OrderItemRead:
+    id: int
+    product_id: int
+    quantity: int
+    price_at_purchase: Decimal
+    created_at: datetime
+
+@dataclass(slots=True)
+class OrderRead:
+    id: int
+    user_id: int
+    total_amount: Decimal
+    status: str
+    created_at: datetime
+    updated_at: datetime
+    items: List[OrderItemRead] = field(default_factory=list) # Filled from a separate query, not a column
+
+def read_columns(read_model: Type, orm_model: Type, names: Optional[Iterable[str]] = None) -> Tuple[Any, ...]:
+    """
+    The ORM columns backing read_model's fields (or just `names`), in field order.
+    Fields without a column on orm_model (e.g. OrderRead.items) are skipped.
+    """
+    wanted = None if names is None else set(names)
+    return tuple(
+        getattr(orm_model, f.name)
+        for f in fields(read_model)
+        if (wanted is None or f.name in wanted) and f.name in orm_model.__table__.columns
+    )
+
+def from_rows(read_model: Type, rows: Iterable[Sequence[Any]]) -> list:
+    """
+    Loads rows selected with read_columns(read_model, ...) (all columns, same order).
+    """
+    return [read_model(*row) for row in rows]
+
+PRODUCT_READ_COLUMNS = read_columns(ProductRead, Product)
+ORDER_READ_COLUMNS = read_columns(OrderRead, Order)
+ORDER_ITEM_READ_COLUMNS = read_columns(OrderItemRead, OrderItem)
+
+# --- Sparse fieldsets (?fields=id,name,price) ---
+
+def parse_fields(value: Optional[str], model: Type[BaseModel]) -> Optional[Tuple[str, ...]]:
+    """
+    Parses a comma-separated fields parameter into field names in the schema's order,
+    so "name,id" and "id,name" share a cached model. Unknown names are a 400.
+    """
+    if value is None:
+        return None
+    requested = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = requested - set(model.model_fields)
+    if not requested or unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}" if unknown else "No fields requested",
+        )
+    return tuple(name for name in model.model_fields if name in requested)
+
+@lru_cache(maxsize=256)
+def sparse_list_adapter(model: Type[BaseModel], field_names: Tuple[str, ...]) -> TypeAdapter:
+    """
+    TypeAdapter for a list of `model` restricted to field_names; built once per distinct fieldset.
+    """
+    subset = create_model(
+        f"{model.__name__}Fields",
+        __config__=ConfigDict(from_attributes=True),
+        **{name: (model.model_fields[name].annotation, model.model_fields[name]) for name in field_names},
+    )
+    return TypeAdapter(List[subset])
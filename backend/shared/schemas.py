@@ -1,8 +1,20 @@
-from pydantic import BaseModel, EmailStr # type: ignore
-from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field, PlainSerializer # type: ignore
+from typing import Annotated, List, Optional
 from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+
+from .config import CART_BATCH_MAX_ITEMS, ORDER_STATUS_BATCH_MAX_IDS
 
 # --- Pydantic Schemas (Request/Response Models) ---
+# Money matches the NUMERIC(10, 2) columns: exact Decimal in Python, a fixed-point string in JSON ("19.90"),
+# so amounts never pass through binary floats on the way in or out.
+Money = Annotated[
+    Decimal,
+    Field(max_digits=10, decimal_places=2),
+    PlainSerializer(lambda value: f"{value:.2f}", return_type=str, when_used="json"),
+]
+
 # User Schemas
 class UserBase(BaseModel):
     username: str
@@ -27,7 +39,7 @@ class UserResponse(UserBase):
 class ProductBase(BaseModel):
     name: str
     description: Optional[str] = None
-    price: float
+    price: Money
     stock_quantity: int
     image_url: Optional[str] = None
 
@@ -36,7 +48,7 @@ class ProductCreate(ProductBase):
 
 class ProductUpdate(ProductBase):
     name: Optional[str] = None
-    price: Optional[float] = None
+    price: Optional[Money] = None
     stock_quantity: Optional[int] = None
 
 class ProductResponse(ProductBase):
@@ -47,6 +59,12 @@ class ProductResponse(ProductBase):
     class Config:
         from_attributes = True
 
+class ProductSort(str, Enum):
+    # Keyset sort orders for product listing; each is backed by a composite (key, id) index
+    id = "id"
+    price = "price"
+    created_at = "created_at"
+
 # Cart Schemas
 class CartItemBase(BaseModel):
     product_id: int
@@ -60,7 +78,7 @@ class CartItemUpdate(CartItemBase):
 
 class CartItemResponse(CartItemBase):
     id: int
-    price_at_add: float
+    price_at_add: Money
     created_at: datetime
 
     class Config:
@@ -76,18 +94,47 @@ class CartResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CartItemBatch(BaseModel):
+    items: List[CartItemBase] = Field(..., min_length=1, max_length=CART_BATCH_MAX_ITEMS)
+    strict: bool = False # Reject the whole batch if any item fails
+
+class CartItemBatchError(BaseModel):
+    product_id: int
+    detail: str
+
+class CartBatchResponse(BaseModel):
+    cart: CartResponse
+    errors: List[CartItemBatchError] = []
+
 # Order Schemas
 class OrderCreate(BaseModel):
     cart_id: int
 
+class OrderStatus(str, Enum):
+    # Lifecycle: pending -> paid -> shipped -> delivered; pending or paid orders can be cancelled
+    pending = "pending"
+    paid = "paid"
+    shipped = "shipped"
+    delivered = "delivered"
+    cancelled = "cancelled"
+
 class OrderStatusUpdate(BaseModel):
-    status: str
+    status: OrderStatus
+
+class OrderStatusBatchUpdate(BaseModel):
+    order_ids: List[int] = Field(..., min_length=1, max_length=ORDER_STATUS_BATCH_MAX_IDS)
+    from_status: OrderStatus # Only orders currently in this status are moved
+    to_status: OrderStatus
+
+class OrderStatusBatchResponse(BaseModel):
+    updated: List[int] # Orders moved to to_status
+    skipped: List[int] # Unknown ids, or orders no longer in from_status
 
 class OrderItemResponse(BaseModel):
     id: int
     product_id: int
     quantity: int
-    price_at_purchase: float
+    price_at_purchase: Money
     created_at: datetime
 
     class Config:
@@ -96,7 +143,7 @@ class OrderItemResponse(BaseModel):
 class OrderResponse(BaseModel):
     id: int
     user_id: int
-    total_amount: float
+    total_amount: Money
     status: str
     items: List[OrderItemResponse] = []
     created_at: datetime
@@ -105,6 +152,24 @@ class OrderResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class OrderExportFormat(str, Enum):
+    # GET /orders/export: NDJSON emits one object per order, CSV one row per order item
+    ndjson = "ndjson"
+    csv = "csv"
+
+class OrderSummaryResponse(BaseModel):
+    # Order header without its items, for GET /orders/?summary=true
+    id: int
+    user_id: int
+    total_amount: Money
+    status: str
+    item_count: int
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
 # Token Schema for Authentication
 class Token(BaseModel):
     access_token: str
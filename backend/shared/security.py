@@ -1,26 +1,103 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status # type: ignore
 from fastapi.security import OAuth2PasswordBearer # type: ignore
 from jose import JWTError, jwt # type: ignore
-from passlib.context import CryptContext # type: ignore
-from sqlalchemy.orm import Session # type: ignore
+from prometheus_client import Gauge, Histogram # type: ignore
+from sqlalchemy import event, inspect, select, func # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession # type: ignore
+from sqlalchemy.orm import Session, object_session # type: ignore
 
 # Import shared components
-from .config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
-from .database import get_db # This will be overridden per service
+from .cache import TTLCache
+from .config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, AUTH_CACHE_TTL_SECONDS, AUTH_CACHE_MAX_SIZE
+from .config import PASSWORD_HASH_EXECUTOR, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE
+from .database import get_session # Request-scoped session shared with the endpoint
 from .models import User # User model is needed for authentication
+from .notifications import PostgresListener
 
 # --- Security Setup ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token") # This URL will be relative to the service providing the token (User service)
 
+# Only the user service hashes passwords, so passlib is loaded on first use rather than at import
+_pwd_context = None
+
+def get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext # type: ignore
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+# --- Non-blocking password hashing ---
+# bcrypt deliberately burns tens of milliseconds of CPU per call, which would stall the event loop.
+# The async variants below run it in a bounded worker pool and shed load with a 503 when it is full.
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_duration_seconds",
+    "Time spent hashing or verifying a password, including time queued for a worker.",
+    ["operation"],
+)
+PASSWORD_HASH_QUEUE_DEPTH = Gauge(
+    "password_hash_queue_depth",
+    "Password hash operations currently queued or running in the worker pool.",
+    multiprocess_mode="livesum", # summed across gunicorn workers
+)
+
+_hash_executor: Optional[Executor] = None
+_hash_inflight = 0
+_hash_max_inflight = PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE
+
+def _get_hash_executor() -> Executor:
+    global _hash_executor
+    if _hash_executor is None:
+        if PASSWORD_HASH_EXECUTOR == "process":
+            _hash_executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        else:
+            # bcrypt releases the GIL, so threads already hash in parallel
+            _hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    return _hash_executor
+
+async def _run_password_op(operation: str, func, *args):
+    global _hash_inflight
+    if _hash_inflight >= _hash_max_inflight:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    _hash_inflight += 1
+    PASSWORD_HASH_QUEUE_DEPTH.inc()
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_hash_executor(), func, *args)
+    finally:
+        _hash_inflight -= 1
+        PASSWORD_HASH_QUEUE_DEPTH.dec()
+        PASSWORD_HASH_SECONDS.labels(operation=operation).observe(time.perf_counter() - start)
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return await _run_password_op("verify", verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password) -> str:
+    return await _run_password_op("hash", get_password_hash, password)
+
+def shutdown_password_hasher():
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False, cancel_futures=True)
+        _hash_executor = None
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -32,9 +109,80 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# This function expects a db session and will be used by all services
-# It relies on the User model to find the user from the token payload
-def get_current_user(token: str = Depends(oauth2_scheme), db_session: Session = Depends(get_db)):
+# --- Authenticated principal ---
+@dataclass(frozen=True)
+class UserPrincipal:
+    """
+    Immutable snapshot of the authenticated user.
+    Safe to cache across requests, unlike a User instance bound to a closed session.
+    Compatible with UserResponse (from_attributes=True).
+    """
+    id: int
+    username: str
+    email: str
+    created_at: Optional[datetime] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserPrincipal":
+        return cls(id=user.id, username=user.username, email=user.email, created_at=user.created_at)
+
+# username -> UserPrincipal; bounded LRU with TTL. Changes are evicted on commit in this process and,
+# through listen_for_principal_changes(), in every other process and service; the TTL only bounds
+# staleness when a notification is missed.
+principal_cache = TTLCache(maxsize=AUTH_CACHE_MAX_SIZE, ttl=AUTH_CACHE_TTL_SECONDS)
+
+PRINCIPAL_CHANGED_CHANNEL = "principal_changed"
+_ALL_PRINCIPALS = "*" # payload for bulk statements, which do not say which users they touched
+_PENDING_EVICTIONS = "pending_principal_evictions" # key in Session.info
+
+def invalidate_principal(username: str):
+    if username == _ALL_PRINCIPALS:
+        principal_cache.clear()
+    else:
+        principal_cache.pop(username)
+
+def _queue_principal_eviction(session: Session, connection, username: str):
+    # NOTIFY is delivered on commit and dropped on rollback; this process evicts in after_commit
+    connection.execute(select(func.pg_notify(PRINCIPAL_CHANGED_CHANNEL, username)))
+    session.info.setdefault(_PENDING_EVICTIONS, set()).add(username)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    # Evict both the current and any previous username
+    session = object_session(target)
+    for username in {target.username, *(inspect(target).attrs.username.history.deleted or ())}:
+        _queue_principal_eviction(session, connection, username)
+
+@event.listens_for(Session, "do_orm_execute")
+def _users_bulk_changed(orm_execute_state):
+    # update(User)/delete(User) statements bypass the mapper events above
+    mapper = orm_execute_state.bind_mapper
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and mapper is not None and mapper.class_ is User:
+        session = orm_execute_state.session
+        _queue_principal_eviction(session, session.connection(), _ALL_PRINCIPALS)
+
+@event.listens_for(Session, "after_commit")
+def _evict_committed_principals(session):
+    # Evicting at flush would let a concurrent cache miss re-cache the old row before the commit
+    for username in session.info.pop(_PENDING_EVICTIONS, ()):
+        invalidate_principal(username)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_principals(session):
+    session.info.pop(_PENDING_EVICTIONS, None)
+
+def listen_for_principal_changes(listener: PostgresListener):
+    """
+    Subscribes the process-wide principal cache to user changes committed by any service.
+    Every service that authenticates requests should call this before listener.start().
+    """
+    listener.add_handler(PRINCIPAL_CHANGED_CHANNEL, invalidate_principal)
+    listener.on_reconnect(principal_cache.clear) # Notifications may have been missed while disconnected
+
+# This dependency shares the request's AsyncSession and is used by all services.
+# The users-table lookup only happens on a principal cache miss.
+async def get_current_user(token: str = Depends(oauth2_scheme), db_session: AsyncSession = Depends(get_session)) -> UserPrincipal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -47,8 +195,16 @@ def get_current_user(token: str = Depends(oauth2_scheme), db_session: Session =
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+
+    principal = principal_cache.get(username)
+    if principal is not None:
+        return principal
+
     # Use the User model imported from shared.models
-    user = db_session.query(User).filter(User.username == username).first()
+    user_result = await db_session.execute(select(User).filter(User.username == username))
+    user = user_result.scalar_one_or_none()
     if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+        raise credentials_exception # Unknown users are not cached
+    principal = UserPrincipal.from_user(user)
+    principal_cache.set(username, principal)
+    return principal
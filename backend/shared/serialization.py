@@ -0,0 +1,37 @@
+from typing import Any, Mapping, Optional
+
+from fastapi import Response # type: ignore
+from fastapi.responses import ORJSONResponse # type: ignore
+from pydantic import TypeAdapter # type: ignore
+
+from . import config
+
+# --- Response serialization ---
+# FastAPI's default path validates the endpoint's return value against response_model, dumps it to
+# Python primitives and then JSON-encodes those. For 100-item pages that is three walks over the data.
+# json_response() validates once with a prebuilt TypeAdapter and lets pydantic-core write the JSON bytes
+# directly; both paths produce the same output. Apps use ORJSONResponse for everything else.
+
+DefaultResponse = ORJSONResponse # default_response_class for every service
+
+def json_response(
+    adapter: TypeAdapter,
+    data: Any,
+    status_code: int = 200,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    """
+    Encodes `data` (models, dicts, or column rows; attributes are read like from_attributes=True)
+    with `adapter` straight to JSON bytes.
+    """
+    validated = adapter.validate_python(data, from_attributes=True)
+    return Response(content=adapter.dump_json(validated), status_code=status_code, headers=headers, media_type="application/json")
+
+def render(adapter: TypeAdapter, data: Any, response: Response):
+    """
+    Return value for an endpoint whose response_model matches `adapter`. With FAST_SERIALIZATION it is an
+    encoded response carrying the headers already set on `response`; otherwise `data` itself, for FastAPI.
+    """
+    if config.FAST_SERIALIZATION:
+        return json_response(adapter, data, status_code=response.status_code or 200, headers=dict(response.headers))
+    return data
@@ -0,0 +1,132 @@
+import asyncio
+import random
+import re
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine # type: ignore
+
+from .config import SLOW_QUERY_THRESHOLD_MS, SLOW_QUERY_EXPLAIN_SAMPLE_RATE, SLOW_QUERY_LOG_SIZE
+
+# --- Slow-query log ---
+# Statements slower than SLOW_QUERY_THRESHOLD_MS are printed with literals and parameters redacted and
+# kept in a small ring buffer. A sample of slow SELECTs is explained on a separate connection in the
+# background, so the request that was slow is not made slower. EXPLAIN ANALYZE runs the statement, so
+# only plain reads get (ANALYZE, BUFFERS), inside a READ ONLY transaction that is always rolled back;
+# everything else gets a plain EXPLAIN, which plans the statement without running it.
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+_ROW_LOCK = re.compile(r"\bFOR\s+(UPDATE|SHARE|NO\s+KEY|KEY)\b", re.IGNORECASE)
+_CALL = re.compile(r'"?\b([a-z_][a-z0-9_$]*)"?\s*\(', re.IGNORECASE)
+# Words that can precede "(" in a plain SELECT without being a function call
+_SQL_KEYWORDS = frozenset({
+    "select", "from", "join", "on", "where", "and", "or", "not", "in", "exists", "any", "all", "some",
+    "as", "over", "filter", "within", "values", "lateral", "using", "by", "when", "then", "else",
+    "between", "like", "ilike", "is", "union", "intersect", "except", "with", "distinct", "having",
+    "limit", "offset", "row", "cast", "extract", "array",
+})
+# Built-in functions that only compute a value (no locks, writes or session state). A call to anything
+# else (pg_advisory_lock, set_config, nextval, pg_notify, a user-defined function, ...) disqualifies
+# the statement from EXPLAIN ANALYZE. The list errs short: a missing entry only costs the ANALYZE.
+_PURE_FUNCTIONS = frozenset({
+    "count", "sum", "min", "max", "avg", "array_agg", "string_agg", "json_agg", "jsonb_agg",
+    "coalesce", "nullif", "greatest", "least", "lower", "upper", "length", "abs", "round",
+    "now", "date_trunc", "unnest", "to_tsvector", "websearch_to_tsquery", "plainto_tsquery",
+    "to_tsquery", "ts_rank", "ts_rank_cd", "similarity", "word_similarity", "row_number", "generate_series",
+})
+
+def normalize_sql(statement: str) -> str:
+    """
+    Statement shape safe to log: whitespace folded, inline string and number literals replaced by '?'.
+    Bound parameters ($1, $2, ...) are never rendered by SQLAlchemy, so they stay placeholders.
+    """
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+def _explain_prefix(statement: str) -> Optional[str]:
+    """
+    EXPLAIN prefix for a sampled slow statement, or None when it is not explained (not a SELECT).
+    """
+    if not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    shape = normalize_sql(statement) # No string literals left to contain a "("
+    calls = {name.lower() for name in _CALL.findall(shape)}
+    if _ROW_LOCK.search(shape) or calls - _SQL_KEYWORDS - _PURE_FUNCTIONS:
+        return "EXPLAIN "
+    return "EXPLAIN (ANALYZE, BUFFERS) "
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: int, explain_sample_rate: float, size: int):
+        self.threshold_ms = threshold_ms
+        self.explain_sample_rate = explain_sample_rate
+        self._entries: deque = deque(maxlen=size)
+        self._explain_tasks: set = set() # Strong references until each EXPLAIN finishes
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def is_slow(self, duration: float) -> bool:
+        return self.enabled and duration * 1000 >= self.threshold_ms
+
+    def record(self, sync_engine, statement: str, parameters: Any, duration: float, route: Optional[str]):
+        """
+        Called from the cursor-execute hook for a statement that took longer than the threshold.
+        """
+        entry = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "route": route,
+            "duration_ms": round(duration * 1000, 1),
+            "statement": normalize_sql(statement),
+            "parameters": f"[{len(parameters) if parameters else 0} redacted]",
+            "explain": None,
+        }
+        self._entries.append(entry)
+        print(
+            f"Slow query ({entry['duration_ms']} ms) in {route or '<no request>'}: "
+            f"{entry['statement'][:1000]} {entry['parameters']}"
+        )
+
+        if self.explain_sample_rate <= 0 or random.random() >= self.explain_sample_rate:
+            return
+        prefix = _explain_prefix(statement)
+        if prefix is not None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return # Not on an event loop (e.g. a sync script); skip the sample
+            task = loop.create_task(self._explain(sync_engine, prefix + statement, parameters, entry))
+            self._explain_tasks.add(task)
+            task.add_done_callback(self._explain_tasks.discard)
+
+    async def _explain(self, sync_engine, explain: str, parameters: Any, entry: Dict):
+        options = {"slow_query_explain": True}
+        try:
+            async with AsyncEngine(sync_engine).connect() as conn:
+                # A READ ONLY transaction that is always rolled back; the plan uses the original parameters
+                transaction = await conn.begin()
+                try:
+                    await conn.exec_driver_sql("SET TRANSACTION READ ONLY", execution_options=options)
+                    result = await conn.exec_driver_sql(explain, tuple(parameters) if parameters else (), execution_options=options)
+                    entry["explain"] = "\n".join(row[0] for row in result)
+                finally:
+                    await transaction.rollback()
+        except Exception as e:
+            entry["explain"] = f"EXPLAIN failed: {e}"
+
+    def entries(self) -> List[Dict]:
+        return list(reversed(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+
+slow_query_log = SlowQueryLog(
+    threshold_ms=SLOW_QUERY_THRESHOLD_MS,
+    explain_sample_rate=SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+    size=SLOW_QUERY_LOG_SIZE,
+)
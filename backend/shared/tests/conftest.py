@@ -0,0 +1,25 @@
+import pytest # type: ignore
+import pytest_asyncio # type: ignore
+from sqlalchemy.pool import NullPool # type: ignore
+
+from shared.config import DATABASE_URL
+from shared.database import build_engine, get_session_local
+
+# Tests for the shared modules. They run once (pytest shared/tests) rather than in every service's suite.
+# Shared engine settings; NullPool because each test runs on its own event loop
+_engine = build_engine(DATABASE_URL, poolclass=NullPool)
+_SessionLocal = get_session_local(_engine)
+
+@pytest.fixture
+def engine():
+    return _engine
+
+@pytest.fixture
+def session_factory():
+    return _SessionLocal
+
+@pytest_asyncio.fixture(scope="function")
+async def db_session():
+    async with _SessionLocal() as session:
+        yield session
+        await session.rollback()
@@ -0,0 +1,35 @@
+import time
+
+from shared.database import ReplicaRouter, backoff_delay, worker_pool_limits
+
+def test_backoff_delay_is_jittered_and_capped():
+    for attempt in range(20):
+        delay = backoff_delay(attempt, base=0.1, cap=5)
+        assert 0 <= delay <= min(5, 0.1 * 2 ** attempt)
+
+def test_worker_pool_limits_split_connection_budget():
+    assert worker_pool_limits(0, 4, 5, 10) == (5, 10) # no budget: configured sizes per worker
+    assert worker_pool_limits(40, 4, 5, 10) == (5, 5)
+    assert worker_pool_limits(8, 4, 5, 10) == (2, 0)
+    assert worker_pool_limits(2, 4, 5, 10) == (1, 0) # every worker keeps at least one connection
+
+def test_replica_router_prefers_least_busy_current_replica():
+    replica_a, replica_b = "postgresql+asyncpg://app@replica-a/ecommerce", "postgresql+asyncpg://app@replica-b/ecommerce"
+    router = ReplicaRouter([replica_a, replica_b], max_lag=2, read_your_writes_seconds=10)
+    assert router.choose() is None # Lag not measured yet: primary
+
+    router.lag.update({replica_a: 0.1, replica_b: 0.5})
+    assert {router.choose(), router.choose()} == {replica_a, replica_b} # Ties alternate
+    router.in_use[replica_a] = 3
+    assert router.choose() == replica_b
+
+    router.lag[replica_b] = 30 # Too far behind
+    assert router.choose() == replica_a
+    router.lag[replica_a] = None # Unreachable
+    assert router.choose() is None
+
+    router.lag.update({replica_a: 0, replica_b: 0})
+    router.record_write("writer")
+    assert router.choose("writer") is None # Read-your-writes
+    assert router.choose("someone-else") is not None
+    assert router.choose(primary_until=time.time() + 5) is None # Cookie from a write to another service
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest # type: ignore
+import pytest_asyncio # type: ignore
+from fastapi import FastAPI # type: ignore
+from httpx import AsyncClient # type: ignore
+
+from shared import debug
+
+app = FastAPI()
+app.include_router(debug.debug_router)
+
+@pytest_asyncio.fixture(scope="function")
+async def client():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        yield ac
+
+@pytest.mark.asyncio
+async def test_debug_endpoints_require_token(client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(debug, "DEBUG_ENDPOINTS_TOKEN", "")
+    assert (await client.get("/debug/slow-queries")).status_code == 404 # Disabled without a token
+
+    monkeypatch.setattr(debug, "DEBUG_ENDPOINTS_TOKEN", "s3cret")
+    assert (await client.get("/debug/slow-queries")).status_code == 403
+    assert (await client.get("/debug/slow-queries", headers={"X-Debug-Token": "wrong"})).status_code == 403
+    response = await client.get("/debug/slow-queries", headers={"X-Debug-Token": "s3cret"})
+    assert response.status_code == 200
+    assert "queries" in response.json()
+
+@pytest.mark.asyncio
+async def test_debug_profile_modes_and_single_run_guard(client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(debug, "DEBUG_ENDPOINTS_TOKEN", "s3cret")
+    headers = {"X-Debug-Token": "s3cret"}
+
+    sampled = await client.get("/debug/profile", params={"seconds": 0.3}, headers=headers)
+    assert sampled.status_code == 200
+    line = sampled.text.splitlines()[0]
+    stack, count = line.rsplit(" ", 1)
+    assert ";" in stack and int(count) >= 1
+
+    first, second = await asyncio.gather(
+        client.get("/debug/profile", params={"seconds": 0.3, "mode": "cprofile"}, headers=headers),
+        client.get("/debug/profile", params={"seconds": 0.3}, headers=headers),
+    )
+    assert first.status_code == 200
+    assert "function calls" in first.text
+    assert second.status_code == 409
@@ -0,0 +1,34 @@
+import pytest # type: ignore
+
+import shared.health as health
+from shared.config import DATABASE_URL
+from shared.database import build_engine
+
+@pytest.mark.asyncio
+async def test_warm_up_retries_until_it_succeeds(monkeypatch):
+    monkeypatch.setattr(health, "backoff_delay", lambda attempt: 0)
+    attempts = []
+
+    async def flaky_warm_up():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionRefusedError("database not up yet")
+
+    health.start_warm_up(flaky_warm_up)
+    await health.readiness._task
+    assert len(attempts) == 3
+    assert health.readiness.ready
+    await health.stop_warm_up()
+    assert not health.readiness.ready
+
+@pytest.mark.asyncio
+async def test_pool_exhausted_once_every_connection_is_checked_out(monkeypatch):
+    monkeypatch.setattr(health, "WORKER_MAX_OVERFLOW", 0)
+    engine = build_engine(DATABASE_URL, pool_size=1, max_overflow=0)
+    try:
+        assert not health._pool_exhausted(engine)
+        async with engine.connect():
+            assert health._pool_exhausted(engine)
+        assert not health._pool_exhausted(engine)
+    finally:
+        await engine.dispose()
@@ -0,0 +1,9 @@
+import pytest # type: ignore
+
+import shared.migrate as migrate
+
+@pytest.mark.asyncio
+async def test_check_schema_version_rejects_unmigrated_database(engine, monkeypatch):
+    monkeypatch.setattr(migrate, "head_revision", lambda: "9999_not_applied")
+    with pytest.raises(migrate.SchemaVersionError):
+        await migrate.check_schema_version(engine)
@@ -0,0 +1,49 @@
+from uuid import uuid4
+
+import pytest # type: ignore
+from prometheus_client import REGISTRY # type: ignore
+from sqlalchemy import delete # type: ignore
+
+from shared.models import OutboxConsumerOffset
+from shared.outbox import OutboxConsumer, publish_events
+
+@pytest.mark.asyncio
+async def test_outbox_consumer_delivers_at_least_once_in_commit_order(session_factory):
+    consumer_name = f"test-{uuid4().hex[:8]}"
+    marker = uuid4().hex
+    delivered = []
+    fail_next = [True]
+
+    async def handler(db, message):
+        if message.payload.get("marker") != marker:
+            return # Events left by other tests
+        if fail_next[0]:
+            fail_next[0] = False
+            raise RuntimeError("downstream unavailable")
+        delivered.append(message.aggregate_id)
+
+    consumer = OutboxConsumer(consumer_name, handler, batch_size=1000)
+    async with session_factory() as writer, session_factory() as slow_writer, session_factory() as db:
+        await consumer._ensure_offset(db)
+        while await consumer.deliver_batch(db): # Catch up with history
+            pass
+
+        # Event 1 gets the lower id but commits last; it must not be skipped
+        await publish_events(slow_writer, [{"event_type": "test", "aggregate_type": "test", "aggregate_id": 1, "payload": {"marker": marker}}])
+        await publish_events(writer, [{"event_type": "test", "aggregate_type": "test", "aggregate_id": 2, "payload": {"marker": marker}}])
+        await writer.commit()
+        await consumer.deliver_batch(db) # Held back while slow_writer's transaction is open
+        assert delivered == []
+
+        await slow_writer.commit()
+        with pytest.raises(RuntimeError):
+            await consumer.deliver_batch(db) # Handler fails: the batch rolls back, the offset stays
+        await db.rollback()
+        assert await consumer.deliver_batch(db) >= 2
+        assert delivered == [1, 2]
+
+        assert await consumer.deliver_batch(db) == 0 # Nothing is delivered twice once the offset has committed
+        assert REGISTRY.get_sample_value("outbox_consumer_lag_events", {"consumer": consumer_name}) == 0
+
+        await db.execute(delete(OutboxConsumerOffset).where(OutboxConsumerOffset.consumer == consumer_name))
+        await db.commit()
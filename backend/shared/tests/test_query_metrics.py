@@ -0,0 +1,45 @@
+import random
+
+import pytest # type: ignore
+from fastapi import FastAPI # type: ignore
+from httpx import AsyncClient # type: ignore
+from prometheus_client import REGISTRY # type: ignore
+from sqlalchemy import select, text # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession # type: ignore
+
+from shared.models import Product
+from shared.query_metrics import install_query_metrics, track_queries
+
+@pytest.mark.asyncio
+async def test_query_metrics_count_statements_per_route(session_factory):
+    app = FastAPI()
+    install_query_metrics(app)
+
+    @app.get("/products/{product_id}")
+    async def read_twice(product_id: int):
+        async with session_factory() as db:
+            await db.execute(select(Product.id).where(Product.id == product_id))
+            await db.execute(select(Product.name).where(Product.id == product_id))
+        return {}
+
+    labels = {"method": "GET", "route": "/products/{product_id}"} # The route template, not the raw path
+    before = REGISTRY.get_sample_value("db_queries_per_request_count", labels) or 0
+    before_sum = REGISTRY.get_sample_value("db_queries_per_request_sum", labels) or 0
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/products/1")
+    assert response.status_code == 200
+    assert REGISTRY.get_sample_value("db_queries_per_request_count", labels) == before + 1
+    assert REGISTRY.get_sample_value("db_queries_per_request_sum", labels) >= before_sum + 2
+
+@pytest.mark.asyncio
+async def test_track_queries_reports_repeated_statements(db_session: AsyncSession):
+    with track_queries() as stats:
+        for _ in range(4):
+            await db_session.execute(select(Product.id).where(Product.id == random.randint(1, 1000)))
+        await db_session.execute(text("SELECT 1"))
+    assert stats.count == 5
+    assert stats.duration > 0
+    repeated = stats.repeated(threshold=3)
+    assert len(repeated) == 1 and repeated[0][1] == 4
+    assert "FROM products" in repeated[0][0]
@@ -0,0 +1,57 @@
+import asyncio
+import random
+
+import pytest # type: ignore
+from sqlalchemy import text # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession # type: ignore
+
+from shared.slow_queries import slow_query_log, _explain_prefix
+
+async def _wait_for_explain(entry):
+    for _ in range(50): # The EXPLAIN runs in the background on its own connection
+        if entry["explain"] is not None:
+            return entry["explain"]
+        await asyncio.sleep(0.05)
+    return entry["explain"]
+
+@pytest.mark.asyncio
+async def test_slow_queries_logged_redacted_and_explained(db_session: AsyncSession, monkeypatch):
+    monkeypatch.setattr(slow_query_log, "threshold_ms", 1)
+    monkeypatch.setattr(slow_query_log, "explain_sample_rate", 1.0)
+    slow_query_log.clear()
+
+    await db_session.execute(text("SELECT count(*), 'card-4242' AS secret FROM generate_series(1, 300000)"))
+    entry = slow_query_log.entries()[0]
+    assert entry["duration_ms"] >= 1
+    assert "card-4242" not in entry["statement"] and "300000" not in entry["statement"]
+    assert entry["statement"] == "SELECT count(*), ? AS secret FROM generate_series(?, ?)"
+
+    assert "actual time" in await _wait_for_explain(entry)
+    assert len(slow_query_log.entries()) == 1 # The EXPLAIN itself is not logged as a slow query
+    slow_query_log.clear()
+
+def test_only_plain_reads_are_explain_analyzed():
+    assert _explain_prefix("SELECT products.id FROM products WHERE lower(products.name) = $1") == "EXPLAIN (ANALYZE, BUFFERS) "
+    assert _explain_prefix("SELECT pg_advisory_lock($1)") == "EXPLAIN "
+    assert _explain_prefix("SELECT set_config('app.user', $1, false)") == "EXPLAIN "
+    assert _explain_prefix("SELECT nextval('orders_id_seq')") == "EXPLAIN "
+    assert _explain_prefix("SELECT carts.id FROM carts FOR UPDATE") == "EXPLAIN "
+    assert _explain_prefix("UPDATE products SET stock_quantity = $1") is None
+
+@pytest.mark.asyncio
+async def test_side_effecting_slow_queries_are_not_rerun(db_session: AsyncSession, monkeypatch):
+    monkeypatch.setattr(slow_query_log, "threshold_ms", 1)
+    monkeypatch.setattr(slow_query_log, "explain_sample_rate", 1.0)
+    slow_query_log.clear()
+    key = random.randint(1, 2**31)
+
+    await db_session.execute(text("SELECT pg_advisory_xact_lock(:key), pg_sleep(0.01)"), {"key": key})
+    explain = await _wait_for_explain(slow_query_log.entries()[0])
+    assert explain.startswith("Result") and "actual time" not in explain # Planned, never run
+
+    # Only this session holds the lock; the sample did not take it on a pooled connection
+    holders = await db_session.scalar(text(
+        "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND objid = :key AND pid <> pg_backend_pid()"
+    ), {"key": key})
+    assert holders == 0
+    slow_query_log.clear()
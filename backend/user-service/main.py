@@ -6,46 +6,70 @@ from datetime import timedelta
 from prometheus_fastapi_instrumentator import Instrumentator # type: ignore
 
 # Import shared components
-from shared.database import get_db, Base, get_engine # get_db and get_engine are now async
+from shared.database import get_session, get_engine, dispose_engines # get_session and get_engine are now async
+from shared.migrate import check_schema_version
+from shared.query_metrics import install_query_metrics
+from shared.serialization import DefaultResponse
+from shared.debug import debug_router
+from shared.health import health_router, start_warm_up, stop_warm_up
 from shared.models import User, Cart # Cart is needed for creating a cart on user registration
 from shared.schemas import UserCreate, UserResponse, Token
-from shared.security import verify_password, get_password_hash, create_access_token, get_current_user # get_current_user might also need async updates depending on its implementation
+from shared.security import verify_password_async, get_password_hash_async, shutdown_password_hasher, create_access_token, get_current_user, UserPrincipal, listen_for_principal_changes
+from shared.notifications import PostgresListener
 from shared.config import ACCESS_TOKEN_EXPIRE_MINUTES, DATABASE_URL
 
 app = FastAPI(
     title="User Service",
     description="Handles user registration and authentication.",
     version="1.0.0",
-    root_path="/users" # This is important for the Nginx proxy routing
+    root_path="/users", # This is important for the Nginx proxy routing
+    default_response_class=DefaultResponse, # orjson encoding
 )
 
 # --- PROMETHEUS INSTRUMENTATION START ---
 # Initialize Prometheus instrumentation on startup
 # This automatically exposes the /metrics endpoint
 Instrumentator().instrument(app).expose(app)
+install_query_metrics(app) # Per-route SQL statement counts and DB time, plus N+1 warnings
 print("Prometheus metrics exposed at /metrics")
 # --- PROMETHEUS INSTRUMENTATION END ---
 
+# Operator-only /debug endpoints (slow queries, profiler); disabled unless DEBUG_ENDPOINTS_TOKEN is set
+app.include_router(debug_router)
+
+# Liveness (/health) and readiness (/ready) probes
+app.include_router(health_router)
+
+# Dedicated LISTEN connection that evicts cached principals when any service changes a user
+notification_listener = PostgresListener(DATABASE_URL)
+listen_for_principal_changes(notification_listener)
+
 # Custom dependency for the user service's asynchronous database connection
-async def get_user_db():
-    # Await the asynchronous get_db from shared.database
-    async for session in get_db(DATABASE_URL):
-        yield session
+async def get_user_db(session: AsyncSession = Depends(get_session)):
+    # Same request-scoped session that get_current_user resolves, so a request uses one pooled connection
+    yield session
 
 @app.on_event("startup") # Deprecated, but keeping for now as it's in your original structure
 async def startup_event():
+    # The listener reconnects on its own, so it starts straight away
+    notification_listener.start()
+    # Connect and check the schema in the background; /ready reports 200 once this has succeeded
+    start_warm_up(warm_up)
+
+async def warm_up():
     # Ensure the engine is created asynchronously
     engine = await get_engine(DATABASE_URL)
-    # This creates tables if they don't exist.
-    # In a production setup, use Alembic for migrations.
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all) # Run synchronous create_all within async context
-    print("User service database tables checked/created.")
+    # The schema is owned by the migrations (python -m shared.migrate); only check it is current
+    await check_schema_version(engine)
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_warm_up() # Report not ready first so traffic drains away
+    await notification_listener.stop()
+    # Release the shared connection pool so Postgres sees clean disconnects
+    await dispose_engines()
+    shutdown_password_hasher()
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
 
 @app.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register_user(
@@ -64,7 +88,7 @@ async def register_user(
     if db_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password) # bcrypt runs in the worker pool
     new_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
     db.add(new_user)
     await db.commit() # Await commit
@@ -87,7 +111,7 @@ async def login_for_access_token(
     user_result = await db.execute(select(User).filter(User.username == form_data.username))
     user = user_result.scalar_one_or_none()
 
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -101,10 +125,8 @@ async def login_for_access_token(
 
 @app.get("/me", response_model=UserResponse)
 async def read_users_me(
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
     db: AsyncSession = Depends(get_user_db) # Type hint with AsyncSession
 ):
-    # get_current_user typically fetches the user based on the token.
-    # Its implementation in shared/security.py should also be updated to be async
-    # and use AsyncSession if it performs DB lookups.
+    # get_current_user resolves the token to a cached principal, sharing this request's session on a miss.
     return current_user
\ No newline at end of file
@@ -1,17 +1,26 @@
+import asyncio
+
 import pytest  # type: ignore
 import pytest_asyncio  # type: ignore
 from httpx import AsyncClient  # type: ignore
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker  # type: ignore
-from sqlalchemy import select  # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession  # type: ignore
+from sqlalchemy import select, update  # type: ignore
+from sqlalchemy.pool import NullPool  # type: ignore
 from uuid import uuid4
 
 from shared.config import DATABASE_URL
+from shared.database import build_engine, get_session_local, get_session
 from shared.models import User
-from shared.security import get_current_user, verify_password
-from main import app, get_db
+import shared.security as security
+import shared.health as health
+from shared.notifications import PostgresListener
+from shared.security import get_current_user, verify_password, create_access_token, principal_cache
+from shared.security import UserPrincipal, PRINCIPAL_CHANGED_CHANNEL, listen_for_principal_changes
+from main import app, get_user_db
 
-engine = create_async_engine(DATABASE_URL, echo=False)
-SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+# Shared engine settings; NullPool because each test runs on its own event loop
+engine = build_engine(DATABASE_URL, poolclass=NullPool)
+SessionLocal = get_session_local(engine)
 
 
 @pytest_asyncio.fixture(scope="function")
@@ -26,7 +35,8 @@ async def client(db_session: AsyncSession):
     async def override_get_db():
         yield db_session
 
-    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_user_db] = override_get_db
+    app.dependency_overrides[get_session] = override_get_db  # Session used by get_current_user
 
     async with AsyncClient(app=app, base_url="http://test") as ac:
         yield ac
@@ -70,3 +80,106 @@ async def test_create_user(client: AsyncClient, db_session: AsyncSession):
     assert user_in_db is not None
     assert user_in_db.username == user_data["username"]
     assert verify_password(user_data["password"], user_in_db.hashed_password)
+
+
+@pytest.mark.asyncio
+async def test_read_users_me_caches_principal(client: AsyncClient, db_session: AsyncSession):
+    unique_suffix = uuid4().hex[:8]
+    user = User(username=f"me_{unique_suffix}", email=f"me_{unique_suffix}@example.com", hashed_password="mocked_hash")
+    db_session.add(user)
+    await db_session.commit()
+    await db_session.refresh(user)
+    headers = {"Authorization": f"Bearer {create_access_token(data={'sub': user.username})}"}
+
+    response = await client.get("/users/me", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["id"] == user.id
+    assert principal_cache.get(user.username).id == user.id
+
+    # A change that is flushed and rolled back keeps the cached principal
+    username = user.username
+    user.email = f"rolled_back_{unique_suffix}@example.com"
+    await db_session.flush()
+    assert principal_cache.get(username) is not None
+    await db_session.rollback()
+    assert principal_cache.get(username) is not None
+
+    # A committed change drops it, but not before the commit
+    await db_session.refresh(user)
+    user.email = f"changed_{unique_suffix}@example.com"
+    await db_session.flush()
+    assert principal_cache.get(username) is not None
+    await db_session.commit()
+    assert principal_cache.get(username) is None
+
+    response = await client.get("/users/me", headers=headers)
+    assert response.json()["email"] == f"changed_{unique_suffix}@example.com"
+
+    # Bulk statements do not say which users changed, so they drop every principal
+    await db_session.execute(update(User).where(User.id == user.id).values(email=f"bulk_{unique_suffix}@example.com"))
+    assert principal_cache.get(username) is not None
+    await db_session.commit()
+    assert principal_cache.get(username) is None
+
+@pytest.mark.asyncio
+async def test_principal_changes_are_broadcast_on_commit(db_session: AsyncSession):
+    unique_suffix = uuid4().hex[:8]
+    user = User(username=f"bcast_{unique_suffix}", email=f"bcast_{unique_suffix}@example.com", hashed_password="mocked_hash")
+    db_session.add(user)
+    await db_session.commit()
+    username = user.username
+
+    # Other processes and services hear about the change through their own listener
+    received = []
+    listener = PostgresListener(DATABASE_URL)
+    listen_for_principal_changes(listener)
+    listener.add_handler(PRINCIPAL_CHANGED_CHANNEL, received.append)
+    listener.start()
+    try:
+        await asyncio.wait_for(listener.connected.wait(), timeout=5)
+        user.email = f"moved_{unique_suffix}@example.com"
+        await db_session.commit()
+        for _ in range(50):
+            if username in received:
+                break
+            await asyncio.sleep(0.05)
+        assert username in received
+
+        # A reconnect may have missed notifications, so everything is dropped
+        principal_cache.set(username, UserPrincipal(id=user.id, username=username, email="stale@example.com"))
+        for callback in listener._reconnect_callbacks:
+            callback()
+        assert principal_cache.get(username) is None
+    finally:
+        await listener.stop()
+
+
+@pytest.mark.asyncio
+async def test_register_returns_503_when_hash_pool_is_full(client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(security, "_hash_max_inflight", 0)
+    unique_suffix = uuid4().hex[:8]
+    user_data = {"username": f"busy_{unique_suffix}", "email": f"busy_{unique_suffix}@example.com", "password": "securepassword"}
+
+    response = await client.post("/users/register", json=user_data)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+@pytest.mark.asyncio
+async def test_health_is_liveness_and_ready_waits_for_startup(client: AsyncClient):
+    app.dependency_overrides[health.get_readiness_engine] = lambda: engine
+    health.readiness.mark_not_ready("starting")
+
+    response = await client.get("/users/health")
+    assert response.status_code == 200
+    assert response.json() == {"status": "healthy"}
+    response = await client.get("/users/ready")
+    assert response.status_code == 503
+    assert response.json()["reason"] == "starting"
+
+    health.readiness.mark_ready()
+    try:
+        response = await client.get("/users/ready")
+        assert response.status_code == 200
+        assert response.json() == {"status": "ready"}
+    finally:
+        health.readiness.mark_not_ready("starting")
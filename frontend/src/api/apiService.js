@@ -98,11 +98,14 @@ export const removeCartItemApi = async (token, productId) => {
 };
 
 // --- Order API Calls ---
-export const fetchOrdersApi = async (token) => {
-  const response = await fetch(`${API_BASE_URL}/orders`, {
+// Order history is paginated: pass the nextCursor of one page to fetch the next (null when there are no more).
+export const fetchOrdersApi = async (token, cursor = null) => {
+  const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+  const response = await fetch(`${API_BASE_URL}/orders${query}`, {
     headers: getHeaders(token),
   });
-  return handleResponse(response);
+  const orders = await handleResponse(response);
+  return { orders, nextCursor: response.headers.get('X-Next-Cursor') };
 };
 
 export const createOrderApi = async (token) => {
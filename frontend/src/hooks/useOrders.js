@@ -4,19 +4,22 @@ import useAppMessages from './useAppMessages';
 
 const useOrders = (token) => {
   const [orders, setOrders] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null); // Cursor for the next (older) page of orders
   const [ordersLoading, setOrdersLoading] = useState(false);
   const { handleError, handleSuccess, clearMessages } = useAppMessages();
 
   const fetchOrders = useCallback(async () => {
     if (!token) {
       setOrders([]);
+      setNextCursor(null);
       return;
     }
     setOrdersLoading(true);
     clearMessages();
     try {
-      const data = await fetchOrdersApi(token);
-      setOrders(data);
+      const page = await fetchOrdersApi(token);
+      setOrders(page.orders);
+      setNextCursor(page.nextCursor);
     } catch (err) {
       handleError(err);
     } finally {
@@ -24,6 +27,21 @@ const useOrders = (token) => {
     }
   }, [token, handleError, clearMessages]);
 
+  const loadMoreOrders = useCallback(async () => {
+    if (!token || !nextCursor) return;
+    setOrdersLoading(true);
+    clearMessages();
+    try {
+      const page = await fetchOrdersApi(token, nextCursor);
+      setOrders((previous) => [...previous, ...page.orders]);
+      setNextCursor(page.nextCursor);
+    } catch (err) {
+      handleError(err);
+    } finally {
+      setOrdersLoading(false);
+    }
+  }, [token, nextCursor, handleError, clearMessages]);
+
   const handleCreateOrder = useCallback(async (cartItemsCount) => {
     if (!token) {
       handleError({ message: "Please log in to create an order." });
@@ -53,7 +71,7 @@ const useOrders = (token) => {
     fetchOrders();
   }, [fetchOrders]);
 
-  return { orders, ordersLoading, fetchOrders, handleCreateOrder };
+  return { orders, ordersLoading, fetchOrders, handleCreateOrder, hasMoreOrders: nextCursor !== null, loadMoreOrders };
 };
 
 export default useOrders;
\ No newline at end of file
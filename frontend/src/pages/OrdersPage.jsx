@@ -6,13 +6,24 @@ import useProducts from '../hooks/useProducts'; // To get product names for orde
 
 const OrdersPage = () => {
   const { token } = useAuth();
-  const { orders, ordersLoading } = useOrders(token);
+  const { orders, ordersLoading, hasMoreOrders, loadMoreOrders } = useOrders(token);
   const { products } = useProducts(); // Get all products to display details in orders
 
   return (
     <div className="mt-8">
       <h2 className="text-3xl font-bold mb-6 text-gray-800 text-center">Your Orders</h2>
       <OrderList orders={orders} productsList={products} loading={ordersLoading} />
+      {hasMoreOrders && (
+        <div className="mt-6 text-center">
+          <button
+            onClick={loadMoreOrders}
+            className="bg-blue-500 hover:bg-blue-600 text-white font-bold py-2 px-4 rounded-md transition duration-300 disabled:opacity-50 disabled:cursor-not-allowed"
+            disabled={ordersLoading}
+          >
+            {ordersLoading ? 'Loading...' : 'Load older orders'}
+          </button>
+        </div>
+      )}
     </div>
   );
 };
@@ -51,8 +51,8 @@ for service_name in "${SERVICE_NAMES[@]}"; do
     echo "Running tests for service: ${service_name} (from directory ${service_dir})"
     echo "========================================="
 
-    # Execute pytest inside the running Docker container for the service
-    docker compose exec "$service_name" pytest
+    # Execute pytest inside the running Docker container for the service (its own tests only)
+    docker compose exec "$service_name" pytest tests
 
     # Check the exit code of the docker-compose exec command
     if [ $? -ne 0 ]; then
@@ -65,6 +65,19 @@ for service_name in "${SERVICE_NAMES[@]}"; do
     index=$((index+1))
 done
 
+# Tests for the shared modules (backend/shared/tests) run once; every image ships the same shared package
+echo "========================================="
+echo "Running tests for shared modules (in product-service)"
+echo "========================================="
+docker compose exec product-service pytest shared/tests
+if [ $? -ne 0 ]; then
+    echo "Tests FAILED for shared modules"
+    TEST_SUCCESS=false
+else
+    echo "Tests PASSED for shared modules"
+fi
+echo ""
+
 echo "--- Test Run Complete ---"
 
 # --- Clean up after tests ---